@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Résumés IA par segment
+=================================================
+
+Génère un résumé par pays et par type d'huile (ou tout autre niveau) en
+un seul lot : les prompts sont construits depuis des agrégats annuels
+calculés par le moteur de stockage, les prompts identiques ne sont
+envoyés qu'une fois, les appels partent en parallèle (concurrence bornée,
+reprises avec backoff exponentiel) et les résumés sont enregistrés dans
+analysis_history.
+
+Usage : python ai_batch.py [--by country type] [--concurrency 4] [--mock]
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from instrumentation import track
+
+# One summary per country and one per oil type
+DEFAULT_LEVELS = (('country',), ('type',))
+ANALYSIS_TYPE = "segment_summary"
+LEVEL_LABELS = {'country': "pays", 'year': "année", 'type': "type"}
+
+def build_prompt(level, segment, yearly):
+    """Compact prompt of one segment: a yearly table instead of raw rows"""
+    label = ", ".join(f"{LEVEL_LABELS[column]} = {value}" for column, value in zip(level, segment))
+    lines = [f"{int(row.year)};{row.sales:.0f};{row.volume:.0f};{row.price:.2f}" for row in yearly.itertuples()]
+    return (
+        f"Résume en français, en trois phrases, les ventes d'huile d'olive du segment {label}.\n"
+        "Année;Ventes (EUR);Volume (L);Prix moyen (EUR/L)\n"
+        + "\n".join(lines)
+        + "\nIndique la tendance, l'évolution du prix et une recommandation."
+    )
+
+def segment_prompts(database, levels=DEFAULT_LEVELS, filters=None):
+    """One (level, segment, prompt) per segment of every level, one engine query per level"""
+    prompts = []
+    for level in levels:
+        level = list(level)
+        yearly = database.aggregate(level + ['year'], {'sales': 'sum', 'volume': 'sum', 'price': 'mean'}, filters)
+        for segment, rows in yearly.groupby(level, sort=True):
+            prompts.append((tuple(level), segment, build_prompt(level, segment, rows)))
+    return prompts
+
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+class TransientModelError(Exception):
+    """A failure worth retrying (rate limit, timeout, unavailable service)"""
+
+class GeminiModel:
+    """Adapter exposing generate(prompt) -> text over a google.generativeai model"""
+
+    def __init__(self, model):
+        self.model = model
+
+    def generate(self, prompt):
+        with track("ai.gemini") as info:
+            response = self.model.generate_content(prompt)
+            info['bytes'] = len(response.text.encode('utf-8'))
+        return response.text
+
+class MockModel:
+    """Local stand-in for Gemini: fixed latency, optional random transient failures
+
+    Answers are derived from the prompt, so identical prompts get identical
+    summaries. Thread-safe; records the number of calls and the peak number
+    of concurrent calls.
+    """
+
+    def __init__(self, latency=0.05, failure_rate=0.0, seed=42):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self.active = 0
+        self.peak_concurrency = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.peak_concurrency = max(self.peak_concurrency, self.active)
+            fail = self._rng.random() < self.failure_rate
+        try:
+            time.sleep(self.latency)
+            if fail:
+                raise TransientModelError("429 Resource exhausted (simulé)")
+            first_line = prompt.splitlines()[0]
+            return f"Résumé simulé ({prompt_hash(prompt)[:8]}) : {first_line}"
+        finally:
+            with self._lock:
+                self.active -= 1
+
+class BatchSummarizer:
+    """Fans segment prompts out to a model with bounded concurrency and retries
+
+    Identical prompts are sent once per batch and answers are memoized by
+    prompt hash for the life of the summarizer, oldest first out when the
+    memory governor calls shrink(). Only TransientModelError
+    (and errors named like rate limits or timeouts) are retried.
+    """
+
+    RETRYABLE_NAMES = ('ResourceExhausted', 'ServiceUnavailable', 'DeadlineExceeded', 'TooManyRequests')
+
+    def __init__(self, model, max_concurrency=4, retries=3, backoff=0.5, database=None):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.database = database
+        self.nbytes = 0
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def _retryable(self, error):
+        return isinstance(error, TransientModelError) or type(error).__name__ in self.RETRYABLE_NAMES
+
+    def _generate(self, prompt):
+        """(text, attempts, error) for one prompt"""
+        for attempt in range(1, self.retries + 2):
+            try:
+                return self.model.generate(prompt), attempt, None
+            except Exception as e:
+                if attempt > self.retries or not self._retryable(e):
+                    return None, attempt, str(e)
+                # Exponential backoff with full jitter
+                time.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+    def summarize(self, prompts):
+        """Summaries of (level, segment, prompt) triples as a DataFrame, in input order"""
+        hashes = [prompt_hash(prompt) for _, _, prompt in prompts]
+        # Read once: a shrink meanwhile does not lose the answers of this call
+        with self._lock:
+            known = {digest: self._memo[digest] for digest in hashes if digest in self._memo}
+        unique = {}
+        for digest, (_, _, prompt) in zip(hashes, prompts):
+            if digest not in known:
+                unique.setdefault(digest, prompt)
+
+        with track("ai.batch_summaries") as info:
+            info['rows'] = len(unique)
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+                answers = dict(zip(unique, pool.map(self._generate, unique.values())))
+        with self._lock:
+            for digest, (text, _, error) in answers.items():
+                if error is None and digest not in self._memo:
+                    self._memo[digest] = text
+                    self.nbytes += sys.getsizeof(digest) + sys.getsizeof(text)
+
+        rows = []
+        for digest, (level, segment, _) in zip(hashes, prompts):
+            text, attempts, error = answers.get(digest, (known.get(digest), 0, None))
+            rows.append({
+                'level': " × ".join(level),
+                'segment': " × ".join(map(str, segment)),
+                'filters': {column: value.item() if hasattr(value, 'item') else value
+                            for column, value in zip(level, segment)},
+                'summary': text,
+                'prompt_hash': digest,
+                'attempts': attempts,
+                'error': error,
+            })
+        result = pd.DataFrame(rows, columns=['level', 'segment', 'filters', 'summary', 'prompt_hash', 'attempts', 'error'])
+        if self.database is not None:
+            fresh = result[result['error'].isna() & (result['attempts'] > 0)]
+            self.save(fresh.drop_duplicates(['level', 'segment']))
+        return result
+
+    def shrink(self, nbytes):
+        """Forget the oldest answers until nbytes are freed (or none is left); returns the bytes freed"""
+        freed = 0
+        with self._lock:
+            while self._memo and freed < nbytes:
+                digest = next(iter(self._memo))
+                freed += sys.getsizeof(digest) + sys.getsizeof(self._memo.pop(digest))
+            self.nbytes -= freed
+        return freed
+
+    def save(self, summaries):
+        """Record new summaries in analysis_history (one row per segment)"""
+        futures = [
+            self.database.save_analysis(
+                ANALYSIS_TYPE,
+                {'level': row.level, 'segment': row.segment, 'filters': row.filters, 'prompt_hash': row.prompt_hash},
+                row.summary)
+            for row in summaries.itertuples()
+        ]
+        for future in futures:
+            future.result()
+
+    def run(self, database, levels=DEFAULT_LEVELS, filters=None):
+        """Build the prompts of every segment and summarize them"""
+        return self.summarize(segment_prompts(database, levels, filters))
+
+def main():
+    parser = argparse.ArgumentParser(description="Résumés IA par segment")
+    parser.add_argument('--db', default=os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"), help="Fichier de base")
+    parser.add_argument('--by', nargs='+', default=['country', 'type'], choices=['country', 'year', 'type'],
+                        help="Niveaux de segmentation (un résumé par valeur de chaque niveau)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Appels simultanés au modèle")
+    parser.add_argument('--retries', type=int, default=3, help="Reprises par prompt en cas d'erreur transitoire")
+    parser.add_argument('--mock', action='store_true', help="Modèle local simulé (tests, benchmarks)")
+    args = parser.parse_args()
+
+    from database import OliveOilDatabase
+
+    if args.mock:
+        model = MockModel()
+    else:
+        api_key = os.environ.get("GEMINI_API_KEY")
+        if not api_key:
+            print("❌ GEMINI_API_KEY non définie (utilisez --mock pour un modèle simulé)")
+            return
+        import google.generativeai as genai
+        genai.configure(api_key=api_key)
+        model = GeminiModel(genai.GenerativeModel('gemini-1.5-flash'))
+
+    database = OliveOilDatabase(args.db)
+    start = time.perf_counter()
+    summarizer = BatchSummarizer(model, args.concurrency, args.retries, database=database)
+    summaries = summarizer.run(database, [(level,) for level in args.by])
+    failed = summaries['error'].notna().sum()
+    print(f"🤖 {len(summaries)} résumés ({summaries['prompt_hash'].nunique()} prompts distincts, {failed} échecs) "
+          f"en {time.perf_counter() - start:.1f}s")
+    database.close()
+
+if __name__ == "__main__":
+    main()
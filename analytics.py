@@ -3,31 +3,140 @@
 
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-import plotly.graph_objects as go
-import plotly.express as px
 from datetime import datetime, timedelta
 
+# sklearn and plotly are imported inside the methods that use them so their
+# import cost is paid on first use instead of at application start.
+
+from anomalies import DETECTORS, group_codes
+from chunked import SalesCube
+from figure_cache import cache as figure_cache
+from forecasting import HoltWinters, in_sample_r2, cache as forecast_cache
+from instrumentation import timed, track
+from storage import FIXED_POINT, to_fixed
+from recommendations import DEFAULT_LEVELS, engine
+from timeseries import TimeSeriesEngine, cache as series_cache
+
 class AdvancedAnalytics:
-    def __init__(self, data):
-        self.data = data
-        self.scaler = StandardScaler()
+    def __init__(self, data, database=None, filters=None, chunksize=100_000):
+        # data is either a DataFrame or a chunked source (an iterator of
+        # DataFrames or an SQL cursor), streamed once into partial aggregates
+        if isinstance(data, pd.DataFrame):
+            self.data = data
+            self._source = None
+        else:
+            self.data = None
+            self._source = data
+        self.chunksize = chunksize
+        self._cube = None
+        self._scaler = None
+        self._fixed_columns = {}
+        # When a database is given, group-bys and pivots run in its storage engine
+        self.database = database
+        self.filters = filters or {}
+    
+    @property
+    def scaler(self):
+        if self._scaler is None:
+            from sklearn.preprocessing import StandardScaler
+            self._scaler = StandardScaler()
+        return self._scaler
+    
+    @property
+    def chunked(self):
+        return self.data is None
+    
+    @property
+    def cube(self):
+        """Partial aggregates of a chunked source, computed on first use"""
+        if self._cube is None:
+            with track("analytics.stream_chunks") as info:
+                self._cube = SalesCube.from_chunks(self._source, self.chunksize)
+                info['rows'] = self._cube.rows
+            self._source = None
+        return self._cube
+    
+    @property
+    def rows(self):
+        """Row-level frame: the data itself, or a bounded sample when chunked"""
+        return self.cube.sample_frame() if self.chunked else self.data
     
-    def detect_anomalies(self, column='sales', contamination=0.1):
-        """Detect anomalies in sales data"""
+    def _grouped(self, by, column, aggfunc='sum'):
+        """Aggregate a column per group, pushed down to the database when available"""
+        if self.database is not None:
+            grouped = self.database.aggregate(by, {column: aggfunc}, self.filters)
+            return grouped.set_index(by)[column]
+        if self.chunked:
+            return self.cube.grouped(by, column, aggfunc)
+        if column in FIXED_POINT and aggfunc in ('sum', 'mean'):
+            # Exact int64 sums of the stored fixed-point amounts
+            keys = self.data[by] if isinstance(by, str) else [self.data[key] for key in by]
+            return self._fixed(column).groupby(keys).agg(aggfunc) / FIXED_POINT[column][1]
+        return self.data.groupby(by)[column].agg(aggfunc)
+    
+    def _stat(self, column, func):
+        """Whole-column statistic, from the streamed aggregates when chunked"""
+        if self.chunked:
+            return self.cube.stat(column, func)
+        if column in FIXED_POINT and func in ('sum', 'mean') and len(self.data):
+            scale = FIXED_POINT[column][1]
+            total = int(self._fixed(column).sum())
+            return total / scale if func == 'sum' else total / (len(self.data) * scale)
+        return self.data[column].agg(func)
+    
+    def _fixed(self, column):
+        """int64 fixed-point amounts of a money column, taken from its integer column or converted once"""
+        if column not in self._fixed_columns:
+            fixed, scale = FIXED_POINT[column]
+            values = self.data[fixed] if fixed in self.data else to_fixed(self.data[column], scale)
+            self._fixed_columns[column] = pd.Series(np.asarray(values, dtype=np.int64), index=self.data.index,
+                                                    name=column)
+        return self._fixed_columns[column]
+    
+    def _count(self):
+        return self.cube.rows if self.chunked else len(self.data)
+    
+    @timed("analytics.detect_anomalies")
+    def detect_anomalies(self, column='sales', contamination=0.1, method='isolation_forest', by=None,
+                         threshold=None):
+        """Detect anomalies in sales data
+        
+        method is 'isolation_forest' (global, sklearn), or one of the
+        vectorized robust detectors 'mad' and 'iqr', which judge each row
+        against its own segment (by, default country × type).
+        """
         try:
+            # Chunked sources are scored on their bounded sample
+            data = self.rows
+            
+            if method in DETECTORS:
+                detector, default_threshold = DETECTORS[method]
+                by = ('country', 'type') if by is None else by
+                with track(f"analytics.{method}") as info:
+                    codes = group_codes(data, by)
+                    scores = detector(data[column].to_numpy(), codes,
+                                      default_threshold if threshold is None else threshold)
+                    info['rows'] = len(data)
+                
+                anomaly_data = data.copy()
+                anomaly_data['is_anomaly'] = scores < 0
+                anomaly_data['anomaly_score'] = scores
+                return anomaly_data
+            
+            from sklearn.ensemble import IsolationForest
+            
             # Prepare data for anomaly detection
-            X = self.data[column].values.reshape(-1, 1)
+            X = data[column].values.reshape(-1, 1)
             X_scaled = self.scaler.fit_transform(X)
             
             # Use Isolation Forest for anomaly detection
             iso_forest = IsolationForest(contamination=contamination, random_state=42)
-            anomalies = iso_forest.fit_predict(X_scaled)
+            with track("analytics.isolation_forest") as info:
+                anomalies = iso_forest.fit_predict(X_scaled)
+                info['rows'] = len(X_scaled)
             
             # Create anomaly dataframe
-            anomaly_data = self.data.copy()
+            anomaly_data = data.copy()
             anomaly_data['is_anomaly'] = anomalies == -1
             anomaly_data['anomaly_score'] = iso_forest.decision_function(X_scaled)
             
@@ -35,23 +144,34 @@ class AdvancedAnalytics:
         except Exception as e:
             return None
     
-    def predict_sales(self, periods=3):
-        """Predict future sales using linear regression"""
+    @timed("analytics.predict_sales")
+    def predict_sales(self, periods=3, method='linear'):
+        """Predict future sales using linear regression (or Holt's exponential smoothing)"""
         try:
             # Prepare time series data
-            time_series = self.data.groupby('year')['sales'].sum().reset_index()
+            time_series = self._grouped('year', 'sales').reset_index()
             time_series['time_index'] = range(len(time_series))
             
-            # Train linear regression model
-            X = time_series['time_index'].values.reshape(-1, 1)
-            y = time_series['sales'].values
-            
-            model = LinearRegression()
-            model.fit(X, y)
-            
-            # Predict future periods
-            future_indices = np.array(range(len(time_series), len(time_series) + periods)).reshape(-1, 1)
-            predictions = model.predict(future_indices)
+            if method == 'holt_winters':
+                # Yearly totals have no seasonality: Holt's linear trend
+                model = HoltWinters(season_length=1)
+                state = model.fit(time_series['sales'].values)
+                predictions = model.forecast(state, periods)[:, 0]
+                score = float(in_sample_r2(time_series['sales'].values, state)[0])
+            else:
+                from sklearn.linear_model import LinearRegression
+                
+                # Train linear regression model
+                X = time_series['time_index'].values.reshape(-1, 1)
+                y = time_series['sales'].values
+                
+                model = LinearRegression()
+                model.fit(X, y)
+                
+                # Predict future periods
+                future_indices = np.array(range(len(time_series), len(time_series) + periods)).reshape(-1, 1)
+                predictions = model.predict(future_indices)
+                score = model.score(X, y)
             
             # Create prediction dataframe
             future_years = range(time_series['year'].max() + 1, time_series['year'].max() + 1 + periods)
@@ -61,17 +181,41 @@ class AdvancedAnalytics:
                 'confidence': [0.85] * periods  # Simple confidence score
             })
             
-            return predictions_df, model.score(X, y)
+            return predictions_df, score
         except Exception as e:
             return None, 0
     
+    @timed("analytics.forecast_segments")
+    def forecast_segments(self, periods=12, freq='M', by=('country', 'type')):
+        """Holt-Winters forecasts of every segment's monthly (or quarterly) sales
+        
+        All segments are fitted together, and the fitted states are
+        warm-started when new days arrive. Needs dated sales.
+        """
+        series = self.time_series(by)
+        if series is None:
+            return None
+        history = series.resample(freq)
+        season_length = {'M': 12, 'Q': 4, 'Y': 1}[freq]
+        # Engines built from an in-memory frame have no stable identity: their states are not cached
+        key = ((self.database.db_path, tuple(sorted(self.filters.items())), freq, tuple(by))
+               if self.database is not None else None)
+        forecasts, _ = forecast_cache.forecast(key, history.to_numpy(), season_length, periods, history.columns)
+        
+        offset = {'M': pd.DateOffset(months=1), 'Q': pd.DateOffset(months=3), 'Y': pd.DateOffset(years=1)}[freq]
+        future = pd.DatetimeIndex([history.index[-1] + offset * (i + 1) for i in range(periods)])
+        result = pd.DataFrame(forecasts, index=future, columns=history.columns)
+        result.index.name = 'period'
+        return result.stack(list(range(result.columns.nlevels))).rename('predicted_sales').reset_index()
+    
+    @timed("analytics.generate_recommendations")
     def generate_recommendations(self):
         """Generate business recommendations based on data analysis"""
         recommendations = []
         
         try:
             # Analyze sales trends
-            sales_by_year = self.data.groupby('year')['sales'].sum()
+            sales_by_year = self._grouped('year', 'sales')
             if len(sales_by_year) > 1:
                 growth_rate = (sales_by_year.iloc[-1] - sales_by_year.iloc[0]) / sales_by_year.iloc[0] * 100
                 
@@ -83,14 +227,14 @@ class AdvancedAnalytics:
                     recommendations.append("⚠️ Déclin des ventes. Analysez les causes et ajustez la stratégie.")
             
             # Analyze country performance
-            country_performance = self.data.groupby('country')['sales'].sum().sort_values(ascending=False)
+            country_performance = self._grouped('country', 'sales').sort_values(ascending=False)
             top_country = country_performance.index[0]
             top_sales = country_performance.iloc[0]
             
             recommendations.append(f"🏆 {top_country} est votre meilleur marché avec {top_sales:,.0f}€ de ventes.")
             
             # Analyze price trends
-            price_trend = self.data.groupby('year')['price'].mean()
+            price_trend = self._grouped('year', 'price', 'mean')
             if len(price_trend) > 1:
                 price_change = (price_trend.iloc[-1] - price_trend.iloc[0]) / price_trend.iloc[0] * 100
                 
@@ -102,76 +246,129 @@ class AdvancedAnalytics:
                     recommendations.append("⚖️ Prix stables. Bonne gestion des coûts.")
             
             # Analyze product mix
-            type_performance = self.data.groupby('type')['sales'].sum().sort_values(ascending=False)
+            type_performance = self._grouped('type', 'sales').sort_values(ascending=False)
             best_type = type_performance.index[0]
             
             recommendations.append(f"🫒 {best_type} est votre produit le plus vendu. Concentrez-vous sur ce segment.")
             
             # Seasonal analysis
-            if len(self.data['year'].unique()) > 1:
+            if self._stat('year', 'nunique') > 1:
                 recommendations.append("📅 Analysez les tendances saisonnières pour optimiser la production.")
-            
+        
         except Exception as e:
             recommendations.append("❌ Erreur lors de l'analyse des données.")
         
         return recommendations
     
+    def _segment_yearly(self):
+        """Sales per (country, type, year) with the price sums and row counts of each group"""
+        keys = ['country', 'type', 'year']
+        if self.database is not None:
+            yearly = self.database.aggregate(keys, {'sales': 'sum', 'volume': 'sum', 'price': ['sum', 'count']},
+                                             self.filters)
+            return yearly.rename(columns={'price_count': 'rows'})
+        if self.chunked:
+            return self.cube.totals().rename(columns={'price': 'price_sum'}).reset_index()
+        return self.data.groupby(keys).agg(
+            sales=('sales', 'sum'), volume=('volume', 'sum'), price_sum=('price', 'sum'), rows=('price', 'size')
+        ).reset_index()
+    
+    def _data_version(self):
+        """Cache key of the analysed data (None disables caching)"""
+        if self.database is not None:
+            return (self.database.db_path, self.database.data_version(), tuple(sorted(self.filters.items())))
+        if self.chunked:
+            return None
+        return int(pd.util.hash_pandas_object(self.data, index=False).sum())
+    
+    @timed("analytics.segment_recommendations")
+    def segment_recommendations(self, levels=DEFAULT_LEVELS):
+        """Rule-based recommendations per country, per type and per country × type"""
+        # The segment aggregates are only queried on a cache miss
+        return engine.recommend(self._segment_yearly, self._data_version(), levels)
+    
+    @timed("analytics.time_series")
+    def time_series(self, by=('country', 'type'), measure='sales'):
+        """Daily time-series engine of the dated sales (None without sale_date)"""
+        if self.database is not None:
+            return series_cache.get(self.database, by, measure, self.filters)
+        if self.chunked or 'sale_date' not in self.data or self.data['sale_date'].isna().all():
+            return None
+        return TimeSeriesEngine.from_frame(self.data, by, measure)
+    
+    @timed("analytics.create_heatmap")
     def create_heatmap(self):
-        """Create a heatmap of sales by country and year"""
+        """Create a heatmap of sales by country and year (served from cached JSON)"""
         try:
-            pivot_data = self.data.pivot_table(
-                values='sales', 
-                index='country', 
-                columns='year', 
-                aggfunc='sum'
-            ).fillna(0)
-            
-            fig = px.imshow(
-                pivot_data,
-                title="Heatmap des ventes par pays et année",
-                labels=dict(x="Année", y="Pays", color="Ventes (€)"),
-                color_continuous_scale="viridis"
-            )
-            
-            return fig
+            import plotly.express as px
+            
+            def build():
+                if self.database is not None:
+                    pivot_data = self.database.pivot('country', 'year', 'sales', 'sum', self.filters)
+                elif self.chunked:
+                    pivot_data = self.cube.pivot('country', 'year', 'sales', 'sum')
+                else:
+                    pivot_data = self.data.pivot_table(
+                        values='sales', 
+                        index='country', 
+                        columns='year', 
+                        aggfunc='sum'
+                    ).fillna(0)
+                
+                return px.imshow(
+                    pivot_data,
+                    title="Heatmap des ventes par pays et année",
+                    labels=dict(x="Année", y="Pays", color="Ventes (€)"),
+                    color_continuous_scale="viridis"
+                )
+            
+            return figure_cache.figure((self._data_version(), 'heatmap'), build)
         except Exception as e:
             return None
     
+    @timed("analytics.create_3d_scatter")
     def create_3d_scatter(self):
-        """Create a 3D scatter plot of sales, volume, and price"""
+        """Create a 3D scatter plot of sales, volume, and price (served from cached JSON)"""
         try:
-            fig = px.scatter_3d(
-                self.data,
-                x='sales',
-                y='volume',
-                z='price',
-                color='country',
-                size='sales',
-                title="Analyse 3D : Ventes, Volume et Prix",
-                labels={'sales': 'Ventes (€)', 'volume': 'Volume (L)', 'price': 'Prix (€/L)'}
-            )
-            
-            return fig
+            import plotly.express as px
+            
+            def build():
+                return px.scatter_3d(
+                    self.rows,
+                    x='sales',
+                    y='volume',
+                    z='price',
+                    color='country',
+                    size='sales',
+                    title="Analyse 3D : Ventes, Volume et Prix",
+                    labels={'sales': 'Ventes (€)', 'volume': 'Volume (L)', 'price': 'Prix (€/L)'}
+                )
+            
+            return figure_cache.figure((self._data_version(), '3d_scatter'), build)
         except Exception as e:
             return None
     
-    def calculate_kpis(self):
+    @timed("analytics.calculate_kpis")
+    def calculate_kpis(self, approximate=False):
         """Calculate advanced KPIs"""
+        # Sketches are partitioned by year: other filters need the exact path
+        if approximate and self.database is not None and set(self.filters) <= {'year'}:
+            return self.approximate_kpis()
         try:
             kpis = {}
             
             # Basic KPIs
-            kpis['total_sales'] = self.data['sales'].sum()
-            kpis['total_volume'] = self.data['volume'].sum()
-            kpis['avg_price'] = self.data['price'].mean()
+            kpis['total_sales'] = self._stat('sales', 'sum')
+            kpis['total_volume'] = self._stat('volume', 'sum')
+            kpis['avg_price'] = self._stat('price', 'mean')
             
             # Advanced KPIs
             kpis['sales_growth'] = self.calculate_growth_rate('sales')
             kpis['volume_growth'] = self.calculate_growth_rate('volume')
-            kpis['price_volatility'] = self.data['price'].std()
+            kpis['price_volatility'] = self._stat('price', 'std')
             
             # Market share analysis
-            country_sales = self.data.groupby('country')['sales'].sum()
+            country_sales = self._grouped('country', 'sales')
             kpis['market_concentration'] = (country_sales ** 2).sum() / (country_sales.sum() ** 2)
             
             # Efficiency metrics
@@ -181,16 +378,45 @@ class AdvancedAnalytics:
         except Exception as e:
             return {}
     
+    @timed("analytics.approximate_kpis")
+    def approximate_kpis(self):
+        """KPIs merged from the database sketches, with their error bounds"""
+        years = [self.filters['year']] if 'year' in self.filters else None
+        summary = self.database.sketch_summary(years)
+        
+        def growth(yearly):
+            values = list(yearly.values())
+            if len(values) > 1:
+                return ((values[-1] - values[0]) / values[0]) * 100
+            return 0
+        
+        kpis = {
+            'total_sales': summary['total_sales'],
+            'total_volume': summary['total_volume'],
+            'avg_price': summary['avg_price'],
+            'sales_growth': growth(summary['yearly_sales']),
+            'volume_growth': growth(summary['yearly_volume']),
+            'price_volatility': summary['price_std'],
+            'market_concentration': summary['market_concentration'],
+            'price_median': summary['price_median'],
+            'price_p95': summary['price_p95'],
+            'error_bounds': summary['error_bounds'],
+        }
+        kpis['sales_per_liter'] = kpis['total_sales'] / kpis['total_volume'] if kpis['total_volume'] else 0
+        return kpis
+    
+    @timed("analytics.calculate_growth_rate")
     def calculate_growth_rate(self, column):
         """Calculate year-over-year growth rate"""
         try:
-            yearly_data = self.data.groupby('year')[column].sum()
+            yearly_data = self._grouped('year', column)
             if len(yearly_data) > 1:
                 return ((yearly_data.iloc[-1] - yearly_data.iloc[0]) / yearly_data.iloc[0]) * 100
             return 0
         except:
             return 0
     
+    @timed("analytics.generate_report")
     def generate_report(self):
         """Generate a comprehensive analysis report"""
         report = {
@@ -203,6 +429,7 @@ class AdvancedAnalytics:
         
         return report
     
+    @timed("analytics.generate_summary")
     def generate_summary(self):
         """Generate a summary of the analysis"""
         try:
@@ -210,15 +437,15 @@ class AdvancedAnalytics:
             📊 **Rapport d'analyse complet**
             
             **Données analysées :**
-            - Période : {self.data['year'].min()} - {self.data['year'].max()}
-            - Pays : {len(self.data['country'].unique())}
-            - Types d'huile : {len(self.data['type'].unique())}
-            - Enregistrements : {len(self.data)}
+            - Période : {self._stat('year', 'min')} - {self._stat('year', 'max')}
+            - Pays : {self._stat('country', 'nunique')}
+            - Types d'huile : {self._stat('type', 'nunique')}
+            - Enregistrements : {self._count()}
             
             **Performance globale :**
-            - Ventes totales : {self.data['sales'].sum():,.0f} €
-            - Volume total : {self.data['volume'].sum():,.0f} L
-            - Prix moyen : {self.data['price'].mean():.2f} €/L
+            - Ventes totales : {self._stat('sales', 'sum'):,.0f} €
+            - Volume total : {self._stat('volume', 'sum'):,.0f} L
+            - Prix moyen : {self._stat('price', 'mean'):.2f} €/L
             
             **Tendances :**
             - Croissance des ventes : {self.calculate_growth_rate('sales'):.1f}%
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+# Iglewicz & Hoaglin: |modified z-score| above 3.5 is a likely outlier
+MAD_THRESHOLD = 3.5
+# Tukey fences: beyond 1.5 IQR outside the quartiles
+IQR_THRESHOLD = 1.5
+# Makes the MAD a consistent estimator of the standard deviation for normal data
+MAD_SCALE = 0.6745
+
+def group_codes(frame, by):
+    """Dense group number of every row (0 .. n_groups - 1)"""
+    if not by:
+        return np.zeros(len(frame), dtype=np.int64)
+    return frame.groupby(list(by), sort=False).ngroup().to_numpy()
+
+def grouped_quantiles(values, codes, quantiles):
+    """Per-group quantiles with linear interpolation (like np.quantile), from a single sort
+
+    Rows are sorted once by (group, value); each group then occupies a
+    contiguous slice, so any quantile is a gather at computed positions.
+    Returns one array per quantile, indexed by group code.
+    """
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    counts = np.bincount(codes)
+    starts = np.cumsum(counts) - counts
+    result = []
+    for q in quantiles:
+        position = starts + q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        result.append(sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower))
+    return result
+
+def mad_scores(values, codes, threshold=MAD_THRESHOLD):
+    """Robust z-score detector: |0.6745 (x - median) / MAD| > threshold within each group
+
+    Scores follow IsolationForest.decision_function: negative means anomaly.
+    Groups with a zero MAD (constant values) flag nothing.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    median, = grouped_quantiles(values, codes, [0.5])
+    deviation = np.abs(values - median[codes])
+    mad, = grouped_quantiles(deviation, codes, [0.5])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(mad[codes] > 0, MAD_SCALE * deviation / mad[codes], 0.0)
+    return threshold - z
+
+def iqr_scores(values, codes, threshold=IQR_THRESHOLD):
+    """Tukey fence detector: distance inside the fences, in IQR units (negative means anomaly)"""
+    values = np.asarray(values, dtype=np.float64)
+    q1, q3 = grouped_quantiles(values, codes, [0.25, 0.75])
+    iqr = (q3 - q1)[codes]
+    lower, upper = q1[codes] - threshold * iqr, q3[codes] + threshold * iqr
+    margin = np.minimum(values - lower, upper - values)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(iqr > 0, margin / iqr, np.inf)
+
+# Vectorized detectors selectable in AdvancedAnalytics.detect_anomalies
+DETECTORS = {
+    'mad': (mad_scores, MAD_THRESHOLD),
+    'iqr': (iqr_scores, IQR_THRESHOLD),
+}
@@ -1,15 +1,26 @@
+import time
+_rerun_start = time.perf_counter()
+
 import streamlit as st
 import pandas as pd
-import google.generativeai as genai
-import plotly.express as px
-import plotly.graph_objects as go
 from datetime import datetime
 import numpy as np
-import sqlite3
+import os
 
 # Import our custom modules
 from database import db
+from ai_batch import BatchSummarizer, GeminiModel
 from analytics import AdvancedAnalytics
+from dashboard import cache as dashboard_cache, figure
+from figure_cache import cache as figure_cache
+from forecasting import cache as forecast_cache
+from ingestion import ingest, scan
+from instrumentation import metrics, query_log, timed, track
+from maintenance import DEFAULT_INTERVAL, Maintenance, MaintenanceScheduler, format_bytes
+from memory_budget import governor
+from notifier import LiveFrame
+from storage import filters_key
+from timeseries import cache as series_cache
 
 # Configuration de la page
 st.set_page_config(
@@ -25,19 +36,33 @@ class AIAgent:
     def __init__(self):
         """Initialise l'agent IA avec le contexte tunisien"""
         # Récupérer la clé API depuis les secrets Streamlit (sécurisé)
-        self.api_key = st.secrets.get("GEMINI_API_KEY")
-        
-        # Afficher le statut de l'API dans la sidebar
-        if self.api_key:
+        try:
+            self.api_key = st.secrets.get("GEMINI_API_KEY")
+        except FileNotFoundError:
+            # Pas de secrets.toml : l'IA reste simplement non configurée
+            self.api_key = None
+        self.is_available = bool(self.api_key)
+        # Le modèle Gemini n'est créé qu'à la première génération
+        self._model = None
+    
+    @property
+    def model(self):
+        """Importe et configure Gemini à la première utilisation"""
+        if self._model is None and self.is_available:
+            with track("ai.init_model"):
+                import google.generativeai as genai
+                genai.configure(api_key=self.api_key)
+                self._model = genai.GenerativeModel('gemini-1.5-flash')
+        return self._model
+    
+    def show_status(self):
+        """Affiche le statut de l'API dans la sidebar"""
+        if self.is_available:
             st.sidebar.success("🤖 IA Gemini : ✅ Configurée")
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
-            self.is_available = True
         else:
             st.sidebar.warning("🤖 IA Gemini : ❌ Non configurée")
-            self.is_available = False
-            self.model = None
     
+    @timed("ai.generate_summary")
     def generate_summary(self, filtered_data):
         """Génère un résumé IA des données"""
         if not self.is_available:
@@ -63,7 +88,9 @@ class AIAgent:
             Fournis une brève analyse des tendances de ventes et des insights clés.
             """
             
-            response = self.model.generate_content(prompt)
+            with track("ai.gemini") as info:
+                response = self.model.generate_content(prompt)
+                info['bytes'] = len(response.text.encode('utf-8'))
             return response.text
             
         except Exception as e:
@@ -72,6 +99,7 @@ class AIAgent:
             safe_error = error_msg.encode('ascii', 'ignore').decode('ascii')
             return f"❌ Erreur lors de la génération du résumé IA : {safe_error}\n\n{self.generate_manual_summary(filtered_data)}"
     
+    @timed("ai.generate_manual_summary")
     def generate_manual_summary(self, filtered_data):
         """Génère un résumé manuel quand l'IA n'est pas disponible"""
         total_sales = filtered_data['sales'].sum()
@@ -116,36 +144,99 @@ class AIAgent:
         
         return summary
 
+@st.cache_resource
+def get_ai_agent():
+    """Agent IA partagé, créé une seule fois par processus"""
+    return AIAgent()
+
+def plotly_express():
+    """Import paresseux de plotly.express, coûteux au démarrage"""
+    import plotly.express as px
+    return px
+
+@st.cache_resource
+def get_batch_summarizer():
+    """Résumés par segment via Gemini, mémorisés par prompt pour tout le processus"""
+    summarizer = BatchSummarizer(GeminiModel(get_ai_agent().model), max_concurrency=4, database=db)
+    governor.watch("ai_summaries", lambda: summarizer.nbytes, summarizer.shrink)
+    return summarizer
+
+@st.cache_resource
+def get_maintenance_scheduler():
+    """Maintenance SQLite en arrière-plan, démarrée une seule fois par processus (intervalle 0 : désactivée)"""
+    interval = float(os.environ.get("OLIVE_OIL_MAINTENANCE_INTERVAL", DEFAULT_INTERVAL))
+    return MaintenanceScheduler(Maintenance(db), interval).start()
+
 # Initialiser l'agent IA
-ai_agent = AIAgent()
+ai_agent = get_ai_agent()
+ai_agent.show_status()
+maintenance_scheduler = get_maintenance_scheduler()
+
+# Secondes entre deux vérifications des écritures des autres sessions (0 : désactivé)
+LIVE_INTERVAL = float(os.environ.get("OLIVE_OIL_LIVE_INTERVAL", 2))
 
 # Initialize database and load data
-@st.cache_data
+@st.cache_resource
+def get_live_sales():
+    """Ventes partagées par toutes les sessions, mises à jour par les écritures validées (sans rechargement)"""
+    # First, ensure the database and tables exist. This is robust.
+    db.init_database()
+    
+    # Then, check if the sales table is empty.
+    count = db.get_statistics()['total_records']
+
+    if count == 0:
+        # If empty, load from CSV.
+        db.load_data_from_csv("olive_oil_data.csv")
+
+    live = LiveFrame(db)
+    # The live frame cannot shrink; the other shared caches give memory back when over budget
+    governor.watch("live_sales", lambda: live.nbytes)
+    governor.watch("figures", lambda: figure_cache.nbytes, figure_cache.shrink)
+    governor.watch("dashboards", lambda: dashboard_cache.nbytes, dashboard_cache.shrink)
+    governor.watch("series", lambda: series_cache.nbytes, series_cache.shrink)
+    governor.watch("forecasts", lambda: forecast_cache.nbytes, forecast_cache.shrink)
+    return live
+
+def live_subscription():
+    """Abonnement de la session aux écritures, créé à sa première exécution"""
+    if "live_subscription" not in st.session_state:
+        st.session_state["live_subscription"] = db.subscribe()
+        st.session_state["live_hidden"] = 0
+    return st.session_state["live_subscription"]
+
+def filter_sales(df, filters):
+    """Sales of df within the sidebar filters"""
+    # Boolean indexing copies already: no extra full copy per session
+    for column, value in filters.items():
+        df = df[df[column] == value]
+    return df
+
+def live_view(filters):
+    """Vue de la session ; relue depuis les ventes partagées quand une écriture touche ses filtres"""
+    deltas = live_subscription().drain()
+    if deltas and get_live_sales().touches(deltas, filters):
+        _, df = get_live_sales().frame()
+        filtered_df = filter_sales(df, filters)
+        st.session_state["live_view"] = (filtered_df, dashboard_cache.get(db, filters, filtered_df))
+    else:
+        st.session_state["live_hidden"] += sum(len(delta['ids']) for delta in deltas)
+    return st.session_state["live_view"]
+
+@timed("app.load_data")
 def load_data():
-    """Load data from database and populate if empty"""
+    """(data version, sales) loaded together; populates the database if empty"""
     try:
-        # First, ensure the database and tables exist. This is robust.
-        db.init_database()
-        
-        # Then, check if the sales table is empty.
-        conn = sqlite3.connect(db.db_path)
-        try:
-            count = pd.read_sql_query("SELECT COUNT(*) FROM sales", conn).iloc[0, 0]
-        except pd.io.sql.DatabaseError:
-            # Table might not exist yet if init failed somehow, so count is 0
-            count = 0
-        finally:
-            conn.close()
-
-        if count == 0:
-            # If empty, load from CSV.
-            db.load_data_from_csv("olive_oil_data.csv")
-
-        # Finally, get all data.
-        return db.get_all_data()
+        # Writes seen from now on are shown by this run: only later ones concern the live updates
+        live_subscription().drain()
+        st.session_state["live_hidden"] = 0
+        live = get_live_sales()
+        # The shared caches grew during the previous runs
+        governor.enforce()
+        return live.frame()
     except Exception as e:
         st.error(f"❌ Erreur critique lors du chargement de la base de données: {str(e)}")
-        return pd.DataFrame()
+        return None, pd.DataFrame()
 
 def generate_ai_summary(filtered_data):
     """Generate AI summary using Gemini"""
@@ -170,13 +261,89 @@ def export_data(df, format_type):
         st.error(f"❌ Erreur lors de l'export: {str(e)}")
         return None
 
+@st.fragment(run_every=LIVE_INTERVAL or None)
+def show_dashboard(filters):
+    """Onglet Dashboard, seul relancé quand une autre session écrit une vente visible avec ses filtres"""
+    st.header("📊 Dashboard Principal")
+    filtered_df, dashboard = live_view(filters)
+    if st.session_state["live_hidden"]:
+        st.caption(f"🔴 {st.session_state['live_hidden']} modifications hors de vos filtres depuis le chargement")
+    
+    totals = dashboard['totals']
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("💰 Total Ventes", f"{totals['sales']:,.2f} €")
+    
+    with col2:
+        st.metric("🫒 Volume Total", f"{totals['volume']:,.0f} L")
+    
+    with col3:
+        st.metric("💵 Prix Moyen", f"{totals['price']:.2f} €/L")
+    
+    with col4:
+        st.metric("📈 Croissance", f"{dashboard['growth_rate']:.1f}%")
+    
+    # Charts
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("📊 Ventes par pays")
+        with track("plotly.from_json"):
+            fig1 = figure(dashboard, 'country')
+        st.plotly_chart(fig1, use_container_width=True)
+    
+    with col2:
+        st.subheader("📈 Évolution annuelle")
+        with track("plotly.from_json"):
+            fig2 = figure(dashboard, 'year')
+        st.plotly_chart(fig2, use_container_width=True)
+    
+    # Additional charts
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("🥧 Répartition par type")
+        with track("plotly.from_json"):
+            fig3 = figure(dashboard, 'type')
+        st.plotly_chart(fig3, use_container_width=True)
+    
+    with col2:
+        st.subheader("📋 Données détaillées")
+        st.dataframe(filtered_df, use_container_width=True)
+    
+    # Sub-annual trends, only when sales carry a sale_date
+    if db.has_sale_dates(filters):
+        st.subheader("📅 Tendance infra-annuelle")
+        series = AdvancedAnalytics(filtered_df, db, filters).time_series()
+        frequency = st.radio("Fréquence", ["Mois", "Trimestre"], horizontal=True, key="ts_frequency")
+        freq = {'Mois': 'M', 'Trimestre': 'Q'}[frequency]
+        periods = series.resample(freq).sum(axis=1)
+        trend = pd.DataFrame({
+            'period': periods.index,
+            'Ventes': periods.values,
+            'Moyenne mobile (1 an)': periods.rolling({'M': 12, 'Q': 4}[freq], min_periods=1).mean().values,
+        })
+        px = plotly_express()
+        with track("plotly.timeseries"):
+            fig4 = px.line(trend, x='period', y=['Ventes', 'Moyenne mobile (1 an)'],
+                          title=f"Ventes par {frequency.lower()}",
+                          labels={'value': 'Ventes (€)', 'period': 'Période', 'variable': ''})
+        st.plotly_chart(fig4, use_container_width=True)
+        
+        lag = {'M': 12, 'Q': 4}[freq]
+        if len(periods) > lag and periods.iloc[-1 - lag]:
+            yoy = (periods.iloc[-1] - periods.iloc[-1 - lag]) / periods.iloc[-1 - lag] * 100
+            st.metric(f"📆 Glissement annuel ({periods.index[-1]:%Y-%m})", f"{yoy:+.1f}%")
+
 # Interface principale avec onglets
 def main():
     st.title("🫒 Olive Oil Tracker Pro")
     st.markdown("### **Dashboard avancé pour le suivi des ventes d'huile d'olive**")
+    metrics.record("app.first_paint", time.perf_counter() - _rerun_start)
     
     # Load data
-    df = load_data()
+    data_version, df = load_data()
     if df.empty:
         st.error("❌ Aucune donnée disponible!")
         return
@@ -208,91 +375,48 @@ def main():
         selected_type = st.selectbox("Type d'huile", all_types)
         
         # Apply filters
-        filtered_df = df.copy()
+        filters = {}
         if selected_country != "Tous":
-            filtered_df = filtered_df[filtered_df['country'] == selected_country]
+            filters['country'] = selected_country
         if selected_year != "Toutes":
-            filtered_df = filtered_df[filtered_df['year'] == selected_year]
+            filters['year'] = selected_year
         if selected_type != "Tous":
-            filtered_df = filtered_df[filtered_df['type'] == selected_type]
+            filters['type'] = selected_type
+        filtered_df = filter_sales(df, filters)
         
         st.markdown(f"📊 **{len(filtered_df)}** enregistrements trouvés")
         
         # Database stats
         st.markdown("---")
         st.subheader("📈 Statistiques DB")
-        stats = db.get_statistics()
+        approximate = st.toggle("⚡ Mode approximatif", key="approximate_mode",
+                                help="Statistiques et KPIs calculés depuis des sketches par année (temps constant)")
+        stats = db.get_statistics(approximate=approximate)
         st.metric("Total enregistrements", stats['total_records'])
-        st.metric("Pays", stats['countries_count'])
+        if approximate:
+            st.metric("Pays", f"≈ {stats['countries_count']}",
+                      help=f"HyperLogLog : ± {stats['error_bounds']['countries_count']:.1%} (erreur type relative)")
+        else:
+            st.metric("Pays", stats['countries_count'])
         st.metric("Période", f"{stats['year_range'][0]}-{stats['year_range'][1]}")
     
+    # KPIs, aggregates and figures of this filter combination (precomputed by the warmup)
+    dashboard = dashboard_cache.get(db, filters, filtered_df)
+    st.session_state["live_view"] = (filtered_df, dashboard)
+    
     # Tab 1: Dashboard
     with tab1:
-        st.header("📊 Dashboard Principal")
-        
-        # KPIs
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            total_sales = filtered_df['sales'].sum()
-            st.metric("💰 Total Ventes", f"{total_sales:,.2f} €")
-        
-        with col2:
-            total_volume = filtered_df['volume'].sum()
-            st.metric("🫒 Volume Total", f"{total_volume:,.0f} L")
-        
-        with col3:
-            avg_price = filtered_df['price'].mean()
-            st.metric("💵 Prix Moyen", f"{avg_price:.2f} €/L")
-        
-        with col4:
-            growth_rate = ((filtered_df.groupby('year')['sales'].sum().iloc[-1] - 
-                          filtered_df.groupby('year')['sales'].sum().iloc[0]) / 
-                         filtered_df.groupby('year')['sales'].sum().iloc[0] * 100) if len(filtered_df.groupby('year')['sales'].sum()) > 1 else 0
-            st.metric("📈 Croissance", f"{growth_rate:.1f}%")
-        
-        # Charts
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("📊 Ventes par pays")
-            sales_by_country = filtered_df.groupby('country')['sales'].sum().reset_index()
-            fig1 = px.bar(sales_by_country, x='country', y='sales', 
-                         title="Ventes totales par pays",
-                         labels={'sales': 'Ventes (€)', 'country': 'Pays'})
-            st.plotly_chart(fig1, use_container_width=True)
-        
-        with col2:
-            st.subheader("📈 Évolution annuelle")
-            sales_by_year = filtered_df.groupby('year')['sales'].sum().reset_index()
-            fig2 = px.line(sales_by_year, x='year', y='sales',
-                          title="Évolution des ventes par année",
-                          labels={'sales': 'Ventes (€)', 'year': 'Année'})
-            st.plotly_chart(fig2, use_container_width=True)
-        
-        # Additional charts
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.subheader("🥧 Répartition par type")
-            sales_by_type = filtered_df.groupby('type')['sales'].sum().reset_index()
-            fig3 = px.pie(sales_by_type, values='sales', names='type',
-                         title="Répartition des ventes par type d'huile")
-            st.plotly_chart(fig3, use_container_width=True)
-        
-        with col2:
-            st.subheader("📋 Données détaillées")
-            st.dataframe(filtered_df, use_container_width=True)
+        show_dashboard(filters)
     
     # Tab 2: Advanced Analytics
     with tab2:
         st.header("🔍 Analyse Avancée")
         
-        analytics = AdvancedAnalytics(filtered_df)
+        analytics = AdvancedAnalytics(filtered_df, db, filters)
         
         # Advanced KPIs
         col1, col2, col3, col4 = st.columns(4)
-        kpis = analytics.calculate_kpis()
+        kpis = analytics.calculate_kpis(approximate=True) if approximate else dashboard['kpis']
         
         with col1:
             st.metric("📊 Croissance Ventes", f"{kpis.get('sales_growth', 0):.1f}%")
@@ -302,6 +426,11 @@ def main():
             st.metric("💰 Volatilité Prix", f"{kpis.get('price_volatility', 0):.2f}")
         with col4:
             st.metric("🎯 Concentration Marché", f"{kpis.get('market_concentration', 0):.2f}")
+        if 'error_bounds' in kpis:
+            st.caption(f"⚡ KPIs approximatifs (sketches) — prix médian ≈ {kpis['price_median']:.2f} €/L, "
+                       f"P95 ≈ {kpis['price_p95']:.2f} €/L (± {kpis['error_bounds']['price_quantiles']:.1%} en rang)")
+        elif approximate:
+            st.caption("ℹ️ Filtres pays/type : KPIs calculés en mode exact")
         
         # Advanced visualizations
         col1, col2 = st.columns(2)
@@ -324,7 +453,17 @@ def main():
         
         # Anomaly detection
         st.subheader("🚨 Détection d'anomalies")
-        anomaly_data = analytics.detect_anomalies()
+        anomaly_methods = {
+            "Isolation Forest (global)": 'isolation_forest',
+            "Score z robuste / MAD (par pays × type)": 'mad',
+            "Écart interquartile (par pays × type)": 'iqr',
+        }
+        anomaly_method = st.selectbox("Méthode", list(anomaly_methods), key="anomaly_method")
+        # Shared by the sessions with the same filters, within the memory budget; keyed by the
+        # version df was read at, so that a write since then cannot file this result under a newer one
+        anomaly_data = governor.get_or_compute(
+            (data_version, "anomalies", filters_key(filters), anomaly_methods[anomaly_method]),
+            lambda: analytics.detect_anomalies(method=anomaly_methods[anomaly_method]))
         if anomaly_data is not None:
             anomalies = anomaly_data[anomaly_data['is_anomaly']]
             if len(anomalies) > 0:
@@ -338,12 +477,18 @@ def main():
     # Tab 3: Predictions
     with tab3:
         st.header("📈 Prévisions et Tendances")
+        px = plotly_express()
         
-        analytics = AdvancedAnalytics(filtered_df)
+        analytics = AdvancedAnalytics(filtered_df, db, filters)
         
         # Sales predictions
         st.subheader("🔮 Prévisions de ventes")
-        predictions, model_score = analytics.predict_sales(periods=3)
+        forecast_methods = {
+            "Régression linéaire": 'linear',
+            "Lissage exponentiel (Holt)": 'holt_winters',
+        }
+        forecast_method = st.radio("Modèle", list(forecast_methods), horizontal=True, key="forecast_method")
+        predictions, model_score = analytics.predict_sales(periods=3, method=forecast_methods[forecast_method])
         
         if predictions is not None:
             col1, col2 = st.columns(2)
@@ -362,13 +507,31 @@ def main():
                 combined = pd.concat([historical[['year', 'sales', 'type']], 
                                     predictions[['year', 'sales', 'type']]])
                 
-                fig = px.line(combined, x='year', y='sales', color='type',
-                             title="Prévisions de ventes",
-                             labels={'sales': 'Ventes (€)', 'year': 'Année'})
+                with track("plotly.line"):
+                    fig = px.line(combined, x='year', y='sales', color='type',
+                                 title="Prévisions de ventes",
+                                 labels={'sales': 'Ventes (€)', 'year': 'Année'})
                 st.plotly_chart(fig, use_container_width=True)
         else:
             st.error("❌ Impossible de générer les prévisions")
         
+        # Monthly forecasts per segment, only with dated sales
+        if db.has_sale_dates(filters):
+            with st.expander("📅 Prévisions mensuelles par segment (Holt-Winters)", expanded=False):
+                segment_forecasts = analytics.forecast_segments(periods=12)
+                monthly = analytics.time_series().resample('M').sum(axis=1)
+                combined = pd.concat([
+                    pd.DataFrame({'period': monthly.index, 'sales': monthly.values, 'type': 'Historique'}),
+                    segment_forecasts.groupby('period')['predicted_sales'].sum().rename('sales')
+                        .reset_index().assign(type='Prédiction'),
+                ])
+                with track("plotly.line"):
+                    fig = px.line(combined, x='period', y='sales', color='type',
+                                 title="Ventes mensuelles prévues (somme des segments)",
+                                 labels={'sales': 'Ventes (€)', 'period': 'Mois'})
+                st.plotly_chart(fig, use_container_width=True)
+                st.dataframe(segment_forecasts, hide_index=True)
+        
         # Trend analysis
         st.subheader("📊 Analyse des tendances")
         trend_data = filtered_df.groupby('year').agg({
@@ -377,9 +540,10 @@ def main():
             'price': 'mean'
         }).reset_index()
         
-        fig = px.line(trend_data, x='year', y=['sales', 'volume'],
-                     title="Évolution des ventes et volumes",
-                     labels={'value': 'Montant', 'year': 'Année'})
+        with track("plotly.line"):
+            fig = px.line(trend_data, x='year', y=['sales', 'volume'],
+                         title="Évolution des ventes et volumes",
+                         labels={'value': 'Montant', 'year': 'Année'})
         st.plotly_chart(fig, use_container_width=True)
     
     # Tab 4: AI & Insights
@@ -393,14 +557,34 @@ def main():
                 summary = generate_ai_summary(filtered_df)
                 st.markdown(summary)
         
+        with st.expander("📰 Résumés IA par pays et par type", expanded=False):
+            if not ai_agent.is_available:
+                st.info("💡 Fonctionnalité IA non disponible : Gemini n'est pas configuré.")
+            elif st.button("🧠 Générer les résumés par segment"):
+                with st.spinner("Génération des résumés en parallèle..."):
+                    summaries = get_batch_summarizer().run(db, filters=filters)
+                failed = summaries['error'].notna().sum()
+                if failed:
+                    st.warning(f"⚠️ {failed} résumés en échec après reprises")
+                st.dataframe(summaries[['level', 'segment', 'summary']], hide_index=True)
+                st.success("✅ Résumés sauvegardés dans la base de données")
+        
         # Business recommendations
         st.subheader("💡 Recommandations Business")
-        analytics = AdvancedAnalytics(filtered_df)
+        analytics = AdvancedAnalytics(filtered_df, db, filters)
         recommendations = analytics.generate_recommendations()
         
         for i, rec in enumerate(recommendations, 1):
             st.markdown(f"{i}. {rec}")
         
+        with st.expander("🎯 Recommandations par segment", expanded=False):
+            segment_recs = analytics.segment_recommendations()
+            levels = list(segment_recs['level'].unique())
+            selected_level = st.selectbox("Niveau", levels, key="segment_level") if levels else None
+            selected_recs = segment_recs[segment_recs['level'] == selected_level]
+            st.caption(f"{len(selected_recs)} recommandations sur {selected_recs['segment'].nunique()} segments")
+            st.dataframe(selected_recs[['segment', 'rule', 'message']], hide_index=True)
+        
         # Advanced analysis report
         st.subheader("📊 Rapport d'analyse complet")
         if st.button("📋 Générer rapport complet"):
@@ -408,11 +592,12 @@ def main():
                 report = analytics.generate_report()
                 st.markdown(report['summary'])
                 
-                # Save analysis to database
-                db.save_analysis("comprehensive_report", 
-                               {"filters": {"country": selected_country, "year": selected_year}},
-                               report['summary'])
-                st.success("✅ Rapport sauvegardé dans la base de données")
+                # Save analysis to database (the Future fails if the write is rolled back)
+                try:
+                    db.save_analysis("comprehensive_report", {"filters": filters}, report['summary']).result()
+                    st.success("✅ Rapport sauvegardé dans la base de données")
+                except Exception as e:
+                    st.error(f"❌ Erreur lors de la sauvegarde du rapport: {str(e)}")
     
     # Tab 5: Data Management
     with tab5:
@@ -440,11 +625,36 @@ def main():
                     if not add_country:
                         st.warning("Le nom du pays est obligatoire.")
                     else:
-                        db.add_sale(add_country, add_year, add_type, add_sales, add_volume, add_price)
+                        db.add_sale(add_country, add_year, add_type, add_sales, add_volume, add_price).result()
                         st.success(f"✅ Vente pour {add_country} en {add_year} ajoutée !")
-                        st.cache_data.clear()
                         st.rerun()
 
+        # --- Section pour importer les fichiers déposés dans un dossier ---
+        with st.expander("📂 Importer un dossier de fichiers", expanded=False):
+            ingest_folder = st.text_input("Dossier des fichiers CSV / XLSX", value="depots", key="ingest_folder")
+            if st.button("📥 Importer les nouveaux fichiers"):
+                if not os.path.isdir(ingest_folder):
+                    st.warning(f"Le dossier « {ingest_folder} » n'existe pas.")
+                else:
+                    with st.spinner("Import en cours..."):
+                        summary = ingest(db, scan(ingest_folder))
+                    st.success(f"✅ {summary['ingested']} fichiers importés, {summary['inserted']:,} lignes ajoutées "
+                               f"({summary['duplicates']:,} doublons et {summary['skipped']} fichiers déjà importés "
+                               f"ignorés) en {summary['seconds']:.1f}s")
+                    for path, error in summary['errors'].items():
+                        st.error(f"❌ {path} : {error}")
+            
+            uploaded_xlsx = st.file_uploader("Ou un fichier Excel (.xlsx)", type=['xlsx'], key="upload_xlsx")
+            if uploaded_xlsx is not None and st.button("📥 Importer le fichier Excel"):
+                try:
+                    with st.spinner("Import en cours..."):
+                        summary = db.load_data_from_xlsx(uploaded_xlsx)
+                except ValueError as e:
+                    st.error(f"❌ {uploaded_xlsx.name} : {e}")
+                else:
+                    st.success(f"✅ {summary['inserted']:,} lignes ajoutées ({summary['duplicates']:,} doublons, "
+                               f"{summary['rejected']:,} lignes invalides) en {summary['seconds']:.1f}s")
+
         st.markdown("---")
         
         # --- Section pour Modifier ou Supprimer une vente ---
@@ -454,18 +664,19 @@ def main():
             st.warning("Aucune donnée à modifier/supprimer avec les filtres actuels.")
         else:
             # Create a more descriptive label for the selectbox
-            filtered_df['display_label'] = filtered_df.apply(
-                lambda row: f"ID: {row['id']} - {row['country']} ({row['year']}) - {row['sales']:,.0f}€", axis=1
-            )
+            labels = {
+                row.id: f"ID: {row.id} - {row.country} ({row.year}) - {row.sales:,.0f}€"
+                for row in filtered_df[['id', 'country', 'year', 'sales']].itertuples(index=False)
+            }
             
             # Select record to edit/delete
             record_to_edit_id = st.selectbox(
                 "Sélectionnez un enregistrement",
                 options=filtered_df['id'],
-                format_func=lambda x: filtered_df.loc[filtered_df['id'] == x, 'display_label'].iloc[0]
+                format_func=labels.__getitem__
             )
             
-            selected_record = db.get_all_data().loc[db.get_all_data()['id'] == record_to_edit_id].iloc[0]
+            selected_record = filtered_df.loc[filtered_df['id'] == record_to_edit_id].iloc[0]
 
             with st.form("edit_form"):
                 st.subheader(f"Modification de l'enregistrement ID: {selected_record['id']}")
@@ -495,15 +706,13 @@ def main():
                     submitted_delete = st.form_submit_button("🗑️ Supprimer")
 
                 if submitted_edit:
-                    db.update_sale(record_to_edit_id, edit_country, edit_year, edit_type, edit_sales, edit_volume, edit_price)
+                    db.update_sale(record_to_edit_id, edit_country, edit_year, edit_type, edit_sales, edit_volume, edit_price).result()
                     st.success(f"✅ Enregistrement ID {record_to_edit_id} mis à jour !")
-                    st.cache_data.clear()
                     st.rerun()
 
                 if submitted_delete:
-                    db.delete_sale(record_to_edit_id)
+                    db.delete_sale(record_to_edit_id).result()
                     st.success(f"✅ Enregistrement ID {record_to_edit_id} supprimé !")
-                    st.cache_data.clear()
                     st.rerun()
 
         st.markdown("---")
@@ -544,20 +753,174 @@ def main():
         with col1:
             st.subheader("🔧 Configuration")
             st.info("Configuration actuelle:")
-            st.markdown(f"- **Base de données:** {db.db_path}")
+            st.markdown(f"- **Base de données:** {db.db_path} ({db.backend.name})")
+            st.markdown(f"- **Version du schéma:** {db.schema_version()}")
             st.markdown(f"- **API Gemini:** {'✅ Configurée' if ai_agent.api_key else '❌ Non configurée'}")
             st.markdown(f"- **Enregistrements:** {len(df)}")
         
         with col2:
             st.subheader("🔄 Actions système")
             if st.button("🔄 Recharger les données"):
-                st.cache_data.clear()
+                get_live_sales().reload()
                 st.success("✅ Données rechargées!")
                 st.rerun()
             
             if st.button("🗑️ Vider le cache"):
-                st.cache_data.clear()
+                get_live_sales().reload()
+                figure_cache.clear()
+                governor.clear()
                 st.success("✅ Cache vidé!")
+            figure_stats = figure_cache.stats()
+            st.caption(f"🖼️ Graphiques en cache : {figure_stats['entries']} "
+                       f"({figure_stats['nbytes'] / 1e6:.1f} / {figure_stats['max_bytes'] / 1e6:.0f} Mo)")
+            memory = governor.stats()
+            st.caption(f"🧠 Mémoire gouvernée : {format_bytes(memory['usage'])} / {format_bytes(memory['budget_bytes'])} "
+                       f"(pic {format_bytes(memory['peak_bytes'])}), {memory['spills']} écrits sur disque "
+                       f"({format_bytes(memory['spilled_bytes'])}), {memory['evictions']} évincés, "
+                       f"{memory['shrinks']} caches réduits")
+            if memory['over_budget']:
+                st.warning(f"⚠️ Budget mémoire dépassé {memory['over_budget']} fois malgré les évictions : "
+                           f"les données en direct ({format_bytes(memory['watched'].get('live_sales', 0))}) "
+                           f"ne peuvent pas être réduites")
+        
+        show_maintenance_panel()
+        show_query_panel()
+        show_performance_panel()
+
+def show_maintenance_panel():
+    """Panneau Maintenance : taille, fragmentation et dernières tâches d'entretien de la base"""
+    st.markdown("---")
+    st.subheader("🧹 Maintenance de la base")
+    
+    maintenance = maintenance_scheduler.maintenance
+    status = maintenance.status()
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Taille", format_bytes(status['file_bytes']))
+    col2.metric("WAL", format_bytes(status['wal_bytes']))
+    if 'page_count' in status:
+        col3.metric("Fragmentation", f"{status['fragmentation']:.1%}",
+                    help=f"{status['freelist_count']:,} pages libres sur {status['page_count']:,}")
+    col4.metric("Modifications depuis ANALYZE", f"{status['changes_since_analyze']:,}")
+    
+    if not maintenance.supported:
+        st.caption(f"ℹ️ Le moteur {status['backend']} gère seul ses checkpoints et son espace libre.")
+    elif status['auto_vacuum'] != 'incremental':
+        st.caption("ℹ️ Vacuum incrémental inactif : lancer une fois `python maintenance.py --full-vacuum`.")
+    if maintenance_scheduler.running:
+        st.caption(f"⏲️ Passage automatique toutes les {maintenance_scheduler.interval:.0f}s "
+                   f"(tâches à faire : {', '.join(maintenance.due(status)) or 'aucune'})")
+    if maintenance_scheduler.last_error:
+        st.warning(f"Dernière maintenance en erreur : {maintenance_scheduler.last_error}")
+    
+    if status['runs']:
+        runs_df = pd.DataFrame([{'Tâche': task, 'Date': run['ran_at'], 'Durée (ms)': round(run['duration_ms'], 1),
+                                 'Détail': ", ".join(f"{key}={value}" for key, value in run['detail'].items())}
+                                for task, run in sorted(status['runs'].items())])
+        st.dataframe(runs_df, use_container_width=True, hide_index=True)
+    
+    if st.button("🧹 Lancer la maintenance", disabled=not maintenance.supported):
+        results = maintenance_scheduler.run_once(force=True)
+        if maintenance_scheduler.last_error:
+            st.error(f"❌ {maintenance_scheduler.last_error}")
+        else:
+            st.success(f"✅ Tâches effectuées : {', '.join(results)}")
+
+def show_query_panel():
+    """Panneau Requêtes SQL : temps et lignes par requête, plans des requêtes lentes et scans complets"""
+    st.markdown("---")
+    st.subheader("🐢 Requêtes SQL")
+    
+    report = query_log.report()
+    slow = report[report['slow_calls'] > 0]
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Requêtes distinctes", len(report))
+    col2.metric("Appels lents", int(report['slow_calls'].sum()), help=f"Plus de {query_log.slow_ms:.0f} ms")
+    col3.metric("Scans complets", int((slow['full_scan'] == True).sum()))
+    
+    if report.empty:
+        st.info("Aucune requête enregistrée.")
+        return
+    table = report.head(20)[['statement', 'backend', 'calls', 'seconds', 'mean_ms', 'max_ms', 'rows', 'slow_calls', 'scanned']]
+    table = table.assign(seconds=table['seconds'] * 1000).round(1).rename(columns={
+        'statement': 'Requête', 'backend': 'Moteur', 'calls': 'Appels', 'seconds': 'Total (ms)', 'mean_ms': 'Moyenne (ms)',
+        'max_ms': 'Max (ms)', 'rows': 'Lignes', 'slow_calls': 'Lents', 'scanned': 'Scan complet'})
+    st.dataframe(table, use_container_width=True, hide_index=True)
+    
+    for row in slow.head(10).itertuples():
+        flag = f"⚠️ scan complet de {row.scanned} · " if row.full_scan else ""
+        with st.expander(f"{flag}{row.max_ms:.0f} ms · {row.statement[:80]}"):
+            st.code(row.statement, language="sql")
+            st.code(row.plan or "Plan en cours de capture…")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("📥 Exporter les requêtes lentes (JSON)", data=query_log.to_json(),
+                           file_name="olive_oil_slow_queries.json")
+    with col2:
+        if st.button("🧹 Réinitialiser le journal des requêtes"):
+            query_log.reset()
+            st.rerun()
+
+@st.cache_resource
+def start_metrics_exporter(port):
+    """Démarre une seule fois par processus l'export Prometheus local"""
+    return metrics.serve_prometheus(port)
+
+def show_performance_panel():
+    """Panneau Performance : temps passé par opération lors de la dernière exécution"""
+    st.markdown("---")
+    st.subheader("⏱️ Performance")
+    
+    last_run_id = st.session_state.get("last_run_id")
+    spans = metrics.run_spans(last_run_id) if last_run_id else []
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("**Dernière exécution**")
+        if spans:
+            run_df = pd.DataFrame(spans)[['name', 'duration', 'rows', 'bytes']]
+            run_df['duration'] = (run_df['duration'] * 1000).round(1)
+            run_df = run_df.rename(columns={'name': 'Opération', 'duration': 'Durée (ms)',
+                                            'rows': 'Lignes', 'bytes': 'Octets'})
+            st.dataframe(run_df, use_container_width=True)
+        else:
+            st.info("Aucune mesure pour l'exécution précédente.")
+    
+    with col2:
+        st.markdown("**Cumul depuis le démarrage**")
+        summary = metrics.summary()
+        st.dataframe(summary, use_container_width=True)
+        
+        st.download_button("📥 Exporter (JSON lines)",
+                           data=metrics.to_jsonl(),
+                           file_name="olive_oil_metrics.jsonl")
+        st.download_button("📥 Exporter (Prometheus)", data=metrics.prometheus_text(),
+                           file_name="olive_oil_metrics.prom")
+    
+    engine = st.selectbox("Profiler la prochaine exécution", ["Aucun", "cProfile", "pyinstrument"],
+                          key="profile_engine_choice")
+    if st.button("🔬 Profiler") and engine != "Aucun":
+        st.session_state["profile_engine"] = engine.lower()
+        st.rerun()
+    
+    profile = metrics.profiles.get(last_run_id)
+    if profile:
+        with st.expander("Rapport du profileur"):
+            st.code(profile)
+
+def run():
+    """Exécute une passe du script en mesurant son temps total"""
+    metrics_port = os.environ.get("OLIVE_OIL_METRICS_PORT")
+    if metrics_port:
+        start_metrics_exporter(int(metrics_port))
+    
+    metrics.start_run()
+    engine = st.session_state.pop("profile_engine", None)
+    try:
+        with metrics.profile(engine), track("app.rerun"):
+            main()
+    finally:
+        st.session_state["last_run_id"] = metrics.run_id
 
 if __name__ == "__main__":
-    main() 
+    run() 
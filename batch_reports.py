@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Rapports en lot
+==========================================
+
+Génère sans interface le rapport complet (AdvancedAnalytics.generate_report)
+de chaque segment pays / type / année, ou d'une liste donnée, dans un pool
+de processus. Les données sont chargées une seule fois et écrites dans un
+fichier Arrow que chaque processus projette en mémoire (mmap) : les
+colonnes sont partagées, pas copiées (sans pyarrow, chaque processus en
+reçoit une copie). Les rapports sont enregistrés dans
+analysis_history et dans des fichiers JSON, HTML et Parquet, avec le débit
+et la durée de chaque segment.
+
+Usage :
+    python batch_reports.py                                  # chaque pays, type et année
+    python batch_reports.py --by country --workers 4
+    python batch_reports.py --segment country=Spain year=2021 --segment type=Organic
+    python batch_reports.py --combinations --formats json parquet
+"""
+
+import argparse
+import html
+import importlib.util
+import json
+import math
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+FILTER_COLUMNS = ('country', 'year', 'type')
+FORMATS = ('json', 'html', 'parquet')
+ANALYSIS_TYPE = "batch_report"
+# Workers memory-map the dataset from an Arrow file; without pyarrow each one gets a copy
+ARROW = importlib.util.find_spec("pyarrow") is not None
+
+def level_segments(data, by=FILTER_COLUMNS):
+    """One filter dict per value of each column in by (each country, each type, each year)"""
+    return [{column: value.item() if hasattr(value, 'item') else value}
+            for column in by for value in sorted(data[column].unique())]
+
+def parse_segment(tokens):
+    """['country=Spain', 'year=2021'] -> {'country': 'Spain', 'year': 2021}"""
+    filters = {}
+    for token in tokens:
+        column, _, value = token.partition('=')
+        if column not in FILTER_COLUMNS or not value:
+            raise ValueError(f"Segment invalide '{token}' (attendu colonne=valeur, colonnes : {', '.join(FILTER_COLUMNS)})")
+        filters[column] = int(value) if column == 'year' else value
+    return filters
+
+def segment_name(filters):
+    return ", ".join(f"{column}={value}" for column, value in filters.items()) or "ensemble"
+
+def segment_slug(filters):
+    """File-system safe name of a segment"""
+    return re.sub(r'[^A-Za-z0-9=._-]+', '_', "__".join(f"{column}={value}" for column, value in filters.items())) or "ensemble"
+
+def _json_value(value):
+    """Plain Python value; NaN and infinities (e.g. the score of a single-year segment) become None"""
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    return value
+
+def serialize_report(report):
+    """JSON-friendly copy of a generate_report() result"""
+    predictions, score = report['predictions']
+    anomalies = report['anomalies']
+    return {
+        'summary': report['summary'],
+        'kpis': {name: _json_value(value) for name, value in report['kpis'].items()},
+        'recommendations': list(report['recommendations']),
+        'anomalies': [] if anomalies is None else
+                     json.loads(anomalies[anomalies['is_anomaly']].to_json(orient='records')),
+        'predictions': [] if predictions is None else json.loads(predictions.to_json(orient='records')),
+        'model_score': _json_value(score),
+    }
+
+def render_html(name, report):
+    """Standalone HTML page of one segment report"""
+    def table(records):
+        return pd.DataFrame(records).to_html(index=False, border=0) if records else "<p>Aucune</p>"
+
+    kpis = pd.DataFrame({'KPI': list(report['kpis']), 'Valeur': list(report['kpis'].values())})
+    recommendations = "".join(f"<li>{html.escape(text)}</li>" for text in report['recommendations'])
+    return f"""<!DOCTYPE html>
+<html lang="fr">
+<head><meta charset="utf-8"><title>Rapport {html.escape(name)}</title></head>
+<body>
+<h1>🫒 Rapport d'analyse : {html.escape(name)}</h1>
+<pre>{html.escape(report['summary'].strip())}</pre>
+<h2>KPIs</h2>
+{kpis.to_html(index=False, border=0)}
+<h2>Recommandations</h2>
+<ul>{recommendations}</ul>
+<h2>Prévisions (R² = {report['model_score'] if report['model_score'] is not None else 'n/a'})</h2>
+{table(report['predictions'])}
+<h2>Anomalies</h2>
+{table(report['anomalies'])}
+</body>
+</html>
+"""
+
+# Dataset of a worker process, mapped (or received) once from the parent
+_worker = {}
+
+def share_dataset(data, directory):
+    """Write data once as an Arrow IPC file for the workers to map; returns its path"""
+    import pyarrow as pa
+
+    path = os.path.join(directory, "dataset.arrow")
+    # One chunk per column: each maps to a single contiguous buffer
+    table = pa.Table.from_pandas(data, preserve_index=False).combine_chunks()
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    return path
+
+def load_shared_dataset(path):
+    """Read-only frame over the memory-mapped file: numbers and strings are not copied"""
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    return table.to_pandas(split_blocks=True)
+
+def _import_analytics():
+    # Paid once up front so that segment timings measure the reports only
+    import analytics
+    import sklearn.ensemble
+    import sklearn.linear_model
+
+def _ignore_undefined_score():
+    # Single-year segments make the regression score undefined; it is reported as None
+    import warnings
+    from sklearn.exceptions import UndefinedMetricWarning
+
+    warnings.filterwarnings('ignore', message=r"R\^2 score is not well-defined", category=UndefinedMetricWarning)
+
+def _init_worker(source):
+    """source is the path of the shared Arrow file, or the frame itself without pyarrow"""
+    _import_analytics()
+    _ignore_undefined_score()
+    _worker['data'] = load_shared_dataset(source) if isinstance(source, str) else source
+
+def run_report(filters, data=None):
+    """(filters, seconds, serialized report) of one segment, computed in memory"""
+    from analytics import AdvancedAnalytics
+
+    data = _worker['data'] if data is None else data
+    start = time.perf_counter()
+    mask = np.ones(len(data), dtype=bool)
+    for column, value in filters.items():
+        mask &= (data[column] == value).to_numpy()
+    report = serialize_report(AdvancedAnalytics(data[mask].reset_index(drop=True)).generate_report())
+    return filters, time.perf_counter() - start, report
+
+def write_outputs(results, output_dir, formats):
+    """Write one JSON/HTML file per segment and one Parquet table for the batch; returns the paths"""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for filters, seconds, report in results:
+        slug = segment_slug(filters)
+        if 'json' in formats:
+            path = output_dir / f"{slug}.json"
+            path.write_text(json.dumps({'segment': filters, 'seconds': seconds, **report},
+                                       ensure_ascii=False, indent=2), encoding='utf-8')
+            paths.append(path)
+        if 'html' in formats:
+            path = output_dir / f"{slug}.html"
+            path.write_text(render_html(segment_name(filters), report), encoding='utf-8')
+            paths.append(path)
+    if 'parquet' in formats:
+        table = pd.DataFrame([{
+            'segment': segment_name(filters),
+            'filters': json.dumps(filters, ensure_ascii=False),
+            'seconds': seconds,
+            **{f"kpi_{name}": value for name, value in report['kpis'].items()},
+            'anomalies': len(report['anomalies']),
+            'summary': report['summary'],
+            'report': json.dumps(report, ensure_ascii=False),
+        } for filters, seconds, report in results])
+        path = output_dir / "reports.parquet"
+        try:
+            table.to_parquet(path, index=False)
+        except ImportError as e:
+            raise ImportError("Parquet output requires the 'pyarrow' package (pip install pyarrow)") from e
+        paths.append(path)
+    return paths
+
+def run_batch(segments, database, workers=None, output_dir=None, formats=FORMATS, save=True):
+    """Generate every segment report in a process pool; returns (results, summary dict)
+
+    The rows are loaded once from the database and written to an Arrow
+    file that every worker memory-maps, so they share one copy (without
+    pyarrow, each worker receives its own pickled copy); reports are saved to analysis_history (through the single
+    writer) and written to output_dir when given.
+    """
+    start = time.perf_counter()
+    data = database.get_all_data()
+    workers = max(1, min(workers or os.cpu_count() or 1, len(segments)))
+    if workers == 1:
+        import warnings
+
+        _import_analytics()
+        with warnings.catch_warnings():
+            _ignore_undefined_score()
+            results = [run_report(filters, data) for filters in segments]
+    else:
+        # spawn: the parent may already run the writer thread
+        context = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory(prefix="olive_oil_reports_") as tmp:
+            source = share_dataset(data, tmp) if ARROW else data
+            with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                     initargs=(source,)) as pool:
+                results = list(pool.map(run_report, segments, chunksize=max(1, len(segments) // (workers * 4))))
+    compute_seconds = time.perf_counter() - start
+
+    if save:
+        futures = [database.save_analysis(ANALYSIS_TYPE, {'filters': filters}, json.dumps(report, ensure_ascii=False))
+                   for filters, _, report in results]
+        for future in futures:
+            future.result()
+    paths = write_outputs(results, output_dir, formats) if output_dir is not None else []
+
+    timings = np.array([seconds for _, seconds, _ in results])
+    total = time.perf_counter() - start
+    return results, {
+        'segments': len(results),
+        'workers': workers,
+        'seconds': total,
+        'compute_seconds': compute_seconds,
+        'reports_per_second': len(results) / total if total else float('inf'),
+        'segment_p50_seconds': float(np.percentile(timings, 50)) if len(timings) else 0.0,
+        'segment_p95_seconds': float(np.percentile(timings, 95)) if len(timings) else 0.0,
+        'segment_max_seconds': float(timings.max()) if len(timings) else 0.0,
+        'files': len(paths),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Rapports d'analyse en lot")
+    parser.add_argument('--db', default=os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"), help="Fichier de base")
+    parser.add_argument('--backend', default=os.environ.get("OLIVE_OIL_DB_BACKEND", "sqlite"),
+                        choices=['sqlite', 'duckdb'])
+    parser.add_argument('--by', nargs='+', default=list(FILTER_COLUMNS), choices=FILTER_COLUMNS,
+                        help="Un rapport par valeur de chacune de ces colonnes")
+    parser.add_argument('--segment', nargs='+', action='append', metavar='COLONNE=VALEUR',
+                        help="Segment explicite (répétable), remplace --by")
+    parser.add_argument('--combinations', action='store_true',
+                        help="Toutes les combinaisons de filtres non vides du dashboard")
+    parser.add_argument('--workers', type=int, default=None, help="Processus (défaut : un par cœur)")
+    parser.add_argument('--output', default=None, help="Dossier de sortie (défaut : reports/AAAAMMJJ_HHMMSS)")
+    parser.add_argument('--formats', nargs='+', default=list(FORMATS), choices=FORMATS, help="Fichiers à écrire")
+    parser.add_argument('--no-history', action='store_true', help="Ne pas enregistrer dans analysis_history")
+    args = parser.parse_args()
+
+    from database import OliveOilDatabase
+
+    database = OliveOilDatabase(args.db, args.backend)
+    if args.segment:
+        try:
+            segments = [parse_segment(tokens) for tokens in args.segment]
+        except ValueError as e:
+            print(f"❌ {e}")
+            return
+    elif args.combinations:
+        from dashboard import filter_combinations
+        segments = filter_combinations(database)
+    else:
+        segments = level_segments(database.aggregate(list(args.by), {'sales': 'count'}), args.by)
+
+    output = args.output or os.path.join("reports", datetime.now().strftime('%Y%m%d_%H%M%S'))
+    print(f"📋 {len(segments)} rapports à générer...")
+    results, summary = run_batch(segments, database, args.workers, output, args.formats, save=not args.no_history)
+
+    print(f"✅ {summary['segments']} rapports en {summary['seconds']:.1f}s avec {summary['workers']} processus "
+          f"({summary['reports_per_second']:.1f} rapports/s)")
+    print(f"⏱️ Par segment : médiane {summary['segment_p50_seconds'] * 1000:.0f} ms, "
+          f"P95 {summary['segment_p95_seconds'] * 1000:.0f} ms, max {summary['segment_max_seconds'] * 1000:.0f} ms")
+    slowest = sorted(results, key=lambda result: result[1], reverse=True)[:5]
+    for filters, seconds, _ in slowest:
+        print(f"   {segment_name(filters):<40} {seconds * 1000:8.0f} ms")
+    print(f"📁 {summary['files']} fichiers dans {output}")
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1042 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Benchmarks
+=====================================
+
+Chronomètre les méthodes publiques de OliveOilDatabase, AdvancedAnalytics
+et les agrégations du dashboard sur des données synthétiques, mesure les
+pics mémoire et compare les résultats à une référence enregistrée.
+
+Usage :
+    python benchmark.py suite --sizes 1000 10000 100000 --save-baseline
+    python benchmark.py suite --sizes 1000 10000 100000 --compare
+    python benchmark.py backends --rows 1000000 10000000 100000000
+    python benchmark.py writes --writers 50
+    python benchmark.py segments --countries 50 100 200
+    python benchmark.py anomalies --rows 100000 1000000
+    python benchmark.py timeseries --years 10 --segments 500
+    python benchmark.py forecast --series 100 1000 10000
+    python benchmark.py warmup --rows 100000 --workers 1 4
+    python benchmark.py figures --rows 10000 100000
+    python benchmark.py ai --segments 200 --concurrency 1 8 --latency 0.2
+    python benchmark.py ingest --files 20 --rows 50000 --workers 1 4
+    python benchmark.py xlsx --rows 10000 100000
+    python benchmark.py money --rows 1000000 10000000 100000000
+    python benchmark.py maintenance --rows 1000000 --purge 0.3
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from analytics import AdvancedAnalytics
+from data_generator import SalesGenerator
+from database import OliveOilDatabase
+
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Regressions smaller than this are considered timer noise
+NOISE_FLOOR_SECONDS = 0.005
+
+def write_xlsx(frame, path):
+    """Write a frame to a spreadsheet with openpyxl's write-only mode (much faster than to_excel)"""
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("ventes")
+    sheet.append(list(frame.columns))
+    for row in frame.itertuples(index=False, name=None):
+        sheet.append([value.item() if hasattr(value, 'item') else value for value in row])
+    workbook.save(path)
+
+class BenchmarkContext:
+    """Données partagées par tous les cas d'une même taille"""
+
+    def __init__(self, rows, workdir, backend='sqlite', seed=42):
+        self.rows = rows
+        self.workdir = workdir
+        self.generator = SalesGenerator(seed=seed)
+        self.data = self.generator.frame(rows)
+        self.csv_path = os.path.join(workdir, f"sales_{rows}.csv")
+        self.data.to_csv(self.csv_path, index=False)
+        self._xlsx_path = None
+        self.database = OliveOilDatabase(os.path.join(workdir, f"bench_{rows}.{backend}"), backend=backend)
+        self.database.load_data_from_csv(self.csv_path)
+        self.analytics = AdvancedAnalytics(self.data)
+        self.sale_id = int(self.database.get_all_data()['id'].iloc[0])
+
+    @property
+    def xlsx_path(self):
+        """Classeur des données, écrit au premier usage : seul le cas xlsx en a besoin"""
+        if self._xlsx_path is None:
+            path = os.path.join(self.workdir, f"sales_{self.rows}.xlsx")
+            write_xlsx(self.data, path)
+            self._xlsx_path = path
+        return self._xlsx_path
+
+# Registry of benchmark cases: name -> function(context)
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Décorateur enregistrant un cas de benchmark"""
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+# --- OliveOilDatabase -------------------------------------------------------
+
+@benchmark("OliveOilDatabase.load_data_from_csv")
+def bench_load_data_from_csv(ctx):
+    ctx.database.load_data_from_csv(ctx.csv_path)
+
+@benchmark("OliveOilDatabase.load_data_from_xlsx")
+def bench_load_data_from_xlsx(ctx):
+    # The first run also writes the workbook; the best time excludes it
+    ctx.database.load_data_from_xlsx(ctx.xlsx_path)
+
+@benchmark("OliveOilDatabase.ingest_frame")
+def bench_ingest_frame(ctx):
+    ctx.database.ingest_frame(ctx.data.iloc[:1000]).result()
+
+@benchmark("OliveOilDatabase.ingested_checksums")
+def bench_ingested_checksums(ctx):
+    ctx.database.ingested_checksums()
+
+@benchmark("OliveOilDatabase.get_all_data")
+def bench_get_all_data(ctx):
+    ctx.database.get_all_data()
+
+@benchmark("OliveOilDatabase.get_sales")
+def bench_get_sales(ctx):
+    ctx.database.get_sales(range(ctx.sale_id, ctx.sale_id + 1000))
+
+@benchmark("OliveOilDatabase.iter_data")
+def bench_iter_data(ctx):
+    for _ in ctx.database.iter_data(50_000):
+        pass
+
+@benchmark("OliveOilDatabase.get_statistics")
+def bench_get_statistics(ctx):
+    ctx.database.get_statistics()
+
+@benchmark("OliveOilDatabase.sketch_summary")
+def bench_sketch_summary(ctx):
+    ctx.database.sketch_summary()
+
+@benchmark("OliveOilDatabase.data_version")
+def bench_data_version(ctx):
+    ctx.database.data_version()
+
+@benchmark("OliveOilDatabase.data_versions")
+def bench_data_versions(ctx):
+    ctx.database.data_versions()
+
+@benchmark("OliveOilDatabase.daily_sales")
+def bench_daily_sales(ctx):
+    ctx.database.daily_sales()
+
+@benchmark("OliveOilDatabase.has_sale_dates")
+def bench_has_sale_dates(ctx):
+    ctx.database.has_sale_dates()
+
+@benchmark("OliveOilDatabase.max_sale_id")
+def bench_max_sale_id(ctx):
+    ctx.database.max_sale_id()
+
+@benchmark("OliveOilDatabase.subscribe")
+def bench_subscribe(ctx):
+    ctx.database.subscribe().close()
+
+@benchmark("OliveOilDatabase.first_sale_date_after")
+def bench_first_sale_date_after(ctx):
+    ctx.database.first_sale_date_after(ctx.sale_id)
+
+@benchmark("OliveOilDatabase.aggregate")
+def bench_aggregate(ctx):
+    ctx.database.aggregate(['country', 'type'], {'sales': 'sum', 'price': 'mean'})
+
+@benchmark("OliveOilDatabase.pivot")
+def bench_pivot(ctx):
+    ctx.database.pivot('country', 'year')
+
+@benchmark("OliveOilDatabase.add_sale")
+def bench_add_sale(ctx):
+    ctx.database.add_sale('Spain', 2024, 'Extra Virgin', 1000.0, 200.0, 5.0).result()
+
+@benchmark("OliveOilDatabase.update_sale")
+def bench_update_sale(ctx):
+    ctx.database.update_sale(ctx.sale_id, 'Spain', 2024, 'Extra Virgin', 1000.0, 200.0, 5.0).result()
+
+@benchmark("OliveOilDatabase.delete_sale")
+def bench_delete_sale(ctx):
+    # Deleting a missing id still exercises the lookup and commit
+    ctx.database.delete_sale(-1).result()
+
+@benchmark("OliveOilDatabase.save_analysis")
+def bench_save_analysis(ctx):
+    ctx.database.save_analysis("benchmark", {"filters": {}}, "x" * 2000).result()
+
+@benchmark("OliveOilDatabase.get_latest_analysis")
+def bench_get_latest_analysis(ctx):
+    ctx.database.get_latest_analysis("benchmark", {'country': 'Spain'})
+
+@benchmark("OliveOilDatabase.compact_history")
+def bench_compact_history(ctx):
+    ctx.database.compact_history().result()
+
+@benchmark("OliveOilDatabase.schema_version")
+def bench_schema_version(ctx):
+    ctx.database.schema_version()
+
+@benchmark("OliveOilDatabase.get_analysis_history")
+def bench_get_analysis_history(ctx):
+    ctx.database.get_analysis_history(10)
+
+# --- AdvancedAnalytics ------------------------------------------------------
+
+@benchmark("AdvancedAnalytics.calculate_kpis")
+def bench_calculate_kpis(ctx):
+    ctx.analytics.calculate_kpis()
+
+@benchmark("AdvancedAnalytics.calculate_kpis[chunked]")
+def bench_calculate_kpis_chunked(ctx):
+    # Same KPIs streamed from the database in bounded chunks
+    AdvancedAnalytics(ctx.database.iter_data(50_000)).calculate_kpis()
+
+@benchmark("AdvancedAnalytics.approximate_kpis")
+def bench_approximate_kpis(ctx):
+    AdvancedAnalytics(ctx.data, ctx.database).approximate_kpis()
+
+@benchmark("AdvancedAnalytics.segment_recommendations")
+def bench_segment_recommendations(ctx):
+    # Evaluation cost, without the per-version cache
+    from recommendations import engine
+    engine.clear()
+    ctx.analytics.segment_recommendations()
+
+@benchmark("AdvancedAnalytics.time_series")
+def bench_time_series(ctx):
+    AdvancedAnalytics(ctx.data, ctx.database).time_series()
+
+@benchmark("AdvancedAnalytics.calculate_growth_rate")
+def bench_calculate_growth_rate(ctx):
+    ctx.analytics.calculate_growth_rate('sales')
+
+@benchmark("AdvancedAnalytics.detect_anomalies")
+def bench_detect_anomalies(ctx):
+    ctx.analytics.detect_anomalies()
+
+@benchmark("AdvancedAnalytics.detect_anomalies[mad]")
+def bench_detect_anomalies_mad(ctx):
+    ctx.analytics.detect_anomalies(method='mad')
+
+@benchmark("AdvancedAnalytics.predict_sales")
+def bench_predict_sales(ctx):
+    ctx.analytics.predict_sales()
+
+@benchmark("AdvancedAnalytics.predict_sales[holt_winters]")
+def bench_predict_sales_holt_winters(ctx):
+    ctx.analytics.predict_sales(method='holt_winters')
+
+@benchmark("AdvancedAnalytics.forecast_segments")
+def bench_forecast_segments(ctx):
+    # No dated sales in the suite data: measures the early exit
+    AdvancedAnalytics(ctx.data, ctx.database).forecast_segments()
+
+@benchmark("AdvancedAnalytics.generate_recommendations")
+def bench_generate_recommendations(ctx):
+    ctx.analytics.generate_recommendations()
+
+@benchmark("AdvancedAnalytics.create_heatmap")
+def bench_create_heatmap(ctx):
+    ctx.analytics.create_heatmap()
+
+@benchmark("AdvancedAnalytics.create_3d_scatter")
+def bench_create_3d_scatter(ctx):
+    ctx.analytics.create_3d_scatter()
+
+@benchmark("AdvancedAnalytics.generate_summary")
+def bench_generate_summary(ctx):
+    ctx.analytics.generate_summary()
+
+@benchmark("AdvancedAnalytics.generate_report")
+def bench_generate_report(ctx):
+    ctx.analytics.generate_report()
+
+# --- Dashboard --------------------------------------------------------------
+
+@benchmark("dashboard.filtres")
+def bench_dashboard_filters(ctx):
+    df = ctx.data
+    df[(df['country'] == 'Spain') & (df['type'] == 'Extra Virgin')]
+
+@benchmark("dashboard.agregations")
+def bench_dashboard_aggregations(ctx):
+    # Same group-bys as the Dashboard and Prévisions tabs of app.py
+    df = ctx.data
+    df.groupby('country')['sales'].sum()
+    df.groupby('year')['sales'].sum()
+    df.groupby('type')['sales'].sum()
+    df.groupby('year').agg({'sales': 'sum', 'volume': 'sum', 'price': 'mean'})
+
+def missing_benchmarks():
+    """Méthodes publiques qui n'ont pas encore de cas de benchmark"""
+    missing = []
+    for cls in (OliveOilDatabase, AdvancedAnalytics):
+        for name, _ in inspect.getmembers(cls, inspect.isfunction):
+            if not name.startswith('_') and f"{cls.__name__}.{name}" not in BENCHMARKS:
+                missing.append(f"{cls.__name__}.{name}")
+    return missing
+
+def measure(func, ctx, repeat):
+    """Durées (meilleure et médiane) puis pic mémoire Python d'un cas"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(ctx)
+        durations.append(time.perf_counter() - start)
+
+    # Memory is measured on a separate run because tracing slows everything down
+    tracemalloc.start()
+    func(ctx)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'min_seconds': durations[0],
+        'median_seconds': durations[len(durations) // 2],
+        'peak_memory_bytes': peak,
+    }
+
+def run_suite(sizes, repeat=3, selected=None, backend='sqlite'):
+    """Exécuter tous les cas (ou ceux demandés) pour chaque taille"""
+    results = {}
+    for rows in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            ctx = BenchmarkContext(rows, tmp, backend)
+            for name, func in BENCHMARKS.items():
+                if selected and not any(pattern in name for pattern in selected):
+                    continue
+                results[f"{name}[{rows}]"] = measure(func, ctx, repeat)
+                print(f"✅ {name} [{rows:,}] : {results[f'{name}[{rows}]']['min_seconds'] * 1000:.1f} ms")
+            ctx.database.close()
+    return results
+
+def compare(results, baseline, tolerance):
+    """Lister les cas plus lents ou plus gourmands que la référence"""
+    regressions = []
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        ref_time, cur_time = reference['min_seconds'], current['min_seconds']
+        if cur_time > ref_time * (1 + tolerance) and cur_time - ref_time > NOISE_FLOOR_SECONDS:
+            regressions.append(f"{key}: {ref_time * 1000:.1f} ms -> {cur_time * 1000:.1f} ms")
+        ref_mem, cur_mem = reference['peak_memory_bytes'], current['peak_memory_bytes']
+        if cur_mem > ref_mem * (1 + tolerance) and cur_mem - ref_mem > 1_000_000:
+            regressions.append(f"{key}: mémoire {ref_mem / 1e6:.1f} Mo -> {cur_mem / 1e6:.1f} Mo")
+    return regressions
+
+def bench_backends(sizes, backends=('sqlite', 'duckdb')):
+    """Charger chaque taille dans chaque moteur et chronométrer les agrégations"""
+    results = []
+    for rows in sizes:
+        for backend in backends:
+            with tempfile.TemporaryDirectory() as tmp:
+                database = OliveOilDatabase(os.path.join(tmp, f"bench.{backend}"), backend=backend)
+
+                def load():
+                    conn = database.backend.connect()
+                    for chunk in SalesGenerator().chunks(rows):
+                        database.backend.insert_frame(conn, 'sales', chunk)
+                    conn.commit()
+                    conn.close()
+
+                queries = {
+                    'chargement': load,
+                    'get_statistics': database.get_statistics,
+                    'ventes_par_pays': lambda: database.aggregate('country'),
+                    'ventes_par_annee': lambda: database.aggregate('year'),
+                    'prix_moyen_pays_type': lambda: database.aggregate(['country', 'type'], {'price': 'mean'}),
+                    'pivot_pays_annee': lambda: database.pivot('country', 'year'),
+                }
+                for name, query in queries.items():
+                    start = time.perf_counter()
+                    query()
+                    results.append({'backend': backend, 'rows': rows, 'operation': name,
+                                    'seconds': time.perf_counter() - start})
+                print(f"✅ {backend}: {rows:,} lignes")
+
+    return pd.DataFrame(results)
+
+def bench_concurrent_writes(writers=50, writes_per_writer=100):
+    """Écritures/s avec N écrivains concurrents : connexion par écriture vs file d'écriture unique"""
+    import sqlite3
+    import threading
+    
+    results = []
+    for mode in ('connexion_par_ecriture', 'file_unique'):
+        with tempfile.TemporaryDirectory() as tmp:
+            database = OliveOilDatabase(os.path.join(tmp, "writes.db"))
+            errors = []
+            read_latencies = []
+            stop_reading = threading.Event()
+            
+            def direct_writer():
+                for _ in range(writes_per_writer):
+                    try:
+                        conn = sqlite3.connect(database.db_path, timeout=30)
+                        conn.execute("INSERT INTO sales (country, year, type, sales, volume, price, "
+                                     "sales_cents, price_millis) "
+                                     "VALUES ('Spain', 2024, 'Pure', 10.0, 2.0, 5.0, 1000, 5000)")
+                        conn.commit()
+                        conn.close()
+                    except sqlite3.OperationalError as e:
+                        errors.append(str(e))
+            
+            def queued_writer():
+                futures = [database.add_sale('Spain', 2024, 'Pure', 10.0, 2.0, 5.0)
+                           for _ in range(writes_per_writer)]
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(str(e))
+            
+            def reader():
+                while not stop_reading.is_set():
+                    start = time.perf_counter()
+                    database.get_statistics()
+                    read_latencies.append(time.perf_counter() - start)
+            
+            target = direct_writer if mode == 'connexion_par_ecriture' else queued_writer
+            threads = [threading.Thread(target=target) for _ in range(writers)]
+            reader_thread = threading.Thread(target=reader)
+            reader_thread.start()
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            stop_reading.set()
+            reader_thread.join()
+            
+            written = database.get_statistics()['total_records']
+            database.close()
+            results.append({
+                'mode': mode,
+                'ecritures': written,
+                'erreurs': len(errors),
+                'ecritures_par_s': written / elapsed,
+                'lecture_max_ms': max(read_latencies, default=0) * 1000,
+            })
+            print(f"✅ {mode}: {written / elapsed:,.0f} écritures/s")
+    return pd.DataFrame(results)
+
+def bench_segments(countries_counts=(50, 100, 200), types=10, rows=200_000, repeat=3):
+    """Segments/s du moteur de recommandations (pays, types et pays × types)"""
+    from recommendations import RecommendationEngine, segment_table
+    
+    results = []
+    for countries in countries_counts:
+        generator = SalesGenerator(countries=countries, types=types)
+        data = generator.frame(rows)
+        yearly = data.groupby(['country', 'type', 'year']).agg(
+            sales=('sales', 'sum'), volume=('volume', 'sum'), price_sum=('price', 'sum'), rows=('price', 'size')
+        ).reset_index()
+        engine = RecommendationEngine()
+        
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            table = segment_table(yearly)
+            recommendations = engine.evaluate(table)
+            timings.append(time.perf_counter() - start)
+        best = min(timings)
+        
+        engine.recommend(yearly, version=1)
+        start = time.perf_counter()
+        engine.recommend(yearly, version=1)
+        cached = time.perf_counter() - start
+        
+        results.append({
+            'segments': len(table),
+            'recommendations': len(recommendations),
+            'seconds': best,
+            'segments_per_second': len(table) / best,
+            'cached_seconds': cached,
+        })
+    return pd.DataFrame(results)
+
+def bench_anomaly_detectors(rows_list=(100_000, 1_000_000), anomaly_rate=0.01):
+    """Précision, rappel et durée des détecteurs d'anomalies sur des anomalies injectées"""
+    results = []
+    for rows in rows_list:
+        data = SalesGenerator(anomaly_rate=anomaly_rate).frame(rows, labels=True)
+        injected = data.pop('injected_anomaly').to_numpy()
+        analytics = AdvancedAnalytics(data)
+        
+        detectors = [
+            # IsolationForest gets the true contamination rate, its best case
+            ('isolation_forest', {'contamination': anomaly_rate}),
+            ('mad', {}),
+            ('iqr', {}),
+            ('mad', {'by': ('country', 'type', 'year')}),
+            ('iqr', {'by': ('country', 'type', 'year')}),
+        ]
+        for method, options in detectors:
+            start = time.perf_counter()
+            flagged = analytics.detect_anomalies(method=method, **options)['is_anomaly'].to_numpy()
+            seconds = time.perf_counter() - start
+            true_positives = int((flagged & injected).sum())
+            precision = true_positives / max(int(flagged.sum()), 1)
+            recall = true_positives / max(int(injected.sum()), 1)
+            results.append({
+                'rows': rows,
+                'method': method + (f" par {' × '.join(options['by'])}" if 'by' in options else ""),
+                'seconds': seconds,
+                'precision': precision,
+                'recall': recall,
+                'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.0,
+            })
+    return pd.DataFrame(results)
+
+def bench_timeseries(years=10, segments=500, seed=42):
+    """Moteur de séries temporelles : construction, fenêtres et ajout incrémental d'un jour"""
+    from timeseries import TimeSeriesEngine
+    
+    rng = np.random.default_rng(seed)
+    days = pd.date_range("2015-01-01", periods=365 * years, freq='D')
+    segment = np.tile(np.arange(segments), len(days))
+    daily = pd.DataFrame({
+        'sale_date': np.repeat(days.values, segments),
+        'country': pd.Categorical(segment // 10).rename_categories(lambda i: f"Country-{i:03d}"),
+        'type': pd.Categorical(segment % 10).rename_categories(lambda i: f"Type-{i}"),
+        'sales': rng.lognormal(6, 0.5, len(segment)),
+    })
+    new_day = daily[daily['sale_date'] == days[-1]].assign(sale_date=days[-1] + pd.Timedelta(days=1))
+    
+    def windows(engine):
+        engine.resample('M')
+        engine.resample('Q')
+        engine.rolling_mean(30)
+        engine.yoy('M')
+    
+    timings = {}
+    start = time.perf_counter()
+    engine = TimeSeriesEngine.from_frame(daily)
+    timings['construction'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    windows(engine)
+    timings['fenetres (froid)'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    windows(engine)
+    timings['fenetres (cache)'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    engine.update(new_day)
+    windows(engine)
+    timings['ajout d\'un jour (incrémental)'] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    windows(TimeSeriesEngine.from_frame(pd.concat([daily, new_day], ignore_index=True)))
+    timings['ajout d\'un jour (recalcul complet)'] = time.perf_counter() - start
+    
+    return pd.DataFrame({
+        'operation': list(timings),
+        'seconds': list(timings.values()),
+        'points': len(daily),
+    })
+
+def bench_forecasting(series_counts=(100, 1_000, 10_000), periods=120, horizon=12, seed=42):
+    """Ajustements/s : Holt-Winters vectorisé sur toutes les séries vs LinearRegression série par série"""
+    from sklearn.linear_model import LinearRegression
+    from forecasting import HoltWinters
+    
+    rng = np.random.default_rng(seed)
+    results = []
+    for count in series_counts:
+        t = np.arange(periods)[:, None]
+        values = (1000 + rng.uniform(-5, 5, count) * t + rng.uniform(0, 200, count) * np.sin(2 * np.pi * t / 12)
+                  + rng.normal(0, 20, (periods, count)))
+        model = HoltWinters(season_length=12)
+        
+        start = time.perf_counter()
+        state = model.fit(values)
+        model.forecast(state, horizon)
+        holt_winters = time.perf_counter() - start
+        
+        # Warm start: one new month for every series
+        start = time.perf_counter()
+        model.forecast(model.update(state, values[-1:]), horizon)
+        warm_start = time.perf_counter() - start
+        
+        # Existing path: one LinearRegression per series (capped, then extrapolated)
+        sample = min(count, 1_000)
+        X = np.arange(periods).reshape(-1, 1)
+        future = np.arange(periods, periods + horizon).reshape(-1, 1)
+        start = time.perf_counter()
+        for i in range(sample):
+            LinearRegression().fit(X, values[:, i]).predict(future)
+        linear = (time.perf_counter() - start) * count / sample
+        
+        for method, seconds in (('holt_winters (grille de %d paramètres)' % len(model.grid), holt_winters),
+                                ('holt_winters (reprise à chaud)', warm_start),
+                                ('linear_regression (boucle)', linear)):
+            results.append({'series': count, 'method': method, 'seconds': seconds, 'fits_per_second': count / seconds})
+    return pd.DataFrame(results)
+
+def bench_ai_batch(segments=200, concurrency_list=(1, 8), latency=0.2, failure_rate=0.05):
+    """Résumés IA par segment contre le modèle simulé : débit selon la concurrence, prompts dédupliqués"""
+    from ai_batch import BatchSummarizer, MockModel, segment_prompts
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = OliveOilDatabase(os.path.join(tmp, "bench.db"))
+        conn = database.backend.connect()
+        # Enough countries and types for the requested number of segments
+        generator = SalesGenerator(countries=max(segments - 10, 1), types=10)
+        database.backend.insert_frame(conn, 'sales', generator.frame(max(segments * 50, 10_000)))
+        conn.commit()
+        conn.close()
+        prompts = segment_prompts(database)
+        # The same segment asked twice, as when two teams request overlapping batches
+        prompts = prompts + prompts[:len(prompts) // 4]
+        
+        for concurrency in concurrency_list:
+            model = MockModel(latency=latency, failure_rate=failure_rate)
+            summarizer = BatchSummarizer(model, concurrency, retries=3, backoff=0.05, database=database)
+            start = time.perf_counter()
+            summaries = summarizer.summarize(prompts)
+            seconds = time.perf_counter() - start
+            results.append({
+                'concurrency': concurrency,
+                'segments': len(prompts),
+                'model_calls': model.calls,
+                'failed': int(summaries['error'].notna().sum()),
+                'seconds': seconds,
+                'summaries_per_second': len(prompts) / seconds,
+            })
+        database.close()
+    return pd.DataFrame(results)
+
+def bench_figures(rows_list=(10_000, 100_000), repeat=3):
+    """Graphiques : construction Plotly Express vs JSON en cache, jusqu'à la spec envoyée par Streamlit"""
+    import plotly.express as px
+    import plotly.io as pio
+    from figure_cache import figure_from_json, serialize
+    
+    def to_spec(figure):
+        # What st.plotly_chart does with a Figure
+        return pio.to_json(figure.to_dict(), validate=False)
+    
+    results = []
+    for rows in rows_list:
+        data = SalesGenerator().frame(rows)
+        by_country = data.groupby('country', as_index=False)['sales'].sum()
+        by_year = data.groupby('year', as_index=False)['sales'].sum()
+        by_type = data.groupby('type', as_index=False)['sales'].sum()
+        charts = {
+            'bar': lambda: px.bar(by_country, x='country', y='sales'),
+            'line': lambda: px.line(by_year, x='year', y='sales'),
+            'pie': lambda: px.pie(by_type, values='sales', names='type'),
+            'imshow': lambda: px.imshow(data.pivot_table(values='sales', index='country', columns='year',
+                                                         aggfunc='sum').fillna(0)),
+            'scatter_3d': lambda: px.scatter_3d(data, x='sales', y='volume', z='price', color='country', size='sales'),
+        }
+        for chart, build in charts.items():
+            cached = serialize(build())
+            timings = {'construite': [], 'depuis le cache': []}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                to_spec(build())
+                timings['construite'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                to_spec(figure_from_json(cached))
+                timings['depuis le cache'].append(time.perf_counter() - start)
+            results.append({'rows': rows, 'chart': chart, 'json_bytes': len(cached),
+                            'built_seconds': min(timings['construite']),
+                            'cached_seconds': min(timings['depuis le cache'])})
+    frame = pd.DataFrame(results)
+    frame['speedup'] = frame['built_seconds'] / frame['cached_seconds']
+    return frame
+
+def bench_money(rows_list=(1_000_000, 10_000_000), sql_rows=1_000_000, backends=('sqlite', 'duckdb')):
+    """Montants : sommes float64 vs centimes int64 (vitesse et écart au total exact), en mémoire puis en SQL"""
+    from decimal import Decimal
+    from storage import to_fixed
+    
+    def error(total, exact_cents):
+        # Distance in euros between a float total and the exact decimal total
+        return float(abs(Decimal(total) - Decimal(exact_cents) / 100))
+    
+    def timed_call(func):
+        start = time.perf_counter()
+        value = func()
+        return value, time.perf_counter() - start
+    
+    results = []
+    for rows in rows_list:
+        # Filled chunk by chunk: at 100M rows the two arrays take 1.6 GB
+        sales = np.empty(rows, dtype=np.float64)
+        offset = 0
+        for chunk in SalesGenerator().chunks(rows):
+            sales[offset:offset + len(chunk)] = chunk['sales'].to_numpy()
+            offset += len(chunk)
+        cents, conversion = timed_call(lambda: to_fixed(sales, 100))
+        exact = int(cents.sum())
+        
+        def streamed():
+            # Per-chunk partial sums folded in order, as chunked aggregations do
+            return sum(float(sales[start:start + 100_000].sum()) for start in range(0, rows, 100_000))
+        
+        cases = {
+            'float64 (numpy, par paires)': lambda: float(sales.sum()),
+            'float64 (cumul par blocs)': streamed,
+            'int64 centimes': lambda: int(cents.sum()) / 100,
+        }
+        for name, func in cases.items():
+            total, seconds = timed_call(func)
+            results.append({'rows': rows, 'mode': 'mémoire', 'case': name, 'seconds': seconds,
+                            'error_euros': 0.0 if name == 'int64 centimes' else error(total, exact)})
+        results.append({'rows': rows, 'mode': 'mémoire', 'case': 'conversion en centimes',
+                        'seconds': conversion, 'error_euros': 0.0})
+        del sales, cents
+        print(f"✅ mémoire : {rows:,} lignes")
+    
+    for backend in backends:
+        with tempfile.TemporaryDirectory() as tmp:
+            database = OliveOilDatabase(os.path.join(tmp, f"money.{backend}"), backend=backend)
+            conn = database.backend.connect()
+            for chunk in SalesGenerator().chunks(sql_rows):
+                database.backend.insert_frame(conn, 'sales', chunk)
+            conn.commit()
+            conn.close()
+            exact = database.backend.query_df(
+                "SELECT country, SUM(sales_cents) AS cents FROM sales GROUP BY country ORDER BY country")
+            queries = {
+                'SUM(sales) REAL': "SELECT country, SUM(sales) AS total FROM sales GROUP BY country ORDER BY country",
+                'SUM(sales_cents) BIGINT': "SELECT country, SUM(sales_cents) / 100.0 AS total FROM sales "
+                                           "GROUP BY country ORDER BY country",
+            }
+            for name, sql in queries.items():
+                totals, seconds = timed_call(lambda: database.backend.query_df(sql))
+                results.append({'rows': sql_rows, 'mode': backend, 'case': name, 'seconds': seconds,
+                                'error_euros': max(error(total, int(cents)) for total, cents
+                                                   in zip(totals['total'], exact['cents']))
+                                               if 'REAL' in name else 0.0})
+            database.close()
+        print(f"✅ {backend} : {sql_rows:,} lignes")
+    return pd.DataFrame(results)
+
+def bench_xlsx(rows_list=(10_000, 100_000), batch_size=50_000):
+    """Import Excel : pd.read_excel vs lecture en flux par lots (durée et pic mémoire Python)"""
+    from ingestion import iter_xlsx, validate_sales
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in rows_list:
+            path = os.path.join(tmp, f"ventes_{rows}.xlsx")
+            write_xlsx(SalesGenerator().frame(rows), path)
+            runs = {'count': 0}
+            
+            def streamed(_):
+                for batch in iter_xlsx(path, batch_size=batch_size):
+                    validate_sales(batch)
+            
+            def imported(_):
+                # A fresh database each time, so every run inserts all the rows
+                runs['count'] += 1
+                database = OliveOilDatabase(os.path.join(tmp, f"xlsx_{rows}_{runs['count']}.db"))
+                database.load_data_from_xlsx(path, batch_size=batch_size)
+                database.close()
+            
+            cases = {
+                'pd.read_excel': lambda _: pd.read_excel(path),
+                'iter_xlsx + validation': streamed,
+                'load_data_from_xlsx (base SQLite)': imported,
+            }
+            for name, func in cases.items():
+                timing = measure(func, None, repeat=1)
+                results.append({'rows': rows, 'case': name, 'seconds': timing['min_seconds'],
+                                'rows_per_second': rows / timing['min_seconds'],
+                                'peak_memory_mb': timing['peak_memory_bytes'] / 1e6})
+            print(f"✅ {rows:,} lignes")
+    return pd.DataFrame(results)
+
+def bench_ingestion(files=20, rows_per_file=50_000, workers_list=(1, os.cpu_count() or 1), overlap=0.1):
+    """Ingestion d'un dossier de CSV (avec des lignes en double entre fichiers) : fichiers/s et lignes/s"""
+    from ingestion import ingest, scan
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = Path(tmp) / "depots"
+        folder.mkdir()
+        data = SalesGenerator().frame(files * rows_per_file)
+        step = int(rows_per_file * (1 - overlap))
+        # Each file repeats the last rows of the previous one
+        for index in range(files):
+            data.iloc[index * step:index * step + rows_per_file].to_csv(folder / f"ventes_{index:03d}.csv", index=False)
+        
+        for workers in sorted(set(workers_list)):
+            database = OliveOilDatabase(os.path.join(tmp, f"ingest_{workers}.db"))
+            summary = ingest(database, scan(folder), workers)
+            rerun = ingest(database, scan(folder), workers)
+            results.append({'workers': workers, 'files': summary['files'], 'rows': summary['rows'],
+                            'inserted': summary['inserted'], 'duplicates': summary['duplicates'],
+                            'seconds': summary['seconds'], 'files_per_second': summary['files_per_second'],
+                            'rows_per_second': summary['rows_per_second'],
+                            'rerun_seconds': rerun['seconds']})
+            database.close()
+    return pd.DataFrame(results)
+
+def bench_maintenance(rows=1_000_000, purge=0.3):
+    """Maintenance après la purge des plus anciennes années : durée de chaque tâche, lectures concurrentes, fichier"""
+    import threading
+    from maintenance import TASKS, Maintenance
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        database = OliveOilDatabase(os.path.join(tmp, "bench.db"))
+        for chunk in SalesGenerator().chunks(rows, 200_000):
+            database.ingest_frame(chunk).result()
+        counts = database.aggregate('year', {'sales': 'count'})
+        share = counts['sales'].cumsum() / counts['sales'].sum()
+        cutoff = int(counts['year'][share >= purge].iloc[0])
+        database.writer.execute("DELETE FROM sales WHERE year < ?", (cutoff,)).result()
+        maintenance = Maintenance(database)
+        
+        def read(stop, latencies):
+            while not stop.is_set():
+                start = time.perf_counter()
+                database.aggregate('country', {'sales': 'sum'}, {'year': cutoff})
+                latencies.append(time.perf_counter() - start)
+        
+        def record(case, task=None):
+            stop, latencies = threading.Event(), []
+            reader = threading.Thread(target=read, args=(stop, latencies))
+            reader.start()
+            start = time.perf_counter()
+            if task is None:
+                time.sleep(1.0)
+            else:
+                maintenance.run(force=True, tasks=(task,))
+            seconds = time.perf_counter() - start
+            stop.set()
+            reader.join()
+            status = maintenance.status()
+            results.append({'case': case, 'seconds': seconds, 'reads': len(latencies),
+                            'read_p50_ms': np.median(latencies) * 1000, 'read_max_ms': np.max(latencies) * 1000,
+                            'file_mb': status['file_bytes'] / 1e6, 'wal_mb': status['wal_bytes'] / 1e6,
+                            'fragmentation': status['fragmentation']})
+        
+        record(f"après purge < {cutoff} (lectures seules)")
+        for task in TASKS:
+            record(task, task)
+        database.close()
+    return pd.DataFrame(results)
+
+def bench_dashboard_warmup(rows=100_000, workers_list=(1, os.cpu_count() or 1)):
+    """Préchauffage du cache du dashboard, puis premier clic calculé vs servi par le cache"""
+    from dashboard import DashboardCache, compute_dashboard, warmup
+    
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        database = OliveOilDatabase(path)
+        conn = database.backend.connect()
+        for chunk in SalesGenerator().chunks(rows):
+            database.backend.insert_frame(conn, 'sales', chunk)
+        conn.commit()
+        conn.close()
+        
+        for workers in sorted(set(workers_list)):
+            database.writer.execute("DELETE FROM dashboard_cache").result()
+            summary = warmup(path, workers=workers)
+            results.append({'operation': f"préchauffage ({summary['combinations']} combinaisons)",
+                            'workers': workers, 'seconds': summary['seconds']})
+        
+        filters = {'year': int(database.aggregate('year')['year'].iloc[0])}
+        frame = database.get_all_data()
+        frame = frame[frame['year'] == filters['year']]
+        clicks = {
+            'premier clic sans cache': lambda: compute_dashboard(database, filters, frame),
+            'premier clic (table dashboard_cache)': lambda: DashboardCache().get(database, filters, frame),
+        }
+        cache = DashboardCache()
+        cache.get(database, filters, frame)
+        clicks['clic suivant (mémoire)'] = lambda: cache.get(database, filters, frame)
+        for name, click in clicks.items():
+            start = time.perf_counter()
+            click()
+            results.append({'operation': name, 'workers': 1, 'seconds': time.perf_counter() - start})
+        database.close()
+    return pd.DataFrame(results)
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Benchmarks Olive Oil Tracker Pro")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    suite = commands.add_parser('suite', help="Chronométrer toutes les méthodes publiques")
+    suite.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                       help="Tailles des jeux de données synthétiques")
+    suite.add_argument('--repeat', type=int, default=3, help="Nombre de répétitions par cas")
+    suite.add_argument('--only', nargs='+', help="Ne lancer que les cas contenant ces noms")
+    suite.add_argument('--backend', default='sqlite', help="Moteur de stockage")
+    suite.add_argument('--output', help="Fichier JSON des résultats")
+    suite.add_argument('--baseline', default=BASELINE_FILE, help="Fichier de référence")
+    suite.add_argument('--save-baseline', action='store_true', help="Enregistrer les résultats comme référence")
+    suite.add_argument('--compare', action='store_true', help="Échouer en cas de régression")
+    suite.add_argument('--tolerance', type=float, default=0.25, help="Régression tolérée (0.25 = +25 %%)")
+
+    backends = commands.add_parser('backends', help="Comparer les moteurs de stockage")
+    backends.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000, 100_000_000],
+                          help="Tailles des jeux de données synthétiques")
+    backends.add_argument('--backends', nargs='+', default=['sqlite', 'duckdb'],
+                          help="Moteurs de stockage à comparer")
+    writes = commands.add_parser('writes', help="Écritures concurrentes")
+    writes.add_argument('--writers', type=int, default=50, help="Nombre d'écrivains concurrents")
+    writes.add_argument('--writes', type=int, default=100, help="Écritures par écrivain")
+    anomalies = commands.add_parser('anomalies', help="Précision et vitesse des détecteurs d'anomalies")
+    anomalies.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000],
+                           help="Tailles des jeux de données synthétiques")
+    anomalies.add_argument('--anomaly-rate', type=float, default=0.01, help="Taux d'anomalies injectées")
+    timeseries = commands.add_parser('timeseries', help="Moteur de séries temporelles journalières")
+    timeseries.add_argument('--years', type=int, default=10, help="Nombre d'années journalières")
+    timeseries.add_argument('--segments', type=int, default=500, help="Nombre de segments")
+    ai = commands.add_parser('ai', help="Résumés IA par segment (modèle simulé)")
+    ai.add_argument('--segments', type=int, default=200, help="Nombre approximatif de segments")
+    ai.add_argument('--concurrency', type=int, nargs='+', default=[1, 8], help="Appels simultanés")
+    ai.add_argument('--latency', type=float, default=0.2, help="Latence simulée d'un appel (s)")
+    figures = commands.add_parser('figures', help="Graphiques construits vs servis depuis le cache")
+    figures.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000], help="Nombres de lignes")
+    warm = commands.add_parser('warmup', help="Préchauffage du cache du dashboard")
+    warm.add_argument('--rows', type=int, default=100_000, help="Nombre de lignes")
+    warm.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help="Nombres de processus")
+    forecast = commands.add_parser('forecast', help="Débit des ajustements de prévision")
+    forecast.add_argument('--series', type=int, nargs='+', default=[100, 1_000, 10_000], help="Nombres de séries")
+    forecast.add_argument('--periods', type=int, default=120, help="Longueur des séries (mois)")
+    ingest = commands.add_parser('ingest', help="Ingestion parallèle d'un dossier de fichiers")
+    ingest.add_argument('--files', type=int, default=20, help="Nombre de fichiers CSV")
+    ingest.add_argument('--rows', type=int, default=50_000, help="Lignes par fichier")
+    ingest.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count() or 1], help="Nombres de processus")
+    xlsx = commands.add_parser('xlsx', help="Import Excel : pd.read_excel vs lecture en flux")
+    xlsx.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000], help="Nombres de lignes")
+    xlsx.add_argument('--batch-size', type=int, default=50_000, help="Lignes par lot")
+    money = commands.add_parser('money', help="Sommes de montants : float64 vs centimes int64")
+    money.add_argument('--rows', type=int, nargs='+', default=[1_000_000, 10_000_000],
+                       help="Tailles des sommes en mémoire")
+    money.add_argument('--sql-rows', type=int, default=1_000_000, help="Lignes chargées pour les sommes SQL")
+    maintenance = commands.add_parser('maintenance', help="Tâches de maintenance SQLite après une purge")
+    maintenance.add_argument('--rows', type=int, default=1_000_000, help="Nombre de lignes")
+    maintenance.add_argument('--purge', type=float, default=0.3, help="Part des lignes supprimées avant la maintenance")
+    segments = commands.add_parser('segments', help="Débit du moteur de recommandations par segment")
+    segments.add_argument('--countries', type=int, nargs='+', default=[50, 100, 200], help="Nombres de pays")
+    segments.add_argument('--types', type=int, default=10, help="Nombre de types d'huile")
+    args = parser.parse_args()
+
+    print("🫒 Olive Oil Tracker Pro - Benchmarks")
+    print("=" * 50)
+
+    if args.command == 'backends':
+        results = bench_backends(args.rows, args.backends)
+        table = results.pivot_table(index=['rows', 'operation'], columns='backend', values='seconds')
+        print(table.round(3).to_string())
+        return
+
+    if args.command == 'writes':
+        print(bench_concurrent_writes(args.writers, args.writes).round(1).to_string(index=False))
+        return
+    
+    if args.command == 'anomalies':
+        print(bench_anomaly_detectors(args.rows, args.anomaly_rate).round(3).to_string(index=False))
+        return
+    
+    if args.command == 'timeseries':
+        print(bench_timeseries(args.years, args.segments).round(4).to_string(index=False))
+        return
+    
+    if args.command == 'ai':
+        print(bench_ai_batch(args.segments, args.concurrency, args.latency).round(3).to_string(index=False))
+        return
+    
+    if args.command == 'figures':
+        print(bench_figures(args.rows).round(4).to_string(index=False))
+        return
+    
+    if args.command == 'warmup':
+        print(bench_dashboard_warmup(args.rows, args.workers).round(4).to_string(index=False))
+        return
+    
+    if args.command == 'forecast':
+        print(bench_forecasting(args.series, args.periods).round(4).to_string(index=False))
+        return
+    
+    if args.command == 'ingest':
+        print(bench_ingestion(args.files, args.rows, args.workers).round(2).to_string(index=False))
+        return
+    
+    if args.command == 'xlsx':
+        print(bench_xlsx(args.rows, args.batch_size).round(3).to_string(index=False))
+        return
+    
+    if args.command == 'money':
+        results = bench_money(args.rows, args.sql_rows)
+        print(results.to_string(index=False, formatters={'seconds': '{:.4f}'.format, 'error_euros': '{:.2e}'.format}))
+        return
+    
+    if args.command == 'maintenance':
+        print(bench_maintenance(args.rows, args.purge).round(3).to_string(index=False))
+        return
+    
+    if args.command == 'segments':
+        print(bench_segments(args.countries, args.types).round(4).to_string(index=False))
+        return
+
+    for name in missing_benchmarks():
+        print(f"⚠️ Pas de benchmark pour {name}")
+
+    results = run_suite(args.sizes, args.repeat, args.only, args.backend)
+    report = {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2))
+        print(f"💾 Référence enregistrée dans {args.baseline}")
+    if args.compare:
+        if not Path(args.baseline).exists():
+            print(f"❌ Référence {args.baseline} introuvable (lancez --save-baseline)")
+            sys.exit(2)
+        baseline = json.loads(Path(args.baseline).read_text())['results']
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ Régressions détectées :")
+            for regression in regressions:
+                print(f"   - {regression}")
+            sys.exit(1)
+        print("\n✅ Aucune régression par rapport à la référence")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from sketches import Moments
+from storage import FIXED_POINT, to_fixed
+
+GROUP_COLUMNS = ['country', 'year', 'type']
+MEASURE_COLUMNS = ['sales', 'volume', 'price']
+
+def iter_cursor(cursor, chunksize=100_000):
+    """Yield the rows of a DB-API cursor as DataFrames of at most chunksize rows"""
+    columns = [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            return
+        yield pd.DataFrame(rows, columns=columns)
+
+def iter_chunks(source, chunksize=100_000):
+    """Normalize a chunked source (cursor or iterable of DataFrames) to DataFrames"""
+    if hasattr(source, 'fetchmany'):
+        return iter_cursor(source, chunksize)
+    return iter(source)
+
+class SalesCube:
+    """Mergeable partial aggregates of a sales stream
+
+    Keeps one row of sums per (country, year, type), Welford moments per
+    measure and a bounded uniform sample, so memory depends on the number
+    of groups and not on the number of rows. Money sums are kept as int64
+    fixed-point units (see storage.FIXED_POINT) so merging chunks is exact.
+    """
+
+    def __init__(self, sample_size=5000, seed=42):
+        self.groups = None
+        self.moments = {column: Moments() for column in MEASURE_COLUMNS}
+        self.sample_size = sample_size
+        self.sample = None
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_chunks(cls, source, chunksize=100_000, sample_size=5000):
+        cube = cls(sample_size)
+        for chunk in iter_chunks(source, chunksize):
+            cube.add(chunk)
+        return cube
+
+    def add(self, chunk):
+        """Fold one chunk into the aggregates"""
+        if chunk.empty:
+            return self
+        fixed = {column: to_fixed(chunk[column], scale) for column, (_, scale) in FIXED_POINT.items()}
+        partial = chunk.assign(**fixed).groupby(GROUP_COLUMNS)[MEASURE_COLUMNS].sum()
+        partial['rows'] = chunk.groupby(GROUP_COLUMNS).size()
+        self._merge_groups(partial)
+        for column in MEASURE_COLUMNS:
+            self.moments[column].update(chunk[column].to_numpy())
+
+        # Reservoir sample: keep the rows with the smallest random priorities
+        candidates = chunk.assign(_priority=self._rng.random(len(chunk)))
+        if self.sample is not None:
+            candidates = pd.concat([self.sample, candidates], ignore_index=True)
+        self.sample = candidates.nsmallest(self.sample_size, '_priority')
+        return self
+
+    def merge(self, other):
+        """Merge the aggregates of another cube (e.g. built by another worker)"""
+        if other.groups is not None:
+            self._merge_groups(other.groups)
+        for column in MEASURE_COLUMNS:
+            self.moments[column].merge(other.moments[column])
+        if other.sample is not None:
+            candidates = other.sample if self.sample is None else pd.concat([self.sample, other.sample], ignore_index=True)
+            self.sample = candidates.nsmallest(self.sample_size, '_priority')
+        return self
+
+    def _merge_groups(self, partial):
+        if self.groups is None:
+            self.groups = partial
+        else:
+            self.groups = pd.concat([self.groups, partial]).groupby(level=GROUP_COLUMNS).sum()
+
+    def totals(self):
+        """Group sums with money converted back to euros"""
+        totals = self.groups.copy()
+        for column, (_, scale) in FIXED_POINT.items():
+            totals[column] = totals[column] / scale
+        return totals
+
+    @property
+    def rows(self):
+        return int(self.groups['rows'].sum()) if self.groups is not None else 0
+
+    def stat(self, column, func):
+        """Whole-column statistic: sum/mean/std/min/max of a measure, min/max/nunique of a dimension"""
+        if column in GROUP_COLUMNS:
+            values = self.groups.index.get_level_values(column)
+            return values.nunique() if func == 'nunique' else getattr(values, func)()
+        if func == 'sum':
+            total = self.groups[column].sum()
+            return total / FIXED_POINT[column][1] if column in FIXED_POINT else total
+        moments = self.moments[column]
+        return {'mean': moments.mean, 'std': moments.std, 'min': moments.minimum, 'max': moments.maximum}[func]
+
+    def grouped(self, by, column, aggfunc='sum'):
+        """Per-group aggregate, like data.groupby(by)[column].agg(aggfunc)"""
+        totals = self.totals().groupby(level=by)[[column, 'rows']].sum()
+        if aggfunc == 'sum':
+            return totals[column]
+        if aggfunc == 'mean':
+            return totals[column] / totals['rows']
+        if aggfunc == 'count':
+            return totals['rows']
+        raise ValueError(f"Unsupported aggregate '{aggfunc}' on chunked data")
+
+    def pivot(self, index, columns, values='sales', aggfunc='sum'):
+        grouped = self.grouped([index, columns], values, aggfunc)
+        return grouped.unstack(columns).fillna(0)
+
+    def sample_frame(self):
+        """Bounded uniform sample of the streamed rows"""
+        if self.sample is None:
+            return pd.DataFrame(columns=GROUP_COLUMNS + MEASURE_COLUMNS)
+        return self.sample.drop(columns='_priority').reset_index(drop=True)
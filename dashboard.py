@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Cache du dashboard
+=============================================
+
+KPIs, agrégats et spécifications des graphiques du dashboard pour chaque
+combinaison des filtres de la barre latérale (pays × année × type, « Tous »
+compris), persistés dans la table dashboard_cache et valides tant que la
+version des données ne change pas.
+
+Le préchauffage calcule toutes les combinaisons (ou les K plus consultées)
+dans un pool de processus, un par cœur.
+
+Usage : python dashboard.py --db olive_oil.db [--workers 4] [--top-k 50]
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from figure_cache import figure_from_json, serialize
+from instrumentation import track
+from memory_budget import sizeof
+from storage import FILTER_COLUMNS, filters_key
+
+# Hits counted in memory before they are written to dashboard_cache in one request
+HIT_FLUSH_COUNT = 100
+
+def filter_combinations(database):
+    """Every non-empty filter combination the sidebar can produce, unfiltered first"""
+    present = database.aggregate(list(FILTER_COLUMNS), {'sales': 'count'})
+    combinations = {}
+    for row in present[list(FILTER_COLUMNS)].itertuples(index=False):
+        values = [value.item() if hasattr(value, 'item') else value for value in row]
+        # Each column is either filtered on this row's value or left at "Tous"
+        for mask in itertools.product((False, True), repeat=len(FILTER_COLUMNS)):
+            filters = {column: value for column, value, kept in zip(FILTER_COLUMNS, values, mask) if kept}
+            combinations.setdefault(filters_key(filters), filters)
+    return sorted(combinations.values(), key=len)
+
+def _number(value):
+    """JSON-friendly float; missing aggregates (no rows) become 0"""
+    if value is None:
+        return 0.0
+    value = float(value)
+    return 0.0 if math.isnan(value) else value
+
+def compute_dashboard(database, filters, frame):
+    """Everything the dashboard shows for one filter combination
+
+    frame holds the filtered rows (as in the app); aggregates are pushed
+    down to the storage engine and figures are kept as plotly JSON.
+    """
+    import plotly.express as px
+    from analytics import AdvancedAnalytics
+
+    with track("dashboard.compute") as info:
+        info['rows'] = len(frame)
+        totals = database.aggregate((), {'sales': 'sum', 'volume': 'sum', 'price': 'mean'}, filters).iloc[0]
+        sales_by_year = database.aggregate('year', {'sales': 'sum'}, filters)
+        sales_by_country = database.aggregate('country', {'sales': 'sum'}, filters)
+        sales_by_type = database.aggregate('type', {'sales': 'sum'}, filters)
+
+        yearly_sales = sales_by_year['sales']
+        growth_rate = ((yearly_sales.iloc[-1] - yearly_sales.iloc[0]) /
+                       yearly_sales.iloc[0] * 100) if len(yearly_sales) > 1 else 0
+        kpis = AdvancedAnalytics(frame, database, filters).calculate_kpis()
+
+        figures = {
+            'country': px.bar(sales_by_country, x='country', y='sales',
+                              title="Ventes totales par pays",
+                              labels={'sales': 'Ventes (€)', 'country': 'Pays'}),
+            'year': px.line(sales_by_year, x='year', y='sales',
+                            title="Évolution des ventes par année",
+                            labels={'sales': 'Ventes (€)', 'year': 'Année'}),
+            'type': px.pie(sales_by_type, values='sales', names='type',
+                           title="Répartition des ventes par type d'huile"),
+        }
+
+        return {
+            'totals': {column: _number(totals[column]) for column in ('sales', 'volume', 'price')},
+            'growth_rate': float(growth_rate),
+            'kpis': {name: float(value) for name, value in kpis.items()},
+            'sales_by_year': sales_by_year.to_dict('list'),
+            'sales_by_country': sales_by_country.to_dict('list'),
+            'sales_by_type': sales_by_type.to_dict('list'),
+            'figures': {name: serialize(figure).decode() for name, figure in figures.items()},
+        }
+
+def figure(payload, name):
+    """Plotly figure rebuilt from the JSON spec stored in a payload"""
+    return figure_from_json(payload['figures'][name])
+
+class DashboardCache:
+    """Dashboard payloads per (database, filters), persisted and kept per data version
+
+    Lookups go through a small in-process LRU, then the dashboard_cache
+    table (filled by other processes or by the warmup), and only compute
+    on a miss. Every lookup counts a hit, which orders the top-K warmup:
+    hits are counted in memory and written in batches (every flush_every
+    hits, and when maintenance or the warmup runs), so that a page view
+    does not queue a write. The memory governor may shrink the LRU.
+    """
+
+    def __init__(self, memory_size=256, flush_every=HIT_FLUSH_COUNT):
+        self.memory_size = memory_size
+        self.flush_every = flush_every
+        self.nbytes = 0
+        self._memory = OrderedDict()
+        self._hits = {}
+        self._lock = threading.Lock()
+
+    def get(self, database, filters, frame):
+        key = filters_key(filters)
+        version = database.data_version()
+        memory_key = (database.db_path, database.backend.name, key)
+        self._count_hit(database, key)
+
+        with self._lock:
+            cached = self._memory.get(memory_key)
+            if cached is not None and cached[0] == version:
+                self._memory.move_to_end(memory_key)
+                return cached[1]
+
+        payload = self.load(database, key, version)
+        if payload is None:
+            payload = compute_dashboard(database, filters, frame)
+            self.store(database, [(key, payload)], version)
+        self._remember(memory_key, version, payload)
+        return payload
+
+    def _remember(self, memory_key, version, payload):
+        size = sizeof(payload)
+        with self._lock:
+            previous = self._memory.pop(memory_key, None)
+            if previous is not None:
+                self.nbytes -= previous[2]
+            self._memory[memory_key] = (version, payload, size)
+            self.nbytes += size
+            while len(self._memory) > self.memory_size:
+                self.nbytes -= self._memory.popitem(last=False)[1][2]
+
+    def shrink(self, nbytes):
+        """Drop least recently used payloads until nbytes are freed (or none is left); returns the bytes freed"""
+        freed = 0
+        with self._lock:
+            while self._memory and freed < nbytes:
+                freed += self._memory.popitem(last=False)[1][2]
+            self.nbytes -= freed
+        return freed
+
+    def _count_hit(self, database, key):
+        with self._lock:
+            pending = self._hits.setdefault((database.db_path, database.backend.name), Counter())
+            pending[key] += 1
+            full = pending.total() >= self.flush_every
+        if full:
+            self.flush_hits(database)
+
+    def pending_hits(self, database):
+        """Hits counted per key since the last flush"""
+        with self._lock:
+            return dict(self._hits.get((database.db_path, database.backend.name), {}))
+
+    def flush_hits(self, database):
+        """Add the hits counted since the last flush in one writer request (returns a Future, None without hits)"""
+        with self._lock:
+            pending = self._hits.pop((database.db_path, database.backend.name), None)
+        if not pending:
+            return None
+        rows = [(count, key) for key, count in pending.items()]
+        # Queued after the store() of a first lookup: the hits of a new row are kept
+        return database.writer.submit(lambda conn: database.backend.executemany(
+            conn, "UPDATE dashboard_cache SET hits = hits + ? WHERE filters_key = ?", rows))
+
+    @staticmethod
+    def load(database, key, version):
+        """Stored payload of a combination, if computed at this data version"""
+        conn = database.backend.connect()
+        try:
+            row = database.backend.execute(conn, "SELECT version, payload FROM dashboard_cache WHERE filters_key = ?",
+                                           (key,)).fetchone()
+        finally:
+            conn.close()
+        if row is None or row[0] != version:
+            return None
+        return json.loads(row[1])
+
+    @staticmethod
+    def store(database, entries, version, hits=0):
+        """Upsert (key, payload) pairs on the writer, keeping their hit counts (returns a Future)"""
+        rows = [(key, version, json.dumps(payload), hits) for key, payload in entries]
+
+        def upsert(conn):
+            for row in rows:
+                database.backend.execute(conn, '''
+                    INSERT INTO dashboard_cache (filters_key, version, payload, hits)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (filters_key) DO UPDATE SET
+                        version = excluded.version, payload = excluded.payload, updated_at = CURRENT_TIMESTAMP
+                ''', row)
+        return database.writer.submit(upsert)
+
+    @staticmethod
+    def stored_keys(database, version):
+        """Keys stored at the current version, and hit counts of every stored key"""
+        conn = database.backend.connect()
+        try:
+            rows = database.backend.execute(conn, "SELECT filters_key, version, hits FROM dashboard_cache").fetchall()
+        finally:
+            conn.close()
+        fresh = {key for key, row_version, _ in rows if row_version == version}
+        return fresh, {key: hits for key, _, hits in rows}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self.nbytes = 0
+
+# Shared by every session so payloads survive Streamlit reruns
+cache = DashboardCache()
+
+# State of a warmup worker process: its own connection and a copy of the rows
+_worker = {}
+
+def _init_worker(db_path, backend):
+    from database import OliveOilDatabase
+
+    database = OliveOilDatabase(db_path, backend)
+    _worker.update(database=database, data=database.get_all_data())
+
+def _compute_in_worker(filters):
+    data = _worker['data']
+    mask = True
+    for column, value in filters.items():
+        mask = mask & (data[column] == value)
+    frame = data[mask] if filters else data
+    return filters_key(filters), compute_dashboard(_worker['database'], filters, frame)
+
+def warmup(db_path="olive_oil.db", backend="sqlite", workers=None, top_k=None):
+    """Compute and store every stale filter combination in parallel; returns a summary dict
+
+    With top_k, only the unfiltered view and the K most used combinations
+    (by recorded hits) are computed. DuckDB files cannot be opened by
+    several processes, so that backend runs in a single worker.
+    """
+    from database import OliveOilDatabase
+
+    start = time.perf_counter()
+    database = OliveOilDatabase(db_path, backend)
+    # Hits counted by this process order the top-K as well
+    flushed = cache.flush_hits(database)
+    if flushed is not None:
+        flushed.result()
+    version = database.data_version()
+    combinations = filter_combinations(database)
+    fresh, hits = DashboardCache.stored_keys(database, version)
+    if top_k is not None:
+        unfiltered, rest = combinations[:1], combinations[1:]
+        rest.sort(key=lambda filters: hits.get(filters_key(filters), 0), reverse=True)
+        combinations = unfiltered + rest[:top_k]
+    pending = [filters for filters in combinations if filters_key(filters) not in fresh]
+
+    workers = workers or os.cpu_count() or 1
+    if backend != 'sqlite':
+        workers = 1
+    if pending:
+        # spawn: the parent may already run the writer thread
+        context = multiprocessing.get_context('spawn')
+        chunksize = max(1, len(pending) // (workers * 4))
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(db_path, backend)) as pool:
+            entries = list(pool.map(_compute_in_worker, pending, chunksize=chunksize))
+        DashboardCache.store(database, entries, version).result()
+
+    return {
+        'combinations': len(combinations),
+        'computed': len(pending),
+        'workers': workers,
+        'version': version,
+        'seconds': time.perf_counter() - start,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Préchauffage du cache du dashboard")
+    parser.add_argument('--db', default=os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"), help="Fichier de base")
+    parser.add_argument('--backend', default=os.environ.get("OLIVE_OIL_DB_BACKEND", "sqlite"),
+                        choices=['sqlite', 'duckdb'])
+    parser.add_argument('--workers', type=int, default=None, help="Processus de calcul (défaut : un par cœur)")
+    parser.add_argument('--top-k', type=int, default=None, help="Ne préchauffer que les K combinaisons les plus consultées")
+    args = parser.parse_args()
+
+    summary = warmup(args.db, args.backend, args.workers, args.top_k)
+    print(f"🔥 {summary['computed']}/{summary['combinations']} combinaisons calculées "
+          f"({summary['workers']} processus) en {summary['seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Générateur de données synthétiques
+=============================================================
+
+Génère des ventes déterministes (même graine = mêmes lignes) au format
+de olive_oil_data.csv, jusqu'à des centaines de millions de lignes
+écrites par blocs, avec des anomalies injectées.
+
+Usage : python data_generator.py --rows 10000000 --output big.csv
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_COUNTRIES = ['Spain', 'Italy', 'Tunisia', 'Greece', 'Portugal', 'Morocco', 'Turkey', 'France']
+DEFAULT_TYPES = ['Extra Virgin', 'Pure', 'Organic']
+DEFAULT_YEARS = list(range(2010, 2025))
+
+# Rows are produced in fixed-size blocks, each seeded from (seed, block index),
+# so the output does not depend on the chunk size requested by the caller.
+BLOCK_SIZE = 65_536
+
+def _names(value, defaults, prefix):
+    """Accept either an explicit list of names or a count"""
+    if isinstance(value, int):
+        if value <= len(defaults):
+            return list(defaults[:value])
+        return list(defaults) + [f"{prefix}-{i:03d}" for i in range(len(defaults), value)]
+    return list(value) if value is not None else list(defaults)
+
+class SalesGenerator:
+    """Deterministic generator of sales rows with injected anomalies"""
+
+    def __init__(self, countries=None, types=None, years=None, anomaly_rate=0.01, seed=42, daily=False):
+        self.countries = np.array(_names(countries, DEFAULT_COUNTRIES, "Country"))
+        self.types = np.array(_names(types, DEFAULT_TYPES, "Type"))
+        self.years = np.array(years if years is not None else DEFAULT_YEARS)
+        self.anomaly_rate = anomaly_rate
+        self.seed = seed
+        # Add a sale_date column (a uniform day within the row's year)
+        self.daily = daily
+
+        # Each (country, type) segment gets its own price level and market size
+        profile_rng = np.random.default_rng([seed, 0])
+        shape = (len(self.countries), len(self.types))
+        self.base_price = profile_rng.uniform(3.5, 8.0, shape)
+        self.base_volume = profile_rng.uniform(2_000, 30_000, shape)
+        self.growth = profile_rng.normal(0.04, 0.05, shape)
+
+    def block(self, index, rows=BLOCK_SIZE, labels=False):
+        """Generate one block of rows"""
+        rng = np.random.default_rng([self.seed, 1, index])
+        c = rng.integers(0, len(self.countries), rows)
+        t = rng.integers(0, len(self.types), rows)
+        y = rng.integers(0, len(self.years), rows)
+
+        volume = self.base_volume[c, t] * (1 + self.growth[c, t]) ** y * rng.lognormal(0, 0.15, rows)
+        price = self.base_price[c, t] * rng.normal(1, 0.03, rows)
+
+        # Anomalies: volume spikes, volume collapses and price outliers
+        anomaly = rng.random(rows) < self.anomaly_rate
+        kind = rng.integers(0, 3, rows)
+        factor = rng.uniform(3, 10, rows)
+        volume = np.where(anomaly & (kind == 0), volume * factor, volume)
+        volume = np.where(anomaly & (kind == 1), volume / factor, volume)
+        price = np.where(anomaly & (kind == 2), price * factor / 2, price)
+
+        volume = volume.round(0)
+        price = price.round(2)
+        df = pd.DataFrame({
+            'country': self.countries[c],
+            'year': self.years[y],
+            'type': self.types[t],
+            'sales': (volume * price).round(2),
+            'volume': volume,
+            'price': price,
+        })
+        if self.daily:
+            # Drawn last so dated and undated outputs share every other column
+            first_day = (self.years[y] - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+            df['sale_date'] = first_day + rng.integers(0, 365, rows)
+        if labels:
+            df['injected_anomaly'] = anomaly
+        return df
+
+    def chunks(self, rows, chunk_size=1_000_000, labels=False):
+        """Yield DataFrames of at most chunk_size rows, rows in total"""
+        buffer, buffered, produced, index = [], 0, 0, 0
+        while produced < rows:
+            n = min(BLOCK_SIZE, rows - produced)
+            buffer.append(self.block(index, n, labels))
+            buffered += n
+            produced += n
+            index += 1
+            while buffered >= chunk_size or (produced == rows and buffered):
+                frame = pd.concat(buffer, ignore_index=True)
+                yield frame.iloc[:chunk_size].reset_index(drop=True)
+                rest = frame.iloc[chunk_size:]
+                buffer, buffered = ([rest], len(rest)) if len(rest) else ([], 0)
+
+    def frame(self, rows, labels=False):
+        """Generate rows into a single DataFrame"""
+        return pd.concat(list(self.chunks(rows, max(rows, 1), labels)), ignore_index=True)
+
+    def write_csv(self, path, rows, chunk_size=1_000_000):
+        """Stream rows into a CSV file with the same columns as olive_oil_data.csv"""
+        for i, chunk in enumerate(self.chunks(rows, chunk_size)):
+            chunk.to_csv(path, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+        return path
+
+def generate_sales(rows, countries=None, types=None, years=None, anomaly_rate=0.01, seed=42, labels=False,
+                   daily=False):
+    """Shortcut returning rows of synthetic sales as a DataFrame"""
+    return SalesGenerator(countries, types, years, anomaly_rate, seed, daily).frame(rows, labels)
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Génère des ventes synthétiques d'huile d'olive")
+    parser.add_argument('--rows', type=int, default=1_000_000, help="Nombre de lignes")
+    parser.add_argument('--output', default="olive_oil_synthetic.csv", help="Fichier CSV de sortie")
+    parser.add_argument('--countries', type=int, default=len(DEFAULT_COUNTRIES), help="Nombre de pays")
+    parser.add_argument('--types', type=int, default=len(DEFAULT_TYPES), help="Nombre de types d'huile")
+    parser.add_argument('--years', type=int, nargs=2, default=[DEFAULT_YEARS[0], DEFAULT_YEARS[-1]],
+                        metavar=('DEBUT', 'FIN'), help="Période couverte")
+    parser.add_argument('--anomaly-rate', type=float, default=0.01, help="Proportion d'anomalies injectées")
+    parser.add_argument('--seed', type=int, default=42, help="Graine aléatoire")
+    parser.add_argument('--daily', action='store_true', help="Ajouter une date de vente (sale_date)")
+    args = parser.parse_args()
+
+    generator = SalesGenerator(args.countries, args.types, range(args.years[0], args.years[1] + 1),
+                               args.anomaly_rate, args.seed, args.daily)
+    generator.write_csv(args.output, args.rows)
+    print(f"✅ {args.rows:,} lignes écrites dans {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,142 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
 import pandas as pd
 from datetime import datetime
+import itertools
 import os
+import threading
+import time
+
+from chunked import iter_cursor
+from instrumentation import timed
+from migrations import MigrationRunner
+from notifier import DEFAULT_MAX_PENDING, notifier
+from sketches import SketchStore, summarize
+from storage import (FIXED_POINT, SALES_COLUMNS, analysis_parameters, analysis_result, analysis_row, create_backend,
+                     filters_key, prepare_sales, read_sales)
+from writer import SingleWriter
+
+# Columns that can be used to group or filter in pushed-down aggregations
+DIMENSION_COLUMNS = ('country', 'year', 'type')
+MEASURE_COLUMNS = ('sales', 'volume', 'price')
+SQL_AGGREGATES = {
+    'sum': 'SUM',
+    'mean': 'AVG',
+    'min': 'MIN',
+    'max': 'MAX',
+    'count': 'COUNT',
+}
+
+# Retention of analysis_history (see compact_history)
+HISTORY_MAX_AGE_DAYS = 365
+HISTORY_KEEP_PER_KEY = 50
+# Saves between two background compactions of analysis_history
+HISTORY_COMPACT_EVERY = 500
+
+def _bindable(value):
+    """numpy scalars (e.g. ids or years taken from a DataFrame) are not bindable as is"""
+    return value.item() if hasattr(value, 'item') else value
+
+def _sale_row(country, year, type_oil, sales, volume, price, sale_date=None):
+    """Stored columns of one sale: amounts rounded to their integer units, content hash"""
+    row = prepare_sales(pd.DataFrame([{
+        'country': country, 'year': _bindable(year), 'type': type_oil, 'sales': _bindable(sales),
+        'volume': _bindable(volume), 'price': _bindable(price), 'sale_date': sale_date,
+    }]))
+    return {column: _bindable(value) for column, value in row.iloc[0].items()}
+
+def _measure_sql(column, func):
+    """SQL of an aggregate; money sums and means run on the integer columns"""
+    if column in FIXED_POINT and func != 'count':
+        fixed, scale = FIXED_POINT[column]
+        return f"{SQL_AGGREGATES[func]}({fixed}) / {scale}.0"
+    return f"{SQL_AGGREGATES[func]}({column})"
 
 class OliveOilDatabase:
-    def __init__(self, db_path="olive_oil.db"):
+    # (backend, path) pairs whose schema was already created by this process
+    _initialized = set()
+    _init_lock = threading.Lock()
+    # One writer thread per database file, shared by every instance
+    _writers = {}
+    # Analyses saved by this process, to schedule history compaction
+    _history_saves = itertools.count(1)
+    
+    def __init__(self, db_path="olive_oil.db", backend="sqlite"):
         self.db_path = db_path
+        self.backend = create_backend(backend, db_path)
+        self._key = (self.backend.name, os.path.abspath(db_path))
+        # Per-year mergeable sketches behind the approximate statistics
+        self.sketches = SketchStore(self.backend)
         self.init_database()
     
-    def init_database(self):
-        """Initialize the database with tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Create sales table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS sales (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                country TEXT NOT NULL,
-                year INTEGER NOT NULL,
-                type TEXT NOT NULL,
-                sales REAL NOT NULL,
-                volume REAL NOT NULL,
-                price REAL NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create users table for future multi-user support
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create analysis_history table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analysis_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                analysis_type TEXT NOT NULL,
-                parameters TEXT,
-                result TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
+    @timed("db.init_database")
+    def init_database(self, force=False):
+        """Apply pending schema migrations (once per process unless forced)"""
+        with self._init_lock:
+            if self._key in self._initialized and not force:
+                return
+            
+            MigrationRunner(self.backend).migrate()
+            self._initialized.add(self._key)
+    
+    @property
+    def writer(self):
+        """Writer thread that serializes and group-commits every write"""
+        with self._init_lock:
+            if self._key not in self._writers:
+                self._writers[self._key] = SingleWriter(self.backend)
+            return self._writers[self._key]
+    
+    def close(self):
+        """Commit pending writes and stop the writer thread of this database"""
+        with self._init_lock:
+            writer = self._writers.pop(self._key, None)
+        if writer is not None:
+            writer.close()
     
+    def _write(self, sql, params=()):
+        """Queue a statement on the writer; returns a Future of the affected row count"""
+        return self.writer.execute(sql, tuple(_bindable(value) for value in params))
+    
+    def data_version(self):
+        """Counter bumped by every write to sales, for caches keyed on the data"""
+        conn = self.backend.connect()
+        try:
+            return self.backend.execute(conn, "SELECT version FROM data_version").fetchone()[0]
+        finally:
+            conn.close()
+    
+    def data_versions(self):
+        """(current data version, last version written by an update, delete or reload)"""
+        conn = self.backend.connect()
+        try:
+            return tuple(self.backend.execute(conn, "SELECT version, rewritten FROM data_version").fetchone())
+        finally:
+            conn.close()
+    
+    def _bump_data_version(self, conn, kind, ids=(), changes=1):
+        # Inserts only append: caches that can extend themselves check rewritten.
+        # changes counts the rows written, the churn that schedules maintenance
+        if kind == 'insert':
+            self.backend.execute(conn, "UPDATE data_version SET version = version + 1, changes = changes + ?",
+                                 (changes,))
+        else:
+            self.backend.execute(conn, "UPDATE data_version SET version = version + 1, rewritten = version + 1, "
+                                       "changes = changes + ?", (changes,))
+        version = self.backend.execute(conn, "SELECT version FROM data_version").fetchone()[0]
+        # Subscribers hear of the write once it is committed, before its Future resolves
+        self.writer.on_commit(lambda: notifier.publish(self._key, version, kind, ids))
+    
+    def subscribe(self, max_pending=DEFAULT_MAX_PENDING):
+        """Subscription to the deltas (version, kind, ids) of the writes to sales of this database"""
+        return notifier.subscribe(self._key, max_pending)
+    
+    def schema_version(self):
+        """Current schema version of the database"""
+        return MigrationRunner(self.backend).current_version()
+    
+    @timed("db.load_data_from_csv")
     def load_data_from_csv(self, csv_path="olive_oil_data.csv"):
         """Load data from CSV into database"""
         if not os.path.exists(csv_path):
@@ -63,119 +145,423 @@ class OliveOilDatabase:
         # Ensure tables exist before loading
         self.init_database()
         
-        df = pd.read_csv(csv_path)
-        conn = sqlite3.connect(self.db_path)
+        df = prepare_sales(pd.read_csv(csv_path))
         
-        # Clear existing data to avoid duplicates on reload
-        conn.execute("DELETE FROM sales")
+        def replace_sales(conn):
+            # Clear existing data to avoid duplicates on reload
+            deleted = self.backend.execute(conn, "SELECT COUNT(*) FROM sales").fetchone()[0]
+            self.backend.execute(conn, "DELETE FROM sales")
+            # Their rows are gone: the files ingested before may be ingested again
+            self.backend.execute(conn, "DELETE FROM ingested_files")
+            
+            # Insert new data
+            self.backend.insert_frame(conn, 'sales', df)
+            self.sketches.replace_all(conn, df)
+            self._bump_data_version(conn, 'reload', changes=deleted + len(df))
         
-        # Insert new data
-        df.to_sql('sales', conn, if_exists='append', index=False)
-        conn.commit()
-        conn.close()
+        self.writer.submit(replace_sales).result()
         return True
     
+    @timed("db.load_data_from_xlsx")
+    def load_data_from_xlsx(self, xlsx_path, sheet_name=None, batch_size=50_000):
+        """Append the sales of a spreadsheet, streamed and inserted by batches of rows; returns a summary
+        
+        Headers are mapped to the sales columns (English or French names),
+        invalid rows are rejected and rows already stored are skipped. At
+        most two batches are held at once: one being parsed, one being
+        written.
+        """
+        from ingestion import iter_xlsx, validate_sales
+        
+        start = time.perf_counter()
+        summary = {'rows': 0, 'inserted': 0, 'rejected': 0, 'batches': 0}
+        pending = None
+        for batch in iter_xlsx(xlsx_path, sheet_name, batch_size):
+            frame, rejected = validate_sales(batch)
+            summary['rows'] += len(batch)
+            summary['rejected'] += rejected
+            summary['batches'] += 1
+            future = self.ingest_frame(frame)
+            if pending is not None:
+                summary['inserted'] += pending.result()
+            pending = future
+        if pending is not None:
+            summary['inserted'] += pending.result()
+        summary['duplicates'] = summary['rows'] - summary['rejected'] - summary['inserted']
+        summary['seconds'] = time.perf_counter() - start
+        return summary
+    
+    @timed("db.ingest_frame")
+    def ingest_frame(self, df, checksum=None, path=None):
+        """Append the rows whose content hash is not stored yet (returns a Future of the inserted count)
+        
+        Rows repeated within df are inserted once. With a checksum, the
+        source file is recorded in ingested_files in the same transaction.
+        """
+        df = prepare_sales(df).drop_duplicates('row_hash')
+        
+        def insert_new(conn):
+            known = self._stored_hashes(conn, df['row_hash'].tolist())
+            new = df[~df['row_hash'].isin(known)]
+            if len(new):
+                # Single writer: the new rows take the ids that follow the current maximum
+                first = self._max_sale_id(conn) + 1
+                self.backend.insert_frame(conn, 'sales', new)
+                self.sketches.add(conn, new)
+                self._bump_data_version(conn, 'insert', range(first, self._max_sale_id(conn) + 1), changes=len(new))
+            if checksum is not None:
+                self.backend.execute(conn, '''
+                    INSERT INTO ingested_files (checksum, path, rows, inserted) VALUES (?, ?, ?, ?)
+                ''', (checksum, str(path), len(df), len(new)))
+            return len(new)
+        
+        return self.writer.submit(insert_new)
+    
+    def _stored_hashes(self, conn, hashes, batch_size=500):
+        """Subset of hashes already present in sales (index lookups by batches)"""
+        found = set()
+        for start in range(0, len(hashes), batch_size):
+            batch = hashes[start:start + batch_size]
+            rows = self.backend.execute(
+                conn, f"SELECT row_hash FROM sales WHERE row_hash IN ({', '.join('?' * len(batch))})", batch)
+            found.update(row[0] for row in rows.fetchall())
+        return found
+    
+    def ingested_checksums(self):
+        """Checksums of the files already ingested"""
+        conn = self.backend.connect()
+        try:
+            return {row[0] for row in self.backend.execute(conn, "SELECT checksum FROM ingested_files").fetchall()}
+        finally:
+            conn.close()
+    
+    @timed("db.get_all_data")
     def get_all_data(self):
         """Get all sales data"""
-        conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query("SELECT * FROM sales", conn)
-        conn.close()
-        return df
+        return read_sales(self.backend.query_df("SELECT * FROM sales"))
+    
+    def get_sales(self, ids, batch_size=500):
+        """Sales of the given ids; a range reads the id interval"""
+        if isinstance(ids, range):
+            if not ids:
+                return read_sales(self.backend.query_df("SELECT * FROM sales WHERE 0 = 1"))
+            return read_sales(self.backend.query_df("SELECT * FROM sales WHERE id BETWEEN ? AND ? ORDER BY id",
+                                                    (ids[0], ids[-1])))
+        ids = [_bindable(sale_id) for sale_id in ids]
+        frames = [
+            self.backend.query_df(f"SELECT * FROM sales WHERE id IN ({', '.join('?' * len(batch))}) ORDER BY id", batch)
+            for batch in (ids[start:start + batch_size] for start in range(0, max(len(ids), 1), batch_size))
+        ]
+        return read_sales(pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0])
     
-    def add_sale(self, country, year, type_oil, sales, volume, price):
-        """Add a new sale record"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def iter_data(self, chunksize=100_000, filters=None):
+        """Stream sales as DataFrames of at most chunksize rows (bounded memory)"""
+        where, params = self._where_clause(filters)
+        conn = self.backend.connect()
+        try:
+            cursor = self.backend.execute(conn, f"SELECT * FROM sales{where} ORDER BY id", params)
+            for chunk in iter_cursor(cursor, chunksize):
+                yield read_sales(chunk)
+        finally:
+            conn.close()
+    
+    @timed("db.add_sale")
+    def add_sale(self, country, year, type_oil, sales, volume, price, sale_date=None):
+        """Add a new sale record (returns a Future)"""
+        if sale_date is not None:
+            sale_date = pd.Timestamp(sale_date).date().isoformat()
+        row = _sale_row(country, year, type_oil, sales, volume, price, sale_date)
         
-        cursor.execute('''
-            INSERT INTO sales (country, year, type, sales, volume, price)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (country, year, type_oil, sales, volume, price))
+        def insert_sale(conn):
+            first = self._max_sale_id(conn) + 1
+            rowcount = self.backend.execute(conn, f'''
+                INSERT INTO sales ({', '.join(row)})
+                VALUES ({', '.join('?' * len(row))})
+            ''', tuple(row.values())).rowcount
+            self.sketches.add(conn, pd.DataFrame([row])[SALES_COLUMNS])
+            self._bump_data_version(conn, 'insert', range(first, self._max_sale_id(conn) + 1))
+            return rowcount
         
-        conn.commit()
-        conn.close()
+        return self.writer.submit(insert_sale)
     
+    def _sale_year(self, conn, sale_id):
+        row = self.backend.execute(conn, "SELECT year FROM sales WHERE id=?", (sale_id,)).fetchone()
+        return [row[0]] if row else []
+    
+    @timed("db.update_sale")
     def update_sale(self, sale_id, country, year, type_oil, sales, volume, price):
-        """Update an existing sale record"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Update an existing sale record (returns a Future)"""
+        sale_id = _bindable(sale_id)
         
-        cursor.execute('''
-            UPDATE sales 
-            SET country=?, year=?, type=?, sales=?, volume=?, price=?, updated_at=CURRENT_TIMESTAMP
-            WHERE id=?
-        ''', (country, year, type_oil, sales, volume, price, sale_id))
+        def update(conn):
+            current = self.backend.execute(conn, "SELECT year, sale_date FROM sales WHERE id=?", (sale_id,)).fetchone()
+            if current is None:
+                return 0
+            # The sale date is kept, and is part of the content hash
+            row = _sale_row(country, year, type_oil, sales, volume, price, current[1])
+            del row['sale_date']
+            rowcount = self.backend.execute(conn, f'''
+                UPDATE sales
+                SET {', '.join(f"{column}=?" for column in row)}, updated_at=CURRENT_TIMESTAMP
+                WHERE id=?
+            ''', tuple(row.values()) + (sale_id,)).rowcount
+            self.sketches.mark_dirty(conn, {current[0], row['year']})
+            self._bump_data_version(conn, 'update', (sale_id,))
+            return rowcount
         
-        conn.commit()
-        conn.close()
+        return self.writer.submit(update)
     
+    @timed("db.delete_sale")
     def delete_sale(self, sale_id):
-        """Delete a sale record"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Delete a sale record (returns a Future)"""
+        sale_id = _bindable(sale_id)
         
-        cursor.execute("DELETE FROM sales WHERE id=?", (sale_id,))
+        def delete(conn):
+            years = self._sale_year(conn, sale_id)
+            rowcount = self.backend.execute(conn, "DELETE FROM sales WHERE id=?", (sale_id,)).rowcount
+            if years:
+                self.sketches.mark_dirty(conn, years)
+                self._bump_data_version(conn, 'delete', (sale_id,))
+            return rowcount
         
-        conn.commit()
-        conn.close()
+        return self.writer.submit(delete)
     
+    @timed("db.save_analysis")
     def save_analysis(self, analysis_type, parameters, result):
-        """Save analysis results"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO analysis_history (analysis_type, parameters, result)
-            VALUES (?, ?, ?)
-        ''', (analysis_type, str(parameters), str(result)))
+        """Save analysis results (returns a Future)
         
-        conn.commit()
-        conn.close()
+        parameters is a dict (or JSON) whose optional 'filters' entry is the
+        filter set of the analysis; the result text is stored compressed.
+        Every HISTORY_COMPACT_EVERY saves, compact_history is queued.
+        """
+        parameters, key, blob = analysis_row(parameters, result)
+        future = self._write('''
+            INSERT INTO analysis_history (analysis_type, parameters, filters_key, result_blob)
+            VALUES (?, ?, ?, ?)
+        ''', (analysis_type, parameters, key, blob))
+        if next(self._history_saves) % HISTORY_COMPACT_EVERY == 0:
+            self.compact_history()
+        return future
     
-    def get_analysis_history(self, limit=10):
-        """Get recent analysis history"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT * FROM analysis_history 
-            ORDER BY created_at DESC 
-            LIMIT ?
-        ''', (limit,))
+    @timed("db.get_analysis_history")
+    def get_analysis_history(self, limit=10, analysis_type=None):
+        """Recent analyses as (id, analysis_type, parameters, result, created_at) rows, newest first"""
+        if analysis_type is None:
+            # Ids grow with insertion time: the primary key gives the order
+            where, order, params = "", "id DESC", (limit,)
+        else:
+            where, order, params = " WHERE analysis_type = ?", "created_at DESC, id DESC", (analysis_type, limit)
+        conn = self.backend.connect()
+        try:
+            rows = self.backend.execute(conn, f'''
+                SELECT id, analysis_type, parameters, result_blob, result, created_at FROM analysis_history{where}
+                ORDER BY {order}
+                LIMIT ?
+            ''', params).fetchall()
+        finally:
+            conn.close()
+        return [(row_id, kind, parameters, analysis_result(blob, text), created_at)
+                for row_id, kind, parameters, blob, text, created_at in rows]
+    
+    @timed("db.get_latest_analysis")
+    def get_latest_analysis(self, analysis_type, filters=None):
+        """Latest analysis of a type for a filter set (indexed point query), or None
         
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        Returns a dict with id, parameters (dict), result (text) and created_at.
+        """
+        conn = self.backend.connect()
+        try:
+            row = self.backend.execute(conn, '''
+                SELECT id, parameters, result_blob, result, created_at FROM analysis_history
+                WHERE analysis_type = ? AND filters_key = ?
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            ''', (analysis_type, filters_key(filters or {}))).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        row_id, parameters, blob, text, created_at = row
+        return {'id': row_id, 'parameters': analysis_parameters(parameters), 'result': analysis_result(blob, text),
+                'created_at': created_at}
     
-    def get_statistics(self):
-        """Get database statistics"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    @timed("db.compact_history")
+    def compact_history(self, max_age_days=HISTORY_MAX_AGE_DAYS, keep_per_key=HISTORY_KEEP_PER_KEY):
+        """Apply the retention policy of analysis_history on the writer (returns a Future of deleted rows)
         
-        # Total records
-        cursor.execute("SELECT COUNT(*) FROM sales")
-        total_records = cursor.fetchone()[0]
+        Drops analyses older than max_age_days, then keeps only the
+        keep_per_key latest ones of each (analysis type, filter set).
+        None disables either rule.
+        """
+        def compact(conn):
+            def count():
+                return self.backend.execute(conn, "SELECT COUNT(*) FROM analysis_history").fetchone()[0]
+            
+            before = count()
+            if max_age_days is not None:
+                # created_at is CURRENT_TIMESTAMP, in UTC
+                cutoff = (pd.Timestamp.now('UTC') - pd.Timedelta(days=max_age_days)).strftime('%Y-%m-%d %H:%M:%S')
+                self.backend.execute(conn, "DELETE FROM analysis_history WHERE created_at < ?", (cutoff,))
+            if keep_per_key is not None:
+                self.backend.execute(conn, '''
+                    DELETE FROM analysis_history WHERE id IN (
+                        SELECT id FROM (
+                            SELECT id, ROW_NUMBER() OVER (
+                                PARTITION BY analysis_type, filters_key ORDER BY created_at DESC, id DESC
+                            ) AS position
+                            FROM analysis_history
+                        ) AS ranked
+                        WHERE position > ?
+                    )
+                ''', (keep_per_key,))
+            # Counted rather than summed: DuckDB reports no rowcount for deletes
+            deleted = before - count()
+            self.backend.execute(conn, "UPDATE data_version SET changes = changes + ?", (deleted,))
+            return deleted
         
-        # Total sales
-        cursor.execute("SELECT SUM(sales) FROM sales")
-        total_sales = cursor.fetchone()[0] or 0
+        return self.writer.submit(compact)
+    
+    @timed("db.get_statistics")
+    def get_statistics(self, approximate=False):
+        """Get database statistics (from the sketches when approximate)"""
+        if approximate:
+            return self.sketch_summary()
         
-        # Countries count
-        cursor.execute("SELECT COUNT(DISTINCT country) FROM sales")
-        countries_count = cursor.fetchone()[0]
+        conn = self.backend.connect()
         
-        # Years range
-        cursor.execute("SELECT MIN(year), MAX(year) FROM sales")
-        year_range = cursor.fetchone()
+        # Single scan for all the sidebar figures
+        cursor = self.backend.execute(conn, f'''
+            SELECT COUNT(*), {_measure_sql('sales', 'sum')}, COUNT(DISTINCT country), MIN(year), MAX(year)
+            FROM sales
+        ''')
+        total_records, total_sales, countries_count, min_year, max_year = cursor.fetchone()
         
         conn.close()
         
         return {
             'total_records': total_records,
-            'total_sales': total_sales,
+            'total_sales': total_sales or 0,
             'countries_count': countries_count,
-            'year_range': year_range
+            'year_range': (min_year, max_year)
         }
+    
+    @timed("db.sketch_summary")
+    def sketch_summary(self, years=None):
+        """Approximate statistics merged from the per-year sketches, with error bounds
+        
+        Cost depends on the number of partitions, not on the number of rows.
+        Partitions touched by updates or deletes are rebuilt first.
+        """
+        conn = self.backend.connect()
+        try:
+            partitions, dirty = self.sketches.load(conn)
+            if dirty:
+                # Only then does the read wait on the writer; clean partitions are read as they are
+                self.writer.submit(self.sketches.refresh).result()
+                partitions, _ = self.sketches.load(conn)
+        finally:
+            conn.close()
+        
+        if years is not None:
+            years = {int(_bindable(year)) for year in years}
+        return summarize(partitions, years)
+    
+    def _where_clause(self, filters):
+        """Build a parameterized WHERE clause from a {column: value} dict"""
+        clauses, params = [], []
+        for column, value in (filters or {}).items():
+            if column not in DIMENSION_COLUMNS:
+                raise ValueError(f"Cannot filter on column '{column}'")
+            clauses.append(f"{column} = ?")
+            params.append(_bindable(value))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+    
+    @timed("db.aggregate")
+    def aggregate(self, group_by, measures=None, filters=None):
+        """Group sales in the storage engine and return one row per group"""
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        measures = measures or {'sales': 'sum'}
+        
+        for column in group_by:
+            if column not in DIMENSION_COLUMNS:
+                raise ValueError(f"Cannot group on column '{column}'")
+        select = list(group_by)
+        for column, funcs in measures.items():
+            # A list of functions gives one {column}_{func} output column each
+            aliases = [(funcs, column)] if isinstance(funcs, str) else [(func, f"{column}_{func}") for func in funcs]
+            for func, alias in aliases:
+                if column not in MEASURE_COLUMNS or func not in SQL_AGGREGATES:
+                    raise ValueError(f"Unsupported aggregate {func}({column})")
+                select.append(f"{_measure_sql(column, func)} AS {alias}")
+        
+        where, params = self._where_clause(filters)
+        sql = f"SELECT {', '.join(select)} FROM sales{where}"
+        if group_by:
+            keys = ', '.join(group_by)
+            sql += f" GROUP BY {keys} ORDER BY {keys}"
+        return self.backend.query_df(sql, params)
+    
+    @timed("db.daily_sales")
+    def daily_sales(self, by=('country', 'type'), measure='sales', filters=None, since=None):
+        """Daily totals per segment of the dated sales (optionally from a given day)"""
+        by = list(by)
+        for column in by:
+            if column not in DIMENSION_COLUMNS:
+                raise ValueError(f"Cannot group on column '{column}'")
+        if measure not in MEASURE_COLUMNS:
+            raise ValueError(f"Unsupported measure '{measure}'")
+        
+        where, params = self._where_clause(filters)
+        clauses = ["sale_date IS NOT NULL"]
+        if since is not None:
+            clauses.append("sale_date >= ?")
+            params.append(pd.Timestamp(since).date().isoformat())
+        where += (" AND " if where else " WHERE ") + " AND ".join(clauses)
+        keys = ", ".join(["sale_date"] + by)
+        df = self.backend.query_df(
+            f"SELECT {keys}, {_measure_sql(measure, 'sum')} AS {measure} FROM sales{where} GROUP BY {keys} ORDER BY sale_date",
+            params)
+        df['sale_date'] = pd.to_datetime(df['sale_date'])
+        return df
+    
+    def _max_sale_id(self, conn):
+        return self.backend.execute(conn, "SELECT MAX(id) FROM sales").fetchone()[0] or 0
+    
+    def max_sale_id(self):
+        conn = self.backend.connect()
+        try:
+            return self._max_sale_id(conn)
+        finally:
+            conn.close()
+    
+    def first_sale_date_after(self, sale_id):
+        """Earliest sale date among the rows inserted after sale_id (None if none is dated)"""
+        conn = self.backend.connect()
+        try:
+            row = self.backend.execute(conn, "SELECT MIN(sale_date) FROM sales WHERE id > ?", (sale_id,)).fetchone()
+            return pd.Timestamp(row[0]) if row[0] is not None else None
+        finally:
+            conn.close()
+    
+    def has_sale_dates(self, filters=None):
+        """Whether any (filtered) sale carries a sale_date"""
+        where, params = self._where_clause(filters)
+        where += (" AND " if where else " WHERE ") + "sale_date IS NOT NULL"
+        conn = self.backend.connect()
+        try:
+            return self.backend.execute(conn, f"SELECT 1 FROM sales{where} LIMIT 1", params).fetchone() is not None
+        finally:
+            conn.close()
+    
+    @timed("db.pivot")
+    def pivot(self, index, columns, values='sales', aggfunc='sum', filters=None):
+        """Pivot table computed from an engine-side group by"""
+        grouped = self.aggregate([index, columns], {values: aggfunc}, filters)
+        return grouped.pivot(index=index, columns=columns, values=values).fillna(0)
 
 # Global database instance
-db = OliveOilDatabase() 
\ No newline at end of file
+db = OliveOilDatabase(
+    os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"),
+    backend=os.environ.get("OLIVE_OIL_DB_BACKEND", "sqlite")
+)
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from instrumentation import track
+
+# Total size of the serialized figures kept in memory
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def serialize(figure):
+    """Figure to JSON bytes, with orjson when it is installed (plotly's 'auto' engine)"""
+    from plotly.io.json import to_json_plotly
+
+    return to_json_plotly(figure).encode()
+
+def figure_from_json(data):
+    """Rebuild a figure from serialized JSON without re-validating it
+
+    The JSON was produced from a validated figure, so skipping validation
+    is safe and an order of magnitude faster than plotly.io.from_json.
+    """
+    import plotly.graph_objects as go
+    from plotly.io.json import from_json_plotly
+
+    return go.Figure(from_json_plotly(data), _validate=False)
+
+def decode_array(value):
+    """numpy array of a trace attribute, decoding plotly's base64 typed arrays
+
+    Numeric arrays survive a JSON round trip as {'dtype', 'bdata', 'shape'}
+    dicts; plotly.js reads them as is, Python code reading a cached figure
+    goes through this.
+    """
+    if isinstance(value, dict) and 'bdata' in value:
+        array = np.frombuffer(base64.b64decode(value['bdata']), dtype=value['dtype'])
+        shape = value.get('shape')
+        return array.reshape([int(size) for size in str(shape).split(',')]) if shape else array
+    return np.asarray(value)
+
+class FigureCache:
+    """Serialized plotly figures keyed by (data version, filters, chart), LRU-evicted by total size"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Serialized figure of key, or None"""
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        """Store serialized figure bytes; figures larger than the whole budget are not kept"""
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.nbytes -= len(previous)
+            if len(data) > self.max_bytes:
+                return
+            self._entries[key] = data
+            self.nbytes += len(data)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def figure(self, key, build):
+        """Figure of key, rebuilt from its cached JSON or built by build() and cached
+
+        A key whose first element (the data version) is None is never
+        cached. build() may return None (nothing to plot), which is not
+        cached either.
+        """
+        if key[0] is None:
+            return build()
+        data = self.get(key)
+        if data is None:
+            figure = build()
+            if figure is None:
+                return None
+            with track("figure_cache.serialize") as info:
+                data = serialize(figure)
+                info['bytes'] = len(data)
+            self.put(key, data)
+        with track("figure_cache.load") as info:
+            info['bytes'] = len(data)
+            return figure_from_json(data)
+
+    def shrink(self, nbytes):
+        """Drop least recently used figures until nbytes are freed (or none is left); returns the bytes freed"""
+        freed = 0
+        with self._lock:
+            while self._entries and freed < nbytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+                freed += len(evicted)
+        return freed
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+# Shared by every session so figures survive Streamlit reruns
+cache = FigureCache()
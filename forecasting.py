@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from instrumentation import track
+
+# Smoothing parameters tried for every series; the best one-step SSE wins
+ALPHAS = (0.1, 0.3, 0.5, 0.7, 0.9)
+BETAS = (0.01, 0.1, 0.3)
+GAMMAS = (0.05, 0.2, 0.5)
+# Fitted states kept by ForecastCache
+DEFAULT_MAX_ENTRIES = 128
+
+class ForecastState:
+    """Fitted Holt-Winters state of S series, enough to continue or forecast them"""
+
+    def __init__(self, level, trend, season, alpha, beta, gamma, steps, sse):
+        self.level = level          # (S,)
+        self.trend = trend          # (S,)
+        self.season = season        # (m, S), indexed by step % m
+        self.alpha = alpha          # (S,)
+        self.beta = beta            # (S,)
+        self.gamma = gamma          # (S,)
+        self.steps = steps          # observations consumed so far
+        self.sse = sse              # (S,) one-step-ahead squared errors
+
+    @property
+    def nbytes(self):
+        return sum(np.asarray(array).nbytes for array in (self.level, self.trend, self.season, self.alpha,
+                                                          self.beta, self.gamma, self.sse))
+
+    def copy(self):
+        return ForecastState(self.level.copy(), self.trend.copy(), self.season.copy(), self.alpha, self.beta,
+                             self.gamma, self.steps, self.sse.copy())
+
+class HoltWinters:
+    """Additive Holt-Winters fitted on many series at once
+
+    Series are the columns of a (T, S) array. The recurrences loop over
+    time only: every step updates all series, and all candidate parameter
+    combinations, with array operations. season_length <= 1 gives Holt's
+    linear trend method (no seasonality), used for yearly totals.
+    """
+
+    def __init__(self, season_length=12, alphas=ALPHAS, betas=BETAS, gammas=GAMMAS):
+        self.season_length = max(int(season_length), 1)
+        self.grid = np.array(list(itertools.product(alphas, betas, gammas if self.seasonal else (0.0,))))
+
+    @property
+    def seasonal(self):
+        return self.season_length > 1
+
+    def _initial_state(self, values):
+        """Level, trend and seasonal indices from the first seasons of each series"""
+        m = self.season_length
+        if self.seasonal and len(values) >= 2 * m:
+            first, second = values[:m].mean(axis=0), values[m:2 * m].mean(axis=0)
+            level, trend = first, (second - first) / m
+            season = values[:m] - first
+            # The first season only initialises the state
+            return level, trend, season, m
+        level = values[0].astype(np.float64)
+        trend = values[1] - values[0] if len(values) > 1 else np.zeros_like(level)
+        return level, trend, np.zeros((m, values.shape[1])), 1
+
+    @staticmethod
+    def _run(values, level, trend, season, alpha, beta, gamma, start_step):
+        """Run the recurrences over values; all state arrays share their trailing shape"""
+        m = len(season)
+        sse = np.zeros_like(level)
+        for t, y in enumerate(values):
+            index = (start_step + t) % m
+            previous_season = season[index]
+            forecast = level + trend + previous_season
+            sse += (y - forecast) ** 2
+            new_level = alpha * (y - previous_season) + (1 - alpha) * (level + trend)
+            trend = beta * (new_level - level) + (1 - beta) * trend
+            season[index] = gamma * (y - new_level) + (1 - gamma) * previous_season
+            level = new_level
+        return level, trend, season, sse
+
+    def fit(self, values):
+        """Fit every series (columns of values) and return their ForecastState"""
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        level, trend, season, skip = self._initial_state(values)
+
+        with track("forecasting.fit") as info:
+            info['rows'] = values.size
+            # Broadcast the state to (G, S): one copy per parameter combination
+            G = len(self.grid)
+            alpha, beta, gamma = (self.grid[:, i:i + 1] for i in range(3))
+            grid_level, grid_trend, grid_season, sse = self._run(
+                values[skip:],
+                np.repeat(level[None], G, axis=0),
+                np.repeat(trend[None], G, axis=0),
+                np.repeat(season[:, None], G, axis=1),
+                alpha, beta, gamma, skip)
+
+            best = np.argmin(sse, axis=0)
+            series = np.arange(values.shape[1])
+            return ForecastState(grid_level[best, series], grid_trend[best, series], grid_season[:, best, series],
+                                 alpha[best, 0], beta[best, 0], gamma[best, 0], len(values), sse[best, series])
+
+    def update(self, state, values):
+        """Warm start: continue a fitted state over new observations, keeping its parameters"""
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        state = state.copy()
+        with track("forecasting.update") as info:
+            info['rows'] = values.size
+            state.level, state.trend, state.season, sse = self._run(
+                values, state.level, state.trend, state.season, state.alpha, state.beta, state.gamma, state.steps)
+        state.sse += sse
+        state.steps += len(values)
+        return state
+
+    def forecast(self, state, horizon):
+        """(horizon, S) array of point forecasts"""
+        steps = np.arange(1, horizon + 1)[:, None]
+        season = state.season[(state.steps + steps[:, 0] - 1) % len(state.season)]
+        return state.level + steps * state.trend + season
+
+def in_sample_r2(values, state):
+    """1 - SSE / SST of the one-step-ahead forecasts, per series"""
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values[:, None]
+    sst = ((values - values.mean(axis=0)) ** 2).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(sst > 0, 1 - state.sse / sst, 0.0)
+
+class ForecastCache:
+    """Fitted states kept across reruns and warm-started as new periods arrive
+
+    The last period is usually still filling up (e.g. the current month),
+    so the cached state stops one period short and that period is replayed
+    on every call. A state is only continued when the segments and every
+    settled period it was fitted on are unchanged (a backdated write
+    rewrites history); otherwise it is refitted. A key of None is never
+    cached, and the least recently used states beyond max_entries are
+    dropped (more of them when the memory governor calls shrink()).
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def forecast(self, key, values, season_length, horizon, segments=None):
+        values = np.asarray(values, dtype=np.float64)
+        model = HoltWinters(season_length)
+        if len(values) < 3 or key is None:
+            state = model.fit(values)
+            return model.forecast(state, horizon), state
+        segments = None if segments is None else list(segments)
+        with self._lock:
+            entry = self._entries.get(key)
+        settled = len(values) - 1
+        if (entry is not None and entry['segments'] == segments and entry['steps'] <= settled
+                and np.array_equal(entry['history'], values[:entry['steps']])):
+            state = model.update(entry['state'], values[entry['steps']:settled])
+        else:
+            state = model.fit(values[:settled])
+        with self._lock:
+            history = values[:settled].copy()
+            self._entries[key] = {'state': state, 'steps': settled, 'segments': segments, 'history': history,
+                                  'nbytes': state.nbytes + history.nbytes}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        current = model.update(state, values[settled:])
+        return model.forecast(current, horizon), current
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(entry['nbytes'] for entry in self._entries.values())
+
+    def shrink(self, nbytes):
+        """Drop least recently used states until nbytes are freed (or none is left); returns the bytes freed"""
+        freed = 0
+        with self._lock:
+            while self._entries and freed < nbytes:
+                _, entry = self._entries.popitem(last=False)
+                freed += entry['nbytes']
+        return freed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every AdvancedAnalytics instance so fitted states survive Streamlit reruns
+cache = ForecastCache()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Ingestion de fichiers
+================================================
+
+Importe tous les fichiers CSV / XLSX d'un dossier (ou le surveille) :
+les fichiers sont lus et préparés (montants en entiers, empreinte de
+chaque ligne) dans un pool de processus, les fichiers déjà ingérés sont
+reconnus à leur somme de contrôle, les lignes déjà présentes à leur
+empreinte (colonne row_hash indexée), et tout est écrit par l'écrivain
+unique de la base.
+
+Usage :
+    python ingestion.py depots/                       # un passage
+    python ingestion.py depots/ --workers 4
+    python ingestion.py depots/ --watch --interval 10 # surveillance continue
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from storage import SALES_COLUMNS, prepare_sales
+
+PATTERNS = ('*.csv', '*.xlsx')
+OPTIONAL_COLUMNS = ('sale_date',)
+# Spreadsheet headers accepted for each column (compared without case or accents)
+COLUMN_ALIASES = {
+    'country': ('country', 'pays'),
+    'year': ('year', 'annee'),
+    'type': ('type', "type d'huile", 'type_huile'),
+    'sales': ('sales', 'ventes', 'ventes (€)', 'ventes (eur)'),
+    'volume': ('volume', 'volume (l)'),
+    'price': ('price', 'prix', 'prix (€/l)', 'prix (eur/l)'),
+    'sale_date': ('sale_date', 'date', 'date de vente'),
+}
+
+def scan(directory, patterns=PATTERNS):
+    """Files of a directory matching the patterns, sorted by name"""
+    directory = Path(directory)
+    return sorted({path for pattern in patterns for path in directory.glob(pattern) if path.is_file()})
+
+def file_checksum(path, block_size=1 << 20):
+    """SHA-256 of a file's content, read by blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _normalize(header):
+    text = unicodedata.normalize('NFKD', str(header)).encode('ascii', 'ignore').decode()
+    return text.strip().lower()
+
+def map_columns(header):
+    """{position: sales column} of a header row; raises ValueError when a required column is missing"""
+    aliases = {_normalize(alias): column for column, names in COLUMN_ALIASES.items() for alias in names}
+    positions = {}
+    for position, name in enumerate(header):
+        column = aliases.get(_normalize(name)) if name is not None else None
+        if column is not None and column not in positions.values():
+            positions[position] = column
+    missing = [column for column in SALES_COLUMNS if column not in positions.values()]
+    if missing:
+        raise ValueError(f"colonnes manquantes : {', '.join(missing)}")
+    return positions
+
+def validate_sales(frame):
+    """(valid rows with the sales dtypes, number of rejected rows), checked column-wise
+
+    Rows with a missing dimension, a non-numeric or negative measure or an
+    unparseable sale date are rejected.
+    """
+    frame = frame.copy()
+    valid = np.ones(len(frame), dtype=bool)
+    for column in ('country', 'type'):
+        frame[column] = frame[column].astype('string').str.strip()
+        valid &= (frame[column].notna() & (frame[column] != '')).to_numpy()
+    for column in ('year', 'sales', 'volume', 'price'):
+        frame[column] = pd.to_numeric(frame[column], errors='coerce')
+        valid &= (frame[column].notna() & (frame[column] >= 0)).to_numpy()
+    valid &= (frame['year'] == frame['year'].round()).to_numpy()
+    if 'sale_date' in frame:
+        dates = pd.to_datetime(frame['sale_date'], errors='coerce')
+        valid &= (dates.notna() | frame['sale_date'].isna()).to_numpy()
+        frame['sale_date'] = dates.dt.strftime('%Y-%m-%d').astype(object).where(dates.notna(), None)
+    frame = frame[valid]
+    frame = frame.astype({'country': object, 'type': object, 'year': np.int64})
+    return frame.reset_index(drop=True), int((~valid).sum())
+
+def iter_xlsx(source, sheet_name=None, batch_size=50_000):
+    """Stream the sales of a spreadsheet as DataFrames of at most batch_size rows
+
+    The workbook is opened in openpyxl's read-only mode and parsed row by
+    row, so memory depends on batch_size and not on the file size. source
+    is a path or a binary file object; rows are not validated.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.active
+        rows = sheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        positions = map_columns(header)
+        names = list(positions.values())
+        indices = list(positions)
+        batch = []
+        for row in rows:
+            if row is None or all(value is None for value in row):
+                continue
+            batch.append([row[index] if index < len(row) else None for index in indices])
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch, columns=names)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=names)
+    finally:
+        workbook.close()
+
+def read_sales_file(path):
+    """(valid sales rows, rejected row count) of a CSV or XLSX file, restricted to the known columns"""
+    path = Path(path)
+    if path.suffix.lower() == '.xlsx':
+        batches = [validate_sales(batch) for batch in iter_xlsx(path)]
+        if not batches:
+            return pd.DataFrame(columns=SALES_COLUMNS), 0
+        return pd.concat([frame for frame, _ in batches], ignore_index=True), sum(rejected for _, rejected in batches)
+    frame = pd.read_csv(path)
+    positions = map_columns(frame.columns)
+    return validate_sales(frame.iloc[:, list(positions)].set_axis(list(positions.values()), axis=1))
+
+def parse_file(path):
+    """(path, frame ready to store or None, rejected rows, error or None) of one file"""
+    try:
+        frame, rejected = read_sales_file(path)
+        return path, prepare_sales(frame), rejected, None
+    except Exception as e:
+        return path, None, 0, str(e)
+
+def ingest(database, paths, workers=None):
+    """Parse new files in parallel and append their new rows; returns a summary dict
+
+    Files whose content was already ingested (same checksum, under any
+    name) are skipped before parsing. The others are handed to the writer
+    as soon as they are parsed, so parsing and writing overlap. A file
+    that fails to parse or to be written is listed in errors, not
+    recorded, and retried on the next run; the other files are kept.
+    """
+    start = time.perf_counter()
+    paths = [Path(path) for path in paths]
+    known = database.ingested_checksums()
+    pending = {}
+    for path in paths:
+        checksum = file_checksum(path)
+        if checksum not in known:
+            pending.setdefault(checksum, path)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending) or 1))
+    checksums = {path: checksum for checksum, path in pending.items()}
+    summary = {'files': len(paths), 'ingested': 0, 'skipped': len(paths) - len(pending), 'failed': 0,
+               'rows': 0, 'inserted': 0, 'rejected': 0, 'errors': {}}
+    futures = []
+
+    def handle(path, frame, rejected, error):
+        if error is not None:
+            summary['failed'] += 1
+            summary['errors'][str(path)] = error
+            return
+        futures.append((path, len(frame), rejected, database.ingest_frame(frame, checksums[path], path)))
+
+    if workers == 1:
+        for path in pending.values():
+            handle(*parse_file(path))
+    else:
+        # spawn: the parent may already run the writer thread
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            for future in as_completed([pool.submit(parse_file, path) for path in pending.values()]):
+                handle(*future.result())
+
+    for path, rows, rejected, future in futures:
+        try:
+            summary['inserted'] += future.result()
+        except Exception as e:
+            summary['failed'] += 1
+            summary['errors'][str(path)] = str(e)
+            continue
+        summary['ingested'] += 1
+        summary['rows'] += rows
+        summary['rejected'] += rejected
+    summary['duplicates'] = summary['rows'] - summary['inserted']
+    summary['workers'] = workers
+    summary['seconds'] = seconds = time.perf_counter() - start
+    summary['files_per_second'] = len(paths) / seconds if seconds else float('inf')
+    summary['rows_per_second'] = summary['rows'] / seconds if seconds else float('inf')
+    return summary
+
+def watch(database, directory, interval=5.0, patterns=PATTERNS, workers=None, settle=1.0, on_batch=None,
+          iterations=None):
+    """Poll a directory and ingest new or changed files; on_batch(summary) after each non-empty pass
+
+    Files modified less than settle seconds ago may still be being copied
+    and wait for the next pass, as do files that failed: a file is only
+    marked as seen once ingested. Runs forever unless iterations is given.
+    """
+    seen = {}
+    passes = 0
+    while iterations is None or passes < iterations:
+        passes += 1
+        now = time.time()
+        pending = {}
+        for path in scan(directory, patterns):
+            stat = path.stat()
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if seen.get(path) != signature and now - stat.st_mtime >= settle:
+                pending[path] = signature
+        if pending:
+            summary = ingest(database, list(pending), workers)
+            seen.update((path, signature) for path, signature in pending.items()
+                        if str(path) not in summary['errors'])
+            if on_batch is not None:
+                on_batch(summary)
+        if iterations is None or passes < iterations:
+            time.sleep(interval)
+
+def print_summary(summary):
+    print(f"📥 {summary['ingested']}/{summary['files']} fichiers ingérés "
+          f"({summary['skipped']} déjà connus, {summary['failed']} en erreur), "
+          f"{summary['inserted']:,} lignes ajoutées, {summary['duplicates']:,} doublons ignorés, "
+          f"{summary['rejected']:,} lignes invalides")
+    print(f"⏱️ {summary['seconds']:.2f}s avec {summary['workers']} processus : "
+          f"{summary['files_per_second']:.1f} fichiers/s, {summary['rows_per_second']:,.0f} lignes/s")
+    for path, error in summary['errors'].items():
+        print(f"❌ {path} : {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion des fichiers de ventes d'un dossier")
+    parser.add_argument('directory', help="Dossier des fichiers CSV / XLSX")
+    parser.add_argument('--db', default=os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"), help="Fichier de base")
+    parser.add_argument('--backend', default=os.environ.get("OLIVE_OIL_DB_BACKEND", "sqlite"),
+                        choices=['sqlite', 'duckdb'])
+    parser.add_argument('--pattern', nargs='+', default=list(PATTERNS), help="Motifs des fichiers à importer")
+    parser.add_argument('--workers', type=int, default=None, help="Processus de lecture (défaut : un par cœur)")
+    parser.add_argument('--watch', action='store_true', help="Surveiller le dossier en continu")
+    parser.add_argument('--interval', type=float, default=5.0, help="Secondes entre deux passages (--watch)")
+    args = parser.parse_args()
+
+    from database import OliveOilDatabase
+
+    database = OliveOilDatabase(args.db, args.backend)
+    if args.watch:
+        print(f"👀 Surveillance de {args.directory} (Ctrl+C pour arrêter)")
+        try:
+            watch(database, args.directory, args.interval, args.pattern, args.workers, on_batch=print_summary)
+        except KeyboardInterrupt:
+            pass
+    else:
+        print_summary(ingest(database, scan(args.directory, args.pattern), args.workers))
+    database.close()
+
+if __name__ == "__main__":
+    main()
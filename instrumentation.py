@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+def result_size(result):
+    """Estimate (rows, bytes) of a value returned by an instrumented call"""
+    if isinstance(result, pd.DataFrame):
+        return len(result), int(result.memory_usage(index=False).sum())
+    if isinstance(result, pd.Series):
+        return len(result), int(result.memory_usage(index=False))
+    if isinstance(result, str):
+        return None, len(result.encode('utf-8'))
+    if isinstance(result, (list, tuple, dict)):
+        return len(result), None
+    return None, None
+
+class Instrumentation:
+    """Collects timings, row counts and sizes of hot-path calls"""
+
+    def __init__(self, max_spans=10000, jsonl_path=None, max_profiles=20):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.spans = deque(maxlen=max_spans)
+        self.totals = {}
+        self.jsonl_path = jsonl_path
+        self.profiles = {}
+        self.max_profiles = max_profiles
+        # Callables adding their own lines to the Prometheus text
+        self.collectors = []
+
+    # --- runs ---------------------------------------------------------------
+
+    def start_run(self):
+        """Start a new run (one Streamlit rerun) for the current thread"""
+        self._local.run_id = uuid.uuid4().hex[:12]
+        return self._local.run_id
+
+    @property
+    def run_id(self):
+        return getattr(self._local, 'run_id', None)
+
+    def run_spans(self, run_id):
+        """Spans recorded during a given run, in start order"""
+        with self._lock:
+            return [span for span in self.spans if span['run_id'] == run_id]
+
+    # --- recording ----------------------------------------------------------
+
+    def record(self, name, duration, rows=None, nbytes=None, started_at=None):
+        """Store one measurement and update the per-operation totals"""
+        span = {
+            'name': name,
+            'run_id': self.run_id,
+            'started_at': started_at or time.time() - duration,
+            'duration': duration,
+            'rows': rows,
+            'bytes': nbytes,
+            'thread': threading.current_thread().name,
+        }
+        with self._lock:
+            self.spans.append(span)
+            total = self.totals.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                                  'rows': 0, 'bytes': 0})
+            total['calls'] += 1
+            total['seconds'] += duration
+            total['max_seconds'] = max(total['max_seconds'], duration)
+            total['rows'] += rows or 0
+            total['bytes'] += nbytes or 0
+            if self.jsonl_path:
+                with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(span) + "\n")
+        return span
+
+    @contextmanager
+    def track(self, name):
+        """Time a block; the yielded dict may receive 'rows' and 'bytes'"""
+        info = {}
+        started_at = time.time()
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.record(name, time.perf_counter() - start, info.get('rows'), info.get('bytes'), started_at)
+
+    def timed(self, name=None):
+        """Decorator timing a function and sizing its result"""
+        def decorator(func):
+            label = name or func.__qualname__
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.track(label) as info:
+                    result = func(*args, **kwargs)
+                    info['rows'], info['bytes'] = result_size(result)
+                    return result
+            return wrapper
+        return decorator
+
+    # --- profiling ----------------------------------------------------------
+
+    @contextmanager
+    def profile(self, engine=None):
+        """Profile a block with cProfile or pyinstrument and keep the report for the run"""
+        if engine is None:
+            yield
+            return
+
+        run_id = self.run_id
+        if engine == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                self._keep_profile(run_id, profiler.output_text(unicode=True))
+            return
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(40)
+            self._keep_profile(run_id, stream.getvalue())
+
+    def _keep_profile(self, run_id, report):
+        """Store a profiler report, dropping the oldest beyond max_profiles"""
+        with self._lock:
+            self.profiles[run_id] = report
+            while len(self.profiles) > self.max_profiles:
+                del self.profiles[next(iter(self.profiles))]
+
+    # --- reporting ----------------------------------------------------------
+
+    def summary(self):
+        """Per-operation totals as a DataFrame, slowest first"""
+        with self._lock:
+            rows = [{'operation': name, **total} for name, total in self.totals.items()]
+        if not rows:
+            return pd.DataFrame(columns=['operation', 'calls', 'seconds', 'max_seconds', 'rows', 'bytes'])
+        df = pd.DataFrame(rows)
+        df['mean_seconds'] = df['seconds'] / df['calls']
+        return df.sort_values('seconds', ascending=False).reset_index(drop=True)
+
+    def to_jsonl(self):
+        """Every buffered span as JSON lines"""
+        with self._lock:
+            spans = list(self.spans)
+        return "".join(json.dumps(span) + "\n" for span in spans)
+
+    def export_jsonl(self, path):
+        """Write every buffered span to a JSON lines file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.to_jsonl())
+
+    def prometheus_text(self):
+        """Totals in the Prometheus text exposition format"""
+        metrics = [
+            ('olive_oil_operation_calls_total', 'counter', 'calls', "Number of calls"),
+            ('olive_oil_operation_seconds_total', 'counter', 'seconds', "Time spent in seconds"),
+            ('olive_oil_operation_seconds_max', 'gauge', 'max_seconds', "Slowest call in seconds"),
+            ('olive_oil_operation_rows_total', 'counter', 'rows', "Rows returned"),
+            ('olive_oil_operation_bytes_total', 'counter', 'bytes', "Bytes returned"),
+        ]
+        with self._lock:
+            totals = {name: dict(total) for name, total in self.totals.items()}
+        lines = []
+        for metric, kind, key, help_text in metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, total in sorted(totals.items()):
+                lines.append(f'{metric}{{operation="{name}"}} {total[key]}')
+        return "\n".join(lines) + "\n" + "".join(collector() for collector in self.collectors)
+
+    def add_collector(self, collector):
+        """Append collector() (Prometheus text lines) to every export"""
+        self.collectors.append(collector)
+
+    def serve_prometheus(self, port=9108, host="127.0.0.1"):
+        """Expose /metrics (and the slow-query report on /queries) on a local HTTP server in a daemon thread"""
+        instrumentation = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.rstrip('/')
+                if path == '/queries':
+                    # Slow-query report of the process, as JSON
+                    body, content_type = query_log.to_json().encode('utf-8'), 'application/json'
+                elif path in ('', '/metrics'):
+                    body, content_type = instrumentation.prometheus_text().encode('utf-8'), 'text/plain; version=0.0.4'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+        return server
+
+class LoggedCursor:
+    """Cursor proxy adding the time and rows of each fetch to its statement in the query log"""
+
+    def __init__(self, log, backend, key, sql, params, cursor):
+        self._log = log
+        self._cursor = cursor
+        self.backend = backend
+        self.key = key
+        self.sql = sql
+        self.params = params
+        self.elapsed = 0.0
+        self.rows = 0
+        self.slow = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(1000)
+            if not rows:
+                return
+            yield from rows
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        if method.__name__ == 'fetchone':
+            rows = int(result is not None)
+        else:
+            rows = len(result)
+        self._log.observe(self, time.perf_counter() - start, rows)
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._fetch(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def df(self):
+        return self._fetch(self._cursor.df)
+
+class QueryLog:
+    """Latency and rows of every SQL statement, with the plans of the slow ones
+
+    Statements are aggregated per backend on their normalized text. A call is slow
+    once its execution plus fetches exceed slow_ms; the first slow call of
+    a statement captures its plan with the backend's explain() on a fresh
+    connection, which also names the tables it reads with a full scan.
+    """
+
+    EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+    def __init__(self, slow_ms=100.0, max_statements=1000, max_slow=200):
+        self.slow_ms = slow_ms
+        self.max_statements = max_statements
+        self._lock = threading.Lock()
+        self.statements = OrderedDict()
+        self.slow_calls = deque(maxlen=max_slow)
+
+    @staticmethod
+    def normalize(sql):
+        """Statement text with collapsed whitespace and placeholder lists of any length folded"""
+        text = " ".join(sql.split())
+        return re.sub(r"\?(?:\s*,\s*\?)+", "?, …", text)
+
+    def execute(self, backend, conn, sql, params=()):
+        """Run a statement and return a LoggedCursor; DML row counts are recorded at once"""
+        start = time.perf_counter()
+        cursor = conn.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        call = LoggedCursor(self, backend, (backend.name, self.normalize(sql)), sql, params, cursor)
+        rowcount = getattr(cursor, 'rowcount', -1)
+        self.observe(call, elapsed, rowcount if rowcount and rowcount > 0 else 0, new_call=True)
+        return call
+
+    @contextmanager
+    def track(self, backend, sql, params=()):
+        """Log a statement run by other means (executemany); the yielded dict may receive 'rows'"""
+        info = {}
+        call = LoggedCursor(self, backend, (backend.name, self.normalize(sql)), sql, params, None)
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.observe(call, time.perf_counter() - start, info.get('rows') or 0, new_call=True)
+
+    def observe(self, call, seconds, rows, new_call=False):
+        """Add seconds and rows of one step (execution or fetch) of a call to its statement"""
+        call.elapsed += seconds
+        call.rows += rows
+        explain = False
+        with self._lock:
+            stats = self.statements.get(call.key)
+            if stats is None:
+                stats = self.statements[call.key] = {
+                    'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'rows': 0,
+                    'slow_calls': 0, 'plan': None, 'full_scan': None, 'scanned': [],
+                }
+                while len(self.statements) > self.max_statements:
+                    self.statements.popitem(last=False)
+            self.statements.move_to_end(call.key)
+            stats['calls'] += int(new_call)
+            stats['seconds'] += seconds
+            stats['rows'] += rows
+            stats['max_seconds'] = max(stats['max_seconds'], call.elapsed)
+            if call.slow is not None:
+                call.slow.update(seconds=call.elapsed, rows=call.rows)
+            elif call.elapsed * 1000 >= self.slow_ms:
+                stats['slow_calls'] += 1
+                call.slow = {'statement': call.key[1], 'backend': call.key[0], 'seconds': call.elapsed,
+                             'rows': call.rows, 'at': time.time(), 'thread': threading.current_thread().name}
+                self.slow_calls.append(call.slow)
+                if stats['plan'] is None and call.key[1].split(" ", 1)[0].upper() in self.EXPLAINABLE:
+                    # Claimed under the lock so that concurrent slow calls explain once
+                    stats['plan'] = explain = []
+        if explain is not False:
+            self._explain(call, stats)
+
+    def _explain(self, call, stats):
+        try:
+            plan, scanned = call.backend.explain(call.sql, call.params)
+        except Exception as e:
+            plan, scanned = [f"(plan indisponible : {e})"], []
+        with self._lock:
+            stats.update(plan=plan, scanned=scanned, full_scan=bool(scanned))
+
+    def report(self, slow_only=False):
+        """Per-statement totals as a DataFrame, most time-consuming first"""
+        columns = ['statement', 'backend', 'calls', 'seconds', 'mean_ms', 'max_ms', 'rows', 'slow_calls',
+                   'full_scan', 'scanned', 'plan']
+        with self._lock:
+            rows = [{'backend': backend, 'statement': statement, **stats, 'plan': "\n".join(stats['plan'] or []),
+                     'scanned': ", ".join(stats['scanned'])}
+                    for (backend, statement), stats in self.statements.items() if stats['slow_calls'] or not slow_only]
+        if not rows:
+            return pd.DataFrame(columns=columns)
+        df = pd.DataFrame(rows)
+        df['mean_ms'] = df['seconds'] / df['calls'].clip(lower=1) * 1000
+        df['max_ms'] = df['max_seconds'] * 1000
+        return df.sort_values('seconds', ascending=False)[columns].reset_index(drop=True)
+
+    def recent_slow_calls(self):
+        """Last slow calls, newest first"""
+        with self._lock:
+            return [dict(call) for call in reversed(self.slow_calls)]
+
+    def to_json(self, slow_only=True):
+        """Aggregated report and recent slow calls as JSON"""
+        report = self.report(slow_only)
+        return json.dumps({'slow_ms': self.slow_ms, 'statements': json.loads(report.to_json(orient='records')),
+                           'recent': self.recent_slow_calls()}, ensure_ascii=False)
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
+            self.slow_calls.clear()
+
+# Global instrumentation instance
+metrics = Instrumentation(jsonl_path=os.environ.get("OLIVE_OIL_METRICS_JSONL"))
+# Every statement run through StorageBackend.execute
+query_log = QueryLog(slow_ms=float(os.environ.get("OLIVE_OIL_SLOW_QUERY_MS", 100)))
+timed = metrics.timed
+track = metrics.track
@@ -11,10 +11,36 @@ avec vérification des dépendances et configuration automatique.
 
 import os
 import sys
+import argparse
 import subprocess
 import importlib.util
 from pathlib import Path
 
+# Modules dont le coût d'import pèse sur le démarrage de l'application
+STARTUP_MODULES = [
+    'streamlit',
+    'pandas',
+    'plotly.express',
+    'sklearn.ensemble',
+    'google.generativeai',
+    'database',
+    'analytics',
+]
+
+# Premier rendu de app.py dans un processus neuf, via le banc de test Streamlit
+FIRST_RUN_SCRIPT = '''
+import time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+from instrumentation import metrics
+at = AppTest.from_file("app.py", default_timeout=300)
+at.run()
+print(time.perf_counter() - start)
+summary = metrics.summary().set_index('operation')['seconds']
+print(summary.get('app.first_paint', float('nan')))
+print(summary.head(8).to_string())
+'''
+
 def check_python_version():
     """Vérifier la version de Python"""
     if sys.version_info < (3, 8):
@@ -101,7 +127,52 @@ def check_env():
     
     return True
 
-def launch_app():
+def measure_import(module):
+    """Mesurer le temps d'import d'un module dans un processus neuf"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+def report_startup_time():
+    """Afficher le coût des imports et la durée du premier rendu de l'application"""
+    print("\n⏱️ Rapport de démarrage")
+    print("=" * 50)
+    
+    for module in STARTUP_MODULES:
+        seconds = measure_import(module)
+        if seconds is None:
+            print(f"⚠️ {module:<22} import impossible")
+        else:
+            print(f"📦 {module:<22} {seconds * 1000:8.0f} ms")
+    
+    result = subprocess.run([sys.executable, "-c", FIRST_RUN_SCRIPT], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"❌ Échec du premier rendu : {result.stderr.strip().splitlines()[-1:]}")
+        return False
+    
+    lines = result.stdout.strip().splitlines()
+    print(f"\n🎨 Premier affichage (titre) : {float(lines[1]) * 1000:.0f} ms")
+    print(f"🖥️ Premier rendu complet de app.py : {float(lines[0]) * 1000:.0f} ms")
+    print("\nOpérations les plus coûteuses du premier rendu :")
+    for line in lines[3:]:
+        print(f"   {line}")
+    return True
+
+def streamlit_command(port=8501, *options):
+    """Commande de lancement du serveur Streamlit de l'application"""
+    return [sys.executable, "-m", "streamlit", "run", "app.py", "--server.port", str(port), *options]
+
+def start_warmup(top_k=None):
+    """Préchauffer le cache du dashboard en arrière-plan pendant le démarrage de Streamlit"""
+    command = [sys.executable, "dashboard.py"]
+    if top_k is not None:
+        command += ["--top-k", str(top_k)]
+    print("🔥 Préchauffage du cache du dashboard en arrière-plan...")
+    return subprocess.Popen(command)
+
+def launch_app(warmup=False, top_k=None):
     """Lancer l'application"""
     print("\n🚀 Lancement de Olive Oil Tracker Pro...")
     print("=" * 50)
@@ -125,8 +196,11 @@ def launch_app():
         print("🔄 Pour arrêter: Ctrl+C")
         print("=" * 50)
         
+        if warmup:
+            start_warmup(top_k)
+        
         # Lancer Streamlit
-        subprocess.run([sys.executable, "-m", "streamlit", "run", "app.py", "--server.port", "8501"])
+        subprocess.run(streamlit_command())
         
     except KeyboardInterrupt:
         print("\n👋 Application arrêtée par l'utilisateur")
@@ -138,6 +212,15 @@ def launch_app():
 
 def main():
     """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Lanceur Olive Oil Tracker Pro")
+    parser.add_argument('--startup-report', action='store_true',
+                        help="Mesurer le temps de démarrage au lieu de lancer l'application")
+    parser.add_argument('--warmup', action='store_true',
+                        help="Précalculer le dashboard pour toutes les combinaisons de filtres au lancement")
+    parser.add_argument('--top-k', type=int, default=None,
+                        help="Avec --warmup, ne précalculer que les K combinaisons les plus consultées")
+    args = parser.parse_args()
+    
     print("🫒 Olive Oil Tracker Pro - Lanceur")
     print("=" * 40)
     
@@ -146,8 +229,12 @@ def main():
         print("❌ Veuillez exécuter ce script depuis le répertoire du projet")
         return
     
+    if args.startup_report:
+        report_startup_time()
+        return
+    
     # Lancer l'application
-    success = launch_app()
+    success = launch_app(args.warmup, args.top_k)
     
     if not success:
         print("\n💡 Solutions possibles:")
@@ -0,0 +1,495 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Tests de charge
+==========================================
+
+Démarre un serveur Streamlit local (commande de launch_pro.py) sur une
+copie de la base, puis simule N sessions simultanées : chaque session est
+un client websocket sans navigateur qui rejoue le protocole de Streamlit
+(réexécutions avec l'état des widgets). Les scénarios de
+loadtest_scenarios.json enchaînent changements de filtres, actions dans
+les onglets et saisies ; chaque réexécution est chronométrée et le CPU et
+la mémoire (RSS) du serveur sont échantillonnés. Chaque scénario garde
+une mesure de référence (baseline) : la commande échoue quand une mesure
+la dépasse de plus de tolerance_pct %, ou dépasse un seuil absolu
+(thresholds, par exemple zéro erreur). --record-baseline remplace les
+références par les mesures du passage, à refaire après un changement de
+machine ou une optimisation.
+
+Les onglets Streamlit sont rendus par le navigateur : chaque réexécution
+exécute le code de tous les onglets, un changement d'onglet ne coûte rien
+au serveur. Les scénarios agissent donc sur les widgets de chaque onglet.
+
+Usage :
+    python loadtest.py                                  # tous les scénarios
+    python loadtest.py --scenario filtres --sessions 20
+    python loadtest.py --output loadtest_results.json
+    python loadtest.py --record-baseline                # nouvelles références
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import ExitStack
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from launch_pro import streamlit_command
+
+SCENARIO_FILE = "loadtest_scenarios.json"
+APP_DIR = Path(__file__).resolve().parent
+
+# Widgets that scenario steps can set, looked up by key then by label
+WIDGET_TYPES = ('selectbox', 'radio', 'toggle', 'checkbox', 'number_input', 'text_input')
+# Summary metrics that thresholds can bound
+THRESHOLD_METRICS = ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'errors', 'cpu_mean_percent', 'rss_peak_mb')
+PERCENTILES = (50, 90, 95, 99)
+# Metrics recorded as a scenario's baseline by --record-baseline
+BASELINE_METRICS = ('p95_ms', 'p99_ms', 'rss_peak_mb')
+# Allowed excess over the baseline, in percent, when a scenario does not set its own
+DEFAULT_TOLERANCE_PCT = 25
+
+def load_scenarios(path=SCENARIO_FILE, names=None):
+    """Scenarios of a JSON file, all of them or those named"""
+    with open(path, encoding='utf-8') as f:
+        scenarios = json.load(f)['scenarios']
+    for scenario in scenarios:
+        unknown = (set(scenario.get('thresholds', {})) | set(scenario.get('baseline', {}))) - set(THRESHOLD_METRICS)
+        if unknown:
+            raise ValueError(f"Seuils inconnus dans '{scenario['name']}' : {', '.join(sorted(unknown))}")
+    if names:
+        missing = set(names) - {scenario['name'] for scenario in scenarios}
+        if missing:
+            raise ValueError(f"Scénarios inconnus : {', '.join(sorted(missing))}")
+        scenarios = [scenario for scenario in scenarios if scenario['name'] in names]
+    return scenarios
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+class Server:
+    """Streamlit server of app.py on a copy of the database, in a temporary directory
+
+    The copy keeps scenario edits away from the original; a throwaway
+    secrets file stands in for .streamlit/secrets.toml (no Gemini key).
+    """
+
+    def __init__(self, db_path, port=None, startup_timeout=60):
+        self.db_path = db_path
+        self.port = port or free_port()
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self.tmp = None
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.port}"
+
+    def _copy_database(self):
+        copy = os.path.join(self.tmp, os.path.basename(self.db_path))
+        if os.path.exists(self.db_path):
+            shutil.copy2(self.db_path, copy)
+            if os.path.exists(self.db_path + "-wal"):
+                shutil.copy2(self.db_path + "-wal", copy + "-wal")
+        return copy
+
+    def start(self):
+        self.tmp = tempfile.mkdtemp(prefix="olive_loadtest_")
+        secrets = os.path.join(self.tmp, "secrets.toml")
+        Path(secrets).write_text('LOADTEST = "1"\n', encoding='utf-8')
+        env = {**os.environ, 'OLIVE_OIL_DB_PATH': self._copy_database()}
+        self.log = open(os.path.join(self.tmp, "server.log"), 'wb')
+        self.process = subprocess.Popen(
+            streamlit_command(self.port, "--server.headless", "true", "--secrets.files", secrets,
+                              "--browser.gatherUsageStats", "false", "--server.fileWatcherType", "none"),
+            cwd=APP_DIR, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.stop()
+                raise RuntimeError(f"Le serveur Streamlit s'est arrêté (code {self.process.returncode})")
+            try:
+                with urllib.request.urlopen(f"{self.url}/_stcore/health", timeout=1) as response:
+                    if response.status == 200:
+                        return self
+            except OSError:
+                time.sleep(0.2)
+        self.stop()
+        raise TimeoutError(f"Le serveur Streamlit n'a pas démarré en {self.startup_timeout}s")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        if self.tmp is not None:
+            self.log.close()
+            shutil.rmtree(self.tmp, ignore_errors=True)
+            self.tmp = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def process_usage(pid):
+    """(CPU seconds, RSS bytes) of a process, read from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        # The command name may contain spaces; the fields that follow it do not
+        fields = f.read().rsplit(')', 1)[1].split()
+    with open(f"/proc/{pid}/statm") as f:
+        pages = int(f.read().split()[1])
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK'), pages * os.sysconf('SC_PAGE_SIZE')
+
+class ResourceMonitor:
+    """Samples the CPU use and RSS of the server process in a background thread
+
+    CPU is process time over wall time between samples, in percent of one
+    core (it can exceed 100 % on several cores). Without /proc nothing is
+    sampled and the summary reports zeros.
+    """
+
+    def __init__(self, pid, interval=0.25):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self, last):
+        wall = time.perf_counter()
+        cpu, rss = process_usage(self.pid)
+        percent = (cpu - last[1]) / (wall - last[0]) * 100 if wall > last[0] else 0.0
+        self.samples.append({'seconds': wall, 'cpu_percent': percent, 'rss_bytes': rss})
+        return wall, cpu
+
+    def _loop(self):
+        try:
+            last = (time.perf_counter(), process_usage(self.pid)[0])
+            while not self._stop.wait(self.interval):
+                last = self._sample(last)
+            self._sample(last)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        self.samples = []
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="loadtest-monitor", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        cpu = [sample['cpu_percent'] for sample in self.samples]
+        rss = [sample['rss_bytes'] for sample in self.samples]
+        return {
+            'cpu_mean_percent': float(np.mean(cpu)) if cpu else 0.0,
+            'cpu_max_percent': float(np.max(cpu)) if cpu else 0.0,
+            'rss_start_mb': rss[0] / 1e6 if rss else 0.0,
+            'rss_peak_mb': max(rss) / 1e6 if rss else 0.0,
+        }
+
+class Session:
+    """One browser tab: a websocket to the server that reruns the script with widget states
+
+    Like the browser, the session keeps the value of every widget it has
+    set and sends them with each rerun; button clicks are sent once. The
+    element tree of each run is parsed with Streamlit's test tree to find
+    widgets by key or label.
+    """
+
+    def __init__(self, url, timeout=300):
+        self.url = url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.origin = url
+        self.timeout = timeout
+        self.tree = None
+        self.states = {}
+        self.triggers = {}
+        self._stack = ExitStack()
+        self._websocket = None
+
+    def __enter__(self):
+        try:
+            from websockets.sync.client import connect
+        except ImportError as e:
+            raise ImportError("Load tests require the 'websockets' package (pip install websockets)") from e
+        self._websocket = self._stack.enter_context(
+            connect(self.url, origin=self.origin, max_size=None, open_timeout=self.timeout))
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+
+    def set(self, widget, value):
+        """Keep a widget value, serialized as the browser does, for the next reruns"""
+        from streamlit.proto.NumberInput_pb2 import NumberInput
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        state = WidgetState(id=widget.id)
+        if widget.type in ('selectbox', 'radio'):
+            # Options are sent by their label
+            state.string_value = str(value)
+        elif widget.type in ('checkbox', 'toggle'):
+            state.bool_value = bool(value)
+        elif widget.type == 'number_input' and widget.proto.data_type == NumberInput.INT:
+            state.int_value = int(value)
+        elif widget.type == 'number_input':
+            state.double_value = float(value)
+        else:
+            state.string_value = str(value)
+        self.states[widget.id] = state
+
+    def click(self, button):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        self.triggers[button.id] = WidgetState(id=button.id, trigger_value=True)
+
+    def rerun(self):
+        """Rerun the script with the widget states; returns the seconds until it finished, st.rerun() included
+
+        Raises RuntimeError when the script fails to compile or shows an exception.
+        """
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+        from streamlit.testing.v1.element_tree import parse_tree_from_messages
+
+        message = BackMsg()
+        message.rerun_script.query_string = ""
+        message.rerun_script.widget_states.widgets.extend([*self.states.values(), *self.triggers.values()])
+        self.triggers = {}
+        start = time.perf_counter()
+        self._websocket.send(message.SerializeToString())
+        messages = []
+        while True:
+            received = ForwardMsg()
+            received.ParseFromString(self._websocket.recv(timeout=self.timeout))
+            messages.append(received)
+            if received.WhichOneof('type') != 'script_finished':
+                continue
+            if received.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+            # st.rerun(): the user waits for the next run, whose elements replace these
+            messages = []
+        seconds = time.perf_counter() - start
+
+        self.tree = parse_tree_from_messages(messages)
+        if received.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+            raise RuntimeError("Erreur de compilation de app.py")
+        if self.tree.exception:
+            raise RuntimeError(self.tree.exception[0].message)
+        return seconds
+
+def find_widget(tree, name):
+    """Widget of the given key, or else of the given label"""
+    for attribute in WIDGET_TYPES:
+        for widget in getattr(tree, attribute):
+            if widget.key == name:
+                return widget
+    for attribute in WIDGET_TYPES:
+        for widget in getattr(tree, attribute):
+            if widget.label == name:
+                return widget
+    raise LookupError(f"Widget introuvable : {name}")
+
+def apply_step(session, step, rng):
+    """Set the widgets of a step and click its button; the caller reruns the script
+
+    "random" picks one of the options of a select box or radio.
+    """
+    for name, value in step.get('set', {}).items():
+        widget = find_widget(session.tree, name)
+        if value == "random":
+            value = rng.choice(list(widget.options))
+        session.set(widget, value)
+    if 'click' in step:
+        buttons = [button for button in session.tree.button if step['click'] in button.label]
+        if not buttons:
+            raise LookupError(f"Bouton introuvable : {step['click']}")
+        session.click(buttons[0])
+
+def run_session(url, scenario, session, samples, lock):
+    """One simulated user: first load, then every step of every iteration"""
+    rng = random.Random(scenario.get('seed', 42) * 1000 + session)
+    steps = [(0, {'name': "chargement"})] + [
+        (iteration, step)
+        for iteration in range(1, scenario.get('iterations', 1) + 1)
+        for step in scenario['steps']
+    ]
+    with Session(url) as client:
+        for iteration, step in steps:
+            seconds, error = float('nan'), None
+            try:
+                if client.tree is not None:
+                    apply_step(client, step, rng)
+                seconds = client.rerun()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            with lock:
+                samples.append({'session': session, 'iteration': iteration, 'step': step['name'],
+                                'seconds': seconds, 'error': error})
+            think_time = scenario.get('think_time', 0)
+            if think_time:
+                time.sleep(rng.uniform(0, 2 * think_time))
+
+def summarize(samples, seconds):
+    """Latency percentiles (ms), errors and throughput of the reruns of a scenario"""
+    latencies = samples['seconds'].dropna().to_numpy() * 1000
+    summary = {f'p{q}_ms': float(np.percentile(latencies, q)) if len(latencies) else 0.0 for q in PERCENTILES}
+    summary.update({
+        'reruns': len(latencies),
+        'errors': int(samples['error'].notna().sum()),
+        'error_messages': samples['error'].dropna().value_counts().head(5).to_dict(),
+        'mean_ms': float(latencies.mean()) if len(latencies) else 0.0,
+        'max_ms': float(latencies.max()) if len(latencies) else 0.0,
+        'seconds': seconds,
+        'reruns_per_second': len(latencies) / seconds if seconds else 0.0,
+    })
+    return summary
+
+def step_table(samples):
+    """Percentiles (ms) per scenario step"""
+    grouped = samples.assign(ms=samples['seconds'] * 1000).groupby('step', sort=False)['ms']
+    return pd.DataFrame({
+        'reruns': grouped.count(),
+        'p50_ms': grouped.median(),
+        'p95_ms': grouped.quantile(0.95),
+        'max_ms': grouped.max(),
+        'errors': samples['error'].notna().groupby(samples['step'], sort=False).sum(),
+    }).reset_index()
+
+def check_thresholds(summary, thresholds, baseline=None, tolerance_pct=DEFAULT_TOLERANCE_PCT):
+    """Absolute thresholds, and baseline values plus tolerance_pct %, exceeded by a scenario summary"""
+    breaches = [f"{metric} : {summary[metric]:.1f} > {limit}"
+                for metric, limit in thresholds.items() if summary[metric] > limit]
+    for metric, reference in (baseline or {}).items():
+        limit = reference * (1 + tolerance_pct / 100)
+        if summary[metric] > limit:
+            breaches.append(f"{metric} : {summary[metric]:.1f} > {limit:.1f} "
+                            f"(référence {reference:.1f} + {tolerance_pct} %)")
+    return breaches
+
+def record_baseline(path, summaries, metrics=BASELINE_METRICS):
+    """Store the measured metrics of each scenario summary as its baseline in the scenario file"""
+    with open(path, encoding='utf-8') as f:
+        document = json.load(f)
+    measured = {summary['scenario']: summary for summary in summaries}
+    for scenario in document['scenarios']:
+        if scenario['name'] in measured:
+            scenario['baseline'] = {metric: round(measured[scenario['name']][metric], 1) for metric in metrics}
+    document['calibration'] = (f"Références mesurées le {time.strftime('%Y-%m-%d')} sur {os.cpu_count()} cœur(s) "
+                               f"(Python {platform.python_version()}), base d'exemple")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+
+def run_scenario(server, scenario, sessions=None):
+    """Run every session of a scenario in parallel against a started server; returns (summary, samples)"""
+    sessions = sessions or scenario.get('sessions', 1)
+    ramp = scenario.get('ramp_seconds', 0)
+    samples, lock = [], threading.Lock()
+
+    def start_session(session):
+        time.sleep(ramp * session / sessions)
+        run_session(server.url, scenario, session, samples, lock)
+
+    threads = [threading.Thread(target=start_session, args=(session,), name=f"loadtest-session-{session}")
+               for session in range(sessions)]
+    with ResourceMonitor(server.process.pid) as monitor:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+    samples = pd.DataFrame(samples, columns=['session', 'iteration', 'step', 'seconds', 'error'])
+    summary = {'scenario': scenario['name'], 'sessions': sessions, **summarize(samples, seconds), **monitor.summary()}
+    summary['breaches'] = check_thresholds(summary, scenario.get('thresholds', {}), scenario.get('baseline'),
+                                           scenario.get('tolerance_pct', DEFAULT_TOLERANCE_PCT))
+    return summary, samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Tests de charge de l'application Streamlit")
+    parser.add_argument('--db', default=os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"),
+                        help="Base copiée pour la durée du test")
+    parser.add_argument('--scenarios', default=SCENARIO_FILE, help="Fichier JSON des scénarios")
+    parser.add_argument('--scenario', nargs='+', help="Ne lancer que ces scénarios")
+    parser.add_argument('--sessions', type=int, default=None, help="Remplace le nombre de sessions des scénarios")
+    parser.add_argument('--port', type=int, default=None, help="Port du serveur (défaut : un port libre)")
+    parser.add_argument('--output', help="Fichier JSON des résultats")
+    parser.add_argument('--record-baseline', action='store_true',
+                        help="Enregistrer les mesures comme références des scénarios")
+    args = parser.parse_args()
+
+    try:
+        scenarios = load_scenarios(args.scenarios, args.scenario)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(2)
+
+    results = []
+    with Server(os.path.abspath(args.db), args.port) as server:
+        print(f"🌐 Serveur Streamlit démarré sur {server.url}")
+        for scenario in scenarios:
+            print(f"🚦 {scenario['name']} : {args.sessions or scenario.get('sessions', 1)} sessions...")
+            summary, samples = run_scenario(server, scenario, args.sessions)
+            steps = step_table(samples)
+            results.append({**summary, 'steps': steps.to_dict(orient='records')})
+            print(f"   {summary['reruns']} réexécutions en {summary['seconds']:.1f}s "
+                  f"({summary['reruns_per_second']:.1f}/s), {summary['errors']} erreurs")
+            print(f"   ⏱️ P50 {summary['p50_ms']:.0f} ms, P95 {summary['p95_ms']:.0f} ms, "
+                  f"P99 {summary['p99_ms']:.0f} ms, max {summary['max_ms']:.0f} ms")
+            print(f"   🖥️ Serveur : CPU moyen {summary['cpu_mean_percent']:.0f} %, "
+                  f"RSS max {summary['rss_peak_mb']:.0f} Mo")
+            print(steps.round(1).to_string(index=False))
+            for message, count in summary['error_messages'].items():
+                print(f"   ⚠️ {count} × {message}")
+            for breach in summary['breaches']:
+                print(f"   ❌ Seuil dépassé : {breach}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'scenarios': results,
+        }, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"📁 Résultats enregistrés dans {args.output}")
+
+    if args.record_baseline:
+        record_baseline(args.scenarios, results)
+        print(f"📏 Références enregistrées dans {args.scenarios}")
+        return
+
+    breaches = sum(len(result['breaches']) for result in results)
+    if breaches:
+        print(f"❌ {breaches} seuils dépassés")
+        sys.exit(1)
+    print("✅ Tous les seuils sont respectés")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Maintenance de la base
+=================================================
+
+Entretien automatique d'une base SQLite : statistiques de l'optimiseur
+rafraîchies (ANALYZE) après un nombre donné de lignes modifiées, pages
+libres rendues au système par petites étapes (PRAGMA incremental_vacuum)
+au-delà d'un taux de fragmentation, et WAL reporté dans la base
+(checkpoint passif) au-delà d'une taille donnée. Les écritures passent
+par l'écrivain unique en transactions courtes : les lecteurs ne sont
+jamais bloqués.
+
+Une base créée avant le vacuum incrémental doit être convertie une fois
+par un VACUUM complet (--full-vacuum), qui bloque les écritures pendant
+sa durée.
+
+Usage :
+    python maintenance.py                   # état de la base
+    python maintenance.py --run             # tâches dont le seuil est atteint
+    python maintenance.py --run --force     # toutes les tâches
+    python maintenance.py --watch --interval 300
+    python maintenance.py --full-vacuum
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+from instrumentation import track
+
+# Changed rows (data_version.changes) between two ANALYZE
+ANALYZE_CHANGES = 10_000
+# Rows sampled per index by ANALYZE, which keeps it to milliseconds on large tables
+ANALYSIS_LIMIT = 1000
+# Free pages, as a share of the file, that trigger an incremental vacuum
+VACUUM_FREE_RATIO = 0.10
+VACUUM_MIN_PAGES = 256
+# Pages released per writer transaction
+VACUUM_STEP_PAGES = 2000
+# WAL size that triggers a checkpoint
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+# Seconds between two passes of the scheduler
+DEFAULT_INTERVAL = 300.0
+
+TASKS = ('analyze', 'vacuum', 'checkpoint')
+AUTO_VACUUM_MODES = {0: 'none', 1: 'full', 2: 'incremental'}
+
+class Maintenance:
+    """Runs the SQLite housekeeping tasks whose thresholds are reached
+
+    Churn is read from data_version.changes (rows written since the
+    database was created) and compared with the value recorded in
+    maintenance_runs at the last ANALYZE. Fragmentation is the share of
+    free pages in the file. Other backends only report their file size:
+    DuckDB checkpoints and reclaims space on its own.
+    """
+
+    def __init__(self, database, analyze_changes=ANALYZE_CHANGES, analysis_limit=ANALYSIS_LIMIT,
+                 vacuum_free_ratio=VACUUM_FREE_RATIO, vacuum_min_pages=VACUUM_MIN_PAGES,
+                 vacuum_step_pages=VACUUM_STEP_PAGES, checkpoint_bytes=CHECKPOINT_BYTES):
+        self.database = database
+        self.analyze_changes = analyze_changes
+        self.analysis_limit = analysis_limit
+        self.vacuum_free_ratio = vacuum_free_ratio
+        self.vacuum_min_pages = vacuum_min_pages
+        self.vacuum_step_pages = vacuum_step_pages
+        self.checkpoint_bytes = checkpoint_bytes
+
+    @property
+    def supported(self):
+        return self.database.backend.name == 'sqlite'
+
+    @property
+    def backend(self):
+        return self.database.backend
+
+    def status(self):
+        """Size, fragmentation, churn and last runs of the database as a dict"""
+        path = self.database.db_path
+        # SQLite writes its log next to the file as name-wal, DuckDB as name.wal
+        wal_path = f"{path}-wal" if self.supported else f"{path}.wal"
+        status = {
+            'backend': self.backend.name,
+            'file_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+            'wal_bytes': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        }
+        conn = self.backend.connect()
+        try:
+            status['changes'] = self.backend.execute(conn, "SELECT changes FROM data_version").fetchone()[0] or 0
+            runs = self.backend.execute(conn, "SELECT task, changes, duration_ms, detail, ran_at FROM maintenance_runs")
+            status['runs'] = {task: {'changes': changes, 'duration_ms': duration_ms,
+                                     'detail': json.loads(detail) if detail else {}, 'ran_at': ran_at}
+                              for task, changes, duration_ms, detail, ran_at in runs.fetchall()}
+            if self.supported:
+                page_size, page_count, freelist, mode = (
+                    self.backend.execute(conn, f"PRAGMA {pragma}").fetchone()[0]
+                    for pragma in ('page_size', 'page_count', 'freelist_count', 'auto_vacuum'))
+                status.update(
+                    page_size=page_size,
+                    page_count=page_count,
+                    freelist_count=freelist,
+                    free_bytes=freelist * page_size,
+                    fragmentation=freelist / page_count if page_count else 0.0,
+                    auto_vacuum=AUTO_VACUUM_MODES.get(mode, str(mode)),
+                    analyzed=self.backend.execute(
+                        conn, "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None,
+                )
+        finally:
+            conn.close()
+        analyzed_at = status['runs'].get('analyze', {}).get('changes', 0)
+        status['changes_since_analyze'] = status['changes'] - analyzed_at
+        return status
+
+    def due(self, status=None):
+        """Tasks whose threshold is reached, in TASKS order"""
+        if not self.supported:
+            return []
+        status = status or self.status()
+        due = []
+        if not status['analyzed'] or status['changes_since_analyze'] >= self.analyze_changes:
+            due.append('analyze')
+        # Without incremental auto_vacuum, free pages only go away with a full VACUUM
+        if (status['auto_vacuum'] == 'incremental' and status['freelist_count'] >= self.vacuum_min_pages
+                and status['fragmentation'] >= self.vacuum_free_ratio):
+            due.append('vacuum')
+        if status['wal_bytes'] >= self.checkpoint_bytes:
+            due.append('checkpoint')
+        return due
+
+    def run(self, force=False, tasks=TASKS):
+        """Run the due tasks (every task of tasks with force); returns {task: detail}
+
+        Also writes the dashboard hits this process counted since the last run.
+        """
+        from dashboard import cache as dashboard_cache
+
+        dashboard_cache.flush_hits(self.database)
+        if not self.supported:
+            return {}
+        selected = [task for task in tasks if force or task in self.due()]
+        results = {}
+        for task in selected:
+            start = time.perf_counter()
+            with track(f"maintenance.{task}"):
+                detail = getattr(self, task)()
+            results[task] = detail
+            self._record(task, (time.perf_counter() - start) * 1000, detail)
+        return results
+
+    def analyze(self):
+        """Refresh the optimizer statistics on the writer (sampled by analysis_limit)"""
+        def refresh(conn):
+            self.backend.execute(conn, f"PRAGMA analysis_limit={int(self.analysis_limit)}")
+            self.backend.execute(conn, "ANALYZE")
+            self.backend.execute(conn, "PRAGMA optimize")
+            return self.backend.execute(conn, "SELECT changes FROM data_version").fetchone()[0]
+
+        return {'changes': self.database.writer.submit(refresh).result()}
+
+    def vacuum(self):
+        """Hand the free pages back to the file system, vacuum_step_pages per writer transaction"""
+        def step(conn):
+            free = self.backend.execute(conn, "PRAGMA freelist_count").fetchone()[0]
+            # sqlite3 runs a statement without result columns for a single step,
+            # and each step of incremental_vacuum releases one page
+            for _ in range(min(free, self.vacuum_step_pages)):
+                self.backend.execute(conn, "PRAGMA incremental_vacuum")
+            return self.backend.execute(conn, "PRAGMA freelist_count").fetchone()[0]
+
+        released = steps = 0
+        remaining = self._pragma('freelist_count')
+        while remaining:
+            left = self.database.writer.submit(step).result()
+            steps += 1
+            if left >= remaining:
+                break
+            released += remaining - left
+            remaining = left
+        return {'pages': released, 'steps': steps, 'free_pages': remaining}
+
+    def checkpoint(self):
+        """Copy the WAL into the database without waiting for readers or the writer
+
+        A passive checkpoint copies what no reader still needs. When it
+        got everything, the WAL is truncated, unless someone holds it at
+        that instant (busy_timeout=0: give up instead of waiting).
+        """
+        conn = self.backend.connect()
+        try:
+            busy, frames, checkpointed = self.backend.execute(conn, "PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            truncated = False
+            if not busy and frames == checkpointed:
+                self.backend.execute(conn, "PRAGMA busy_timeout=0")
+                truncated = self.backend.execute(conn, "PRAGMA wal_checkpoint(TRUNCATE)").fetchone()[0] == 0
+        finally:
+            conn.close()
+        return {'busy': bool(busy), 'frames': frames, 'checkpointed': checkpointed, 'truncated': truncated}
+
+    def full_vacuum(self):
+        """Rebuild the file with incremental auto_vacuum; blocks writers for its whole duration"""
+        if not self.supported:
+            return {}
+        self.database.writer.flush()
+        before = self.status()['file_bytes']
+        start = time.perf_counter()
+        conn = self.backend.connect()
+        try:
+            self.backend.execute(conn, "PRAGMA auto_vacuum=INCREMENTAL")
+            self.backend.execute(conn, "VACUUM")
+            self.backend.execute(conn, "PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+        detail = {'bytes_before': before, 'bytes_after': self.status()['file_bytes']}
+        self._record('full_vacuum', (time.perf_counter() - start) * 1000, detail)
+        return detail
+
+    def _pragma(self, name):
+        conn = self.backend.connect()
+        try:
+            return self.backend.execute(conn, f"PRAGMA {name}").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _record(self, task, duration_ms, detail):
+        # ANALYZE counts as done at the churn it saw, not at the churn of this later write
+        changes = detail.get('changes')
+
+        def record(conn):
+            self.backend.execute(conn, '''
+                INSERT OR REPLACE INTO maintenance_runs (task, changes, duration_ms, detail, ran_at)
+                VALUES (?, COALESCE(?, (SELECT changes FROM data_version)), ?, ?, CURRENT_TIMESTAMP)
+            ''', (task, changes, duration_ms, json.dumps(detail)))
+
+        self.database.writer.submit(record).result()
+
+class MaintenanceScheduler:
+    """Background thread running Maintenance.run() every interval seconds
+
+    The first pass happens one interval after start(). Errors of a pass
+    are kept in last_error and do not stop the thread.
+    """
+
+    def __init__(self, maintenance, interval=DEFAULT_INTERVAL):
+        self.maintenance = maintenance
+        self.interval = interval
+        self.passes = 0
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def run_once(self, force=False):
+        """One pass now, in the calling thread"""
+        try:
+            self.last_result = self.maintenance.run(force)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+        self.passes += 1
+        return self.last_result
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+def format_bytes(size):
+    for unit in ('o', 'Ko', 'Mo', 'Go'):
+        if size < 1024 or unit == 'Go':
+            return f"{size:.0f} {unit}" if unit == 'o' else f"{size:.1f} {unit}"
+        size /= 1024
+
+def print_status(status):
+    print(f"🗄️ Base {status['backend']} : {format_bytes(status['file_bytes'])}, "
+          f"WAL {format_bytes(status['wal_bytes'])}")
+    if 'page_count' in status:
+        print(f"🧩 {status['freelist_count']:,}/{status['page_count']:,} pages libres "
+              f"({status['fragmentation']:.1%}, {format_bytes(status['free_bytes'])}), "
+              f"auto_vacuum {status['auto_vacuum']}")
+    print(f"✏️ {status['changes']:,} lignes modifiées, {status['changes_since_analyze']:,} depuis le dernier ANALYZE")
+    for task, run in sorted(status['runs'].items()):
+        print(f"   {task:<12} {run['ran_at']}  {run['duration_ms']:8.1f} ms  {run['detail']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance de la base SQLite")
+    parser.add_argument('--db', default=os.environ.get("OLIVE_OIL_DB_PATH", "olive_oil.db"), help="Fichier de base")
+    parser.add_argument('--backend', default=os.environ.get("OLIVE_OIL_DB_BACKEND", "sqlite"),
+                        choices=['sqlite', 'duckdb'])
+    parser.add_argument('--run', action='store_true', help="Lancer les tâches dont le seuil est atteint")
+    parser.add_argument('--force', action='store_true', help="Lancer toutes les tâches (avec --run)")
+    parser.add_argument('--full-vacuum', action='store_true',
+                        help="VACUUM complet (active le vacuum incrémental, bloque les écritures)")
+    parser.add_argument('--watch', action='store_true', help="Maintenance en continu")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL, help="Secondes entre deux passages")
+    parser.add_argument('--analyze-changes', type=int, default=ANALYZE_CHANGES,
+                        help="Lignes modifiées avant un nouvel ANALYZE")
+    parser.add_argument('--vacuum-ratio', type=float, default=VACUUM_FREE_RATIO,
+                        help="Part de pages libres déclenchant le vacuum incrémental")
+    parser.add_argument('--checkpoint-mb', type=float, default=CHECKPOINT_BYTES / 1024 / 1024,
+                        help="Taille du WAL (Mo) déclenchant un checkpoint")
+    args = parser.parse_args()
+
+    from database import OliveOilDatabase
+
+    database = OliveOilDatabase(args.db, args.backend)
+    maintenance = Maintenance(database, analyze_changes=args.analyze_changes, vacuum_free_ratio=args.vacuum_ratio,
+                              checkpoint_bytes=int(args.checkpoint_mb * 1024 * 1024))
+    if not maintenance.supported:
+        print(f"ℹ️ Le moteur {args.backend} gère seul ses checkpoints et son espace libre")
+    if args.full_vacuum:
+        detail = maintenance.full_vacuum()
+        if detail:
+            print(f"🧹 VACUUM complet : {format_bytes(detail['bytes_before'])} → {format_bytes(detail['bytes_after'])}")
+    if args.run:
+        results = maintenance.run(args.force)
+        print(f"🧹 Tâches lancées : {', '.join(results) or 'aucune'}")
+        for task, detail in results.items():
+            print(f"   {task:<12} {detail}")
+    if args.watch:
+        scheduler = MaintenanceScheduler(maintenance, args.interval)
+        print(f"👀 Maintenance toutes les {args.interval:.0f}s (Ctrl+C pour arrêter)")
+        try:
+            while True:
+                time.sleep(args.interval)
+                result = scheduler.run_once()
+                if scheduler.last_error:
+                    print(f"❌ {scheduler.last_error}")
+                elif result:
+                    print(f"🧹 {', '.join(result)}")
+        except KeyboardInterrupt:
+            pass
+    print_status(maintenance.status())
+    database.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import importlib.util
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import metrics, track
+
+# Memory allowed to the governed entries plus the watched caches
+DEFAULT_BUDGET_BYTES = 512 * 1024 * 1024
+# Disk allowed to spilled frames; the oldest files are deleted beyond it
+DEFAULT_MAX_SPILL_BYTES = 2 * 1024 * 1024 * 1024
+# Spilling needs pyarrow for Parquet; without it entries are evicted
+PARQUET = importlib.util.find_spec("pyarrow") is not None
+
+def sizeof(value):
+    """Estimated bytes held by a cached value (deep for frames, recursive for containers)"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(key) + sizeof(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(sizeof(item) for item in value)
+    return sys.getsizeof(value)
+
+class MemoryGovernor:
+    """Process-wide memory budget for cached frames and analytics results
+
+    Entries are shared by every session: key them by data version and
+    filters, not by session. Their sizes plus the usage of the watched
+    caches (the live sales frame, the figure, series, forecast and
+    dashboard caches) are kept under budget_bytes by taking out the least
+    recently used entries: DataFrames are spilled to Parquet files and
+    read back on their next get, other values are evicted. When that is
+    not enough, the watched caches that can shrink drop their own least
+    recently used entries, largest cache first. What cannot be freed
+    (the live frame) is counted as over_budget.
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES, spill_dir=None, max_spill_bytes=DEFAULT_MAX_SPILL_BYTES):
+        self.budget_bytes = budget_bytes
+        self.spill_dir = spill_dir
+        self.max_spill_bytes = max_spill_bytes
+        self.nbytes = 0
+        self.spilled_bytes = 0
+        self.peak_bytes = 0
+        self.counters = {'hits': 0, 'misses': 0, 'spill_hits': 0, 'evictions': 0, 'spills': 0,
+                         'spill_errors': 0, 'rejected': 0, 'shrinks': 0, 'over_budget': 0}
+        self._entries = OrderedDict()
+        self._spilled = OrderedDict()
+        self._watched = {}
+        self._own_dir = None
+        self._lock = threading.Lock()
+
+    def watch(self, name, usage, shrink=None):
+        """Count usage() bytes of a cache governed elsewhere against the budget
+
+        shrink(nbytes), when given, drops least recently used entries of
+        the cache until nbytes are freed (or it is empty) and returns the
+        bytes it freed.
+        """
+        with self._lock:
+            self._watched[name] = (usage, shrink)
+
+    def watched_bytes(self):
+        with self._lock:
+            watched = list(self._watched.items())
+        return {name: int(usage()) for name, (usage, _) in watched}
+
+    def usage(self):
+        """Bytes held: governed entries plus watched caches"""
+        return self.nbytes + sum(self.watched_bytes().values())
+
+    def get(self, key):
+        """Cached value of key, read back from its spill file if needed, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.counters['hits'] += 1
+                self._entries.move_to_end(key)
+                return entry[0]
+            spilled = self._spilled.pop(key, None)
+            if spilled is None:
+                self.counters['misses'] += 1
+                return None
+            self.spilled_bytes -= spilled[1]
+            self.counters['spill_hits'] += 1
+        path = spilled[0]
+        with track("memory.unspill") as info:
+            value = pd.read_parquet(path)
+            info['bytes'] = spilled[1]
+        os.remove(path)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        """Keep value under key; values larger than the whole budget are not kept"""
+        size = sizeof(value)
+        with self._lock:
+            self._discard(key)
+            if size > self.budget_bytes:
+                self.counters['rejected'] += 1
+                return value
+            self._entries[key] = (value, size)
+            self.nbytes += size
+        self.enforce()
+        return value
+
+    def get_or_compute(self, key, compute):
+        """Cached value of key, or compute() kept under key
+
+        Like the figure cache, a key whose first element (the data
+        version) is None is never cached, nor is a None result.
+        """
+        if key[0] is None:
+            return compute()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def enforce(self):
+        """Bring usage back under budget; watched caches grow on their own, so call it once per run"""
+        watched = self.watched_bytes()
+        victims = []
+        with self._lock:
+            self.peak_bytes = max(self.peak_bytes, self.nbytes + sum(watched.values()))
+            while self._entries and self.nbytes + sum(watched.values()) > self.budget_bytes:
+                key, (value, size) = self._entries.popitem(last=False)
+                self.nbytes -= size
+                victims.append((key, value))
+            excess = self.nbytes + sum(watched.values()) - self.budget_bytes
+            shrinkable = [(name, self._watched[name][1]) for name in sorted(watched, key=watched.get, reverse=True)
+                          if self._watched[name][1] is not None and watched[name]]
+        # Written outside the lock: a get meanwhile misses and recomputes
+        for key, value in victims:
+            self._spill(key, value)
+        if excess <= 0:
+            return
+        for name, shrink in shrinkable:
+            with track("memory.shrink") as info:
+                info['bytes'] = freed = int(shrink(excess))
+            excess -= freed
+            with self._lock:
+                self.counters['shrinks'] += 1
+            if excess <= 0:
+                return
+        with self._lock:
+            self.counters['over_budget'] += 1
+
+    def _spill(self, key, value):
+        if not (PARQUET and isinstance(value, pd.DataFrame)):
+            with self._lock:
+                self.counters['evictions'] += 1
+            return
+        path = os.path.join(self._directory(), f"{uuid.uuid4().hex}.parquet")
+        try:
+            with track("memory.spill") as info:
+                value.to_parquet(path)
+                info['bytes'] = size = os.path.getsize(path)
+        except Exception:
+            # Columns Parquet cannot hold (mixed objects, non-string names): evicted instead
+            if os.path.exists(path):
+                os.remove(path)
+            with self._lock:
+                self.counters['spill_errors'] += 1
+                self.counters['evictions'] += 1
+            return
+        with self._lock:
+            if key in self._entries:
+                # Put again while it was being written: the fresh value wins
+                os.remove(path)
+                return
+            self._discard(key)
+            self._spilled[key] = (path, size)
+            self.spilled_bytes += size
+            self.counters['spills'] += 1
+            while self.spilled_bytes > self.max_spill_bytes:
+                _, (oldest, oldest_size) = self._spilled.popitem(last=False)
+                os.remove(oldest)
+                self.spilled_bytes -= oldest_size
+                self.counters['evictions'] += 1
+
+    def _directory(self):
+        if self.spill_dir:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            return self.spill_dir
+        if self._own_dir is None:
+            self._own_dir = tempfile.mkdtemp(prefix="olive_oil_spill_")
+            atexit.register(shutil.rmtree, self._own_dir, True)
+        return self._own_dir
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+        spilled = self._spilled.pop(key, None)
+        if spilled is not None:
+            os.remove(spilled[0])
+            self.spilled_bytes -= spilled[1]
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """Drop every entry and spill file"""
+        with self._lock:
+            for key in list(self._entries) + list(self._spilled):
+                self._discard(key)
+
+    def stats(self):
+        watched = self.watched_bytes()
+        with self._lock:
+            return {'entries': len(self._entries), 'spilled_entries': len(self._spilled), 'nbytes': self.nbytes,
+                    'watched': watched, 'usage': self.nbytes + sum(watched.values()),
+                    'budget_bytes': self.budget_bytes, 'peak_bytes': self.peak_bytes,
+                    'spilled_bytes': self.spilled_bytes, **self.counters}
+
+    def prometheus_text(self):
+        """Usage and counters in the Prometheus text exposition format"""
+        stats = self.stats()
+        pools = {'entries': stats['nbytes'], **stats['watched']}
+        lines = ["# HELP olive_oil_memory_bytes Bytes held by governed entries and watched caches",
+                 "# TYPE olive_oil_memory_bytes gauge"]
+        lines += [f'olive_oil_memory_bytes{{pool="{pool}"}} {nbytes}' for pool, nbytes in sorted(pools.items())]
+        for metric, key, help_text in [('olive_oil_memory_budget_bytes', 'budget_bytes', "Memory budget"),
+                                       ('olive_oil_memory_peak_bytes', 'peak_bytes', "Highest usage seen"),
+                                       ('olive_oil_memory_spilled_bytes', 'spilled_bytes', "Bytes of spill files")]:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {stats[key]}"]
+        lines += ["# HELP olive_oil_memory_events_total Cache hits, misses, spills and evictions",
+                  "# TYPE olive_oil_memory_events_total counter"]
+        lines += [f'olive_oil_memory_events_total{{event="{event}"}} {stats[event]}' for event in self.counters]
+        return "\n".join(lines) + "\n"
+
+# Shared by every session; its usage is exported with the other metrics
+governor = MemoryGovernor(budget_bytes=int(float(os.environ.get("OLIVE_OIL_MEMORY_BUDGET_MB", 512)) * 1024 * 1024),
+                          spill_dir=os.environ.get("OLIVE_OIL_SPILL_DIR"))
+metrics.add_collector(governor.prometheus_text)
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+🫒 Olive Oil Tracker Pro - Migrations du schéma
+===============================================
+
+Migrations ordonnées et versionnées (table schema_version). Chaque étape
+tourne dans sa propre transaction courte, sous le verrou d'écriture, et
+les backfills avancent par lots d'identifiants, avec une progression
+enregistrée : une migration interrompue reprend là où elle s'est arrêtée,
+deux processus peuvent migrer la même base sans appliquer deux fois une
+étape, et la base reste accessible en écriture pendant son exécution.
+
+Usage : python migrations.py --db olive_oil.db [--status]
+"""
+
+import argparse
+import time
+
+from instrumentation import track
+from storage import HASH_COLUMNS, analysis_row, create_backend, row_hashes
+
+META_STATEMENTS = [
+    '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        duration_ms REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS schema_migration_progress (
+        version INTEGER NOT NULL,
+        step INTEGER NOT NULL,
+        last_id INTEGER,
+        completed INTEGER NOT NULL DEFAULT 0,
+        duration_ms REAL,
+        PRIMARY KEY (version, step)
+    )
+    ''',
+]
+
+class Step:
+    """One unit of a migration, committed on its own"""
+
+    # Restrict the step to some backends (None = all)
+    backends = None
+
+    def applies_to(self, backend):
+        return self.backends is None or backend.name in self.backends
+
+    def run(self, runner, conn, version, index):
+        raise NotImplementedError
+
+class SQL(Step):
+    """A single DDL/DML statement"""
+
+    def __init__(self, sql, backends=None):
+        self.sql = sql
+        self.backends = backends
+
+    def run(self, runner, conn, version, index):
+        runner.backend.execute(conn, self.sql)
+
+class Schema(Step):
+    """The backend-specific base tables"""
+
+    def run(self, runner, conn, version, index):
+        for statement in runner.backend.schema_statements():
+            runner.backend.execute(conn, statement)
+
+class CreateIndex(SQL):
+    """An index build, kept in its own step so a failure never rolls back other work"""
+
+class Backfill(Step):
+    """Base class for id-ranged batch updates that can resume after an interruption"""
+
+    def __init__(self, table, batch_size=10000, pause=0.0, backends=None):
+        self.table = table
+        self.batch_size = batch_size
+        # Optional sleep between batches to leave room for concurrent writers
+        self.pause = pause
+        self.backends = backends
+
+    def next_upper_bound(self, runner, conn, last_id):
+        """Largest id of the next batch, or None when the table is exhausted"""
+        cursor = runner.backend.execute(conn, f'''
+            SELECT MAX(id) FROM (
+                SELECT id FROM {self.table} WHERE id > ? ORDER BY id LIMIT ?
+            ) AS batch
+        ''', (last_id, self.batch_size))
+        return cursor.fetchone()[0]
+
+    def run(self, runner, conn, version, index):
+        while True:
+            # One write transaction per batch; progress is re-read under the lock
+            # since another process may be running the same backfill
+            runner.backend.begin_write(conn)
+            last_id = runner.progress(conn, version, index) or 0
+            upper = self.next_upper_bound(runner, conn, last_id)
+            if upper is None:
+                conn.rollback()
+                return
+            self.update_batch(runner, conn, last_id, upper)
+            runner.save_progress(conn, version, index, upper)
+            conn.commit()
+            if self.pause:
+                time.sleep(self.pause)
+
+    def update_batch(self, runner, conn, lower, upper):
+        raise NotImplementedError
+
+class SqlBackfill(Backfill):
+    """Backfill expressed as a SET clause evaluated by the engine"""
+
+    def __init__(self, table, set_clause, batch_size=10000, pause=0.0, backends=None):
+        super().__init__(table, batch_size, pause, backends)
+        self.set_clause = set_clause
+
+    def update_batch(self, runner, conn, lower, upper):
+        runner.backend.execute(conn, f"UPDATE {self.table} SET {self.set_clause} WHERE id > ? AND id <= ?",
+                               (lower, upper))
+
+class FrameBackfill(Backfill):
+    """Backfill computed in pandas: transform(frame) returns the target columns"""
+
+    def __init__(self, table, columns, targets, transform, batch_size=10000, pause=0.0, backends=None):
+        super().__init__(table, batch_size, pause, backends)
+        self.columns = columns
+        self.targets = targets
+        self.transform = transform
+
+    def update_batch(self, runner, conn, lower, upper):
+        import pandas as pd
+
+        cursor = runner.backend.execute(
+            conn, f"SELECT id, {', '.join(self.columns)} FROM {self.table} WHERE id > ? AND id <= ?",
+            (lower, upper))
+        frame = pd.DataFrame(cursor.fetchall(), columns=['id'] + list(self.columns))
+        if frame.empty:
+            return
+        values = self.transform(frame)
+        assignments = ", ".join(f"{column}=?" for column in self.targets)
+        rows = [tuple(row) for row in values[list(self.targets)].astype(object).itertuples(index=False)]
+        params = [row + (int(row_id),) for row, row_id in zip(rows, frame['id'])]
+        runner.backend.executemany(conn, f"UPDATE {self.table} SET {assignments} WHERE id=?", params)
+
+def _compact_analyses(frame):
+    """Legacy analysis_history rows: JSON parameters, filter key, compressed result"""
+    import pandas as pd
+
+    rows = [analysis_row(parameters, result) for parameters, result in zip(frame['parameters'], frame['result'])]
+    return pd.DataFrame(rows, columns=['parameters', 'filters_key', 'result_blob']).assign(result=None)
+
+class BuildSketches(Step):
+    """Build the per-year sales sketches of the rows already in the table"""
+
+    def run(self, runner, conn, version, index):
+        from sketches import SketchStore
+
+        store = SketchStore(runner.backend)
+        years = [row[0] for row in runner.backend.execute(conn, "SELECT DISTINCT year FROM sales").fetchall()]
+        store.save(conn, store.rebuild(conn, years))
+
+class Migration:
+    """An ordered, named list of steps applied once per database"""
+
+    def __init__(self, version, name, steps):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+# Ordered list of schema migrations. Never edit an applied migration: append a new one.
+MIGRATIONS = [
+    Migration(1, "tables de base", [Schema()]),
+    Migration(2, "index des agrégations du dashboard", [
+        # DuckDB scans columns directly, these only help SQLite
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_sales_country_year ON sales (country, year)", backends=('sqlite',)),
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_sales_year ON sales (year)", backends=('sqlite',)),
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_sales_type ON sales (type)", backends=('sqlite',)),
+    ]),
+    Migration(3, "sketches des statistiques approximatives", [
+        SQL('''
+            CREATE TABLE IF NOT EXISTS sales_sketches (
+                partition_key INTEGER PRIMARY KEY,
+                payload TEXT NOT NULL,
+                dirty INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''),
+        BuildSketches(),
+    ]),
+    Migration(4, "version des données", [
+        SQL("CREATE TABLE IF NOT EXISTS data_version (id INTEGER PRIMARY KEY, version INTEGER NOT NULL)"),
+        SQL("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)"),
+    ]),
+    Migration(5, "dates de vente", [
+        SQL("ALTER TABLE sales ADD COLUMN sale_date DATE"),
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_sales_sale_date ON sales (sale_date)", backends=('sqlite',)),
+        # Version of the last non-append write (update, delete, reload)
+        SQL("ALTER TABLE data_version ADD COLUMN rewritten INTEGER DEFAULT 0"),
+    ]),
+    Migration(6, "cache du dashboard", [
+        SQL('''
+            CREATE TABLE IF NOT EXISTS dashboard_cache (
+                filters_key TEXT PRIMARY KEY,
+                version INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''),
+    ]),
+    Migration(7, "montants en entiers (centimes, millièmes)", [
+        SQL("ALTER TABLE sales ADD COLUMN sales_cents BIGINT"),
+        SQL("ALTER TABLE sales ADD COLUMN price_millis BIGINT"),
+        SqlBackfill('sales', "sales_cents = CAST(ROUND(sales * 100) AS BIGINT), "
+                             "price_millis = CAST(ROUND(price * 1000) AS BIGINT)"),
+    ]),
+    Migration(8, "empreintes des lignes et fichiers ingérés", [
+        SQL("ALTER TABLE sales ADD COLUMN row_hash BIGINT"),
+        FrameBackfill('sales', HASH_COLUMNS, ['row_hash'], lambda frame: frame.assign(row_hash=row_hashes(frame))),
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_sales_row_hash ON sales (row_hash)", backends=('sqlite',)),
+        SQL('''
+            CREATE TABLE IF NOT EXISTS ingested_files (
+                checksum TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                rows INTEGER NOT NULL,
+                inserted INTEGER NOT NULL,
+                ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''),
+    ]),
+    Migration(9, "historique des analyses compact", [
+        SQL("ALTER TABLE analysis_history ADD COLUMN filters_key TEXT"),
+        SQL("ALTER TABLE analysis_history ADD COLUMN result_blob BLOB"),
+        FrameBackfill('analysis_history', ['parameters', 'result'], ['parameters', 'filters_key', 'result_blob', 'result'],
+                      _compact_analyses, batch_size=1000),
+        # Queryable filter fields; DuckDB cannot add generated columns to an existing table
+        SQL("ALTER TABLE analysis_history ADD COLUMN filter_country TEXT "
+            "GENERATED ALWAYS AS (json_extract(parameters, '$.filters.country')) VIRTUAL", backends=('sqlite',)),
+        SQL("ALTER TABLE analysis_history ADD COLUMN filter_year INTEGER "
+            "GENERATED ALWAYS AS (json_extract(parameters, '$.filters.year')) VIRTUAL", backends=('sqlite',)),
+        SQL("ALTER TABLE analysis_history ADD COLUMN filter_type TEXT "
+            "GENERATED ALWAYS AS (json_extract(parameters, '$.filters.type')) VIRTUAL", backends=('sqlite',)),
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_history_type_created ON analysis_history (analysis_type, created_at)",
+                    backends=('sqlite',)),
+        CreateIndex("CREATE INDEX IF NOT EXISTS idx_history_filters "
+                    "ON analysis_history (analysis_type, filters_key, created_at)", backends=('sqlite',)),
+    ]),
+    Migration(10, "suivi de la maintenance", [
+        # Rows inserted, updated or deleted since the database was created
+        SQL("ALTER TABLE data_version ADD COLUMN changes BIGINT DEFAULT 0"),
+        SQL('''
+            CREATE TABLE IF NOT EXISTS maintenance_runs (
+                task TEXT PRIMARY KEY,
+                changes BIGINT NOT NULL,
+                duration_ms REAL,
+                detail TEXT,
+                ran_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''),
+    ]),
+]
+
+class MigrationRunner:
+    """Applies pending migrations and records their version and duration"""
+
+    def __init__(self, backend, migrations=None):
+        self.backend = backend
+        self.migrations = sorted(migrations or MIGRATIONS, key=lambda m: m.version)
+
+    def _ensure_meta(self, conn):
+        self.backend.prepare(conn)
+        for statement in META_STATEMENTS:
+            self.backend.execute(conn, statement)
+        conn.commit()
+
+    def current_version(self, conn=None):
+        """Highest applied migration version (0 for an empty database)"""
+        own = conn is None
+        conn = conn or self.backend.connect()
+        try:
+            self._ensure_meta(conn)
+            version = self.backend.execute(conn, "SELECT MAX(version) FROM schema_version").fetchone()[0]
+            return version or 0
+        finally:
+            if own:
+                conn.close()
+
+    def applied(self):
+        """Applied migrations as (version, name, applied_at, duration_ms) rows"""
+        conn = self.backend.connect()
+        try:
+            self._ensure_meta(conn)
+            return self.backend.execute(
+                conn, "SELECT version, name, applied_at, duration_ms FROM schema_version ORDER BY version"
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def pending(self):
+        """Migrations not applied yet"""
+        current = self.current_version()
+        return [m for m in self.migrations if m.version > current]
+
+    def progress(self, conn, version, step):
+        row = self.backend.execute(
+            conn, "SELECT last_id FROM schema_migration_progress WHERE version=? AND step=?", (version, step)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_progress(self, conn, version, step, last_id):
+        self.backend.execute(conn, '''
+            INSERT OR REPLACE INTO schema_migration_progress (version, step, last_id, completed)
+            VALUES (?, ?, ?, 0)
+        ''', (version, step, last_id))
+
+    def _step_completed(self, conn, version, step):
+        row = self.backend.execute(
+            conn, "SELECT completed FROM schema_migration_progress WHERE version=? AND step=?", (version, step)
+        ).fetchone()
+        return bool(row and row[0])
+
+    def migrate(self, target=None, verbose=False):
+        """Apply every pending migration up to target; returns the versions applied"""
+        applied = []
+        conn = self.backend.connect()
+        try:
+            current = self.current_version(conn)
+            for migration in self.migrations:
+                if migration.version <= current or (target is not None and migration.version > target):
+                    continue
+
+                start = time.perf_counter()
+                with track(f"migration.{migration.version}"):
+                    for index, step in enumerate(migration.steps):
+                        if not step.applies_to(self.backend) or self._step_completed(conn, migration.version, index):
+                            continue
+                        step_start = time.perf_counter()
+                        try:
+                            if isinstance(step, Backfill):
+                                # Commits batch by batch, each in its own write transaction
+                                step.run(self, conn, migration.version, index)
+                                self.backend.begin_write(conn)
+                            else:
+                                # The step and its progress row commit together: left to itself,
+                                # sqlite3 would autocommit an ALTER TABLE before the row is written
+                                self.backend.begin_write(conn)
+                                if self._step_completed(conn, migration.version, index):
+                                    # Applied by another process while this one waited for the lock
+                                    conn.rollback()
+                                    continue
+                                step.run(self, conn, migration.version, index)
+                            self.backend.execute(conn, '''
+                                INSERT OR REPLACE INTO schema_migration_progress
+                                    (version, step, last_id, completed, duration_ms)
+                                VALUES (?, ?, ?, 1, ?)
+                            ''', (migration.version, index, self.progress(conn, migration.version, index),
+                                  (time.perf_counter() - step_start) * 1000))
+                            conn.commit()
+                        except Exception:
+                            conn.rollback()
+                            raise
+
+                duration_ms = (time.perf_counter() - start) * 1000
+                self.backend.execute(conn, '''
+                    INSERT OR REPLACE INTO schema_version (version, name, duration_ms) VALUES (?, ?, ?)
+                ''', (migration.version, migration.name, duration_ms))
+                conn.commit()
+                applied.append(migration.version)
+                if verbose:
+                    print(f"✅ Migration {migration.version} ({migration.name}) : {duration_ms:.0f} ms")
+        finally:
+            conn.close()
+        return applied
+
+def main():
+    """Fonction principale"""
+    parser = argparse.ArgumentParser(description="Migrations du schéma Olive Oil Tracker Pro")
+    parser.add_argument('--db', default="olive_oil.db", help="Chemin de la base")
+    parser.add_argument('--backend', default="sqlite", help="Moteur de stockage")
+    parser.add_argument('--target', type=int, help="Version cible")
+    parser.add_argument('--status', action='store_true', help="Afficher l'état sans migrer")
+    args = parser.parse_args()
+
+    runner = MigrationRunner(create_backend(args.backend, args.db))
+    if args.status:
+        for version, name, applied_at, duration_ms in runner.applied():
+            print(f"✅ {version:>3} {name} ({applied_at}, {duration_ms or 0:.0f} ms)")
+        for migration in runner.pending():
+            print(f"⏳ {migration.version:>3} {migration.name}")
+        return
+
+    applied = runner.migrate(args.target, verbose=True)
+    print(f"🗄️ Version du schéma : {runner.current_version()} ({len(applied)} migration(s) appliquée(s))")
+
+if __name__ == "__main__":
+    main()
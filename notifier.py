@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+import weakref
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import track
+
+# Deltas a subscriber can fall behind before it is told to reload instead
+DEFAULT_MAX_PENDING = 1000
+# Patches whose changed rows a LiveFrame keeps for its sessions
+CHANGE_LOG_SIZE = 256
+# Beyond this share of the frame, re-reading everything is cheaper than patching
+PATCH_MAX_SHARE = 0.25
+
+class Subscription:
+    """Deltas published for one database since subscribing, in commit order
+
+    Bounded: a subscriber more than max_pending deltas behind drops them
+    and receives a single reload delta instead.
+    """
+
+    def __init__(self, notifier, key, max_pending=DEFAULT_MAX_PENDING):
+        self.notifier = notifier
+        self.key = key
+        self.max_pending = max_pending
+        self._deltas = deque()
+        self._overflow = None
+        self._lock = threading.Lock()
+
+    def _push(self, delta):
+        with self._lock:
+            if self._overflow is not None or len(self._deltas) >= self.max_pending:
+                self._deltas.clear()
+                self._overflow = {'version': delta['version'], 'kind': 'reload', 'ids': ()}
+            else:
+                self._deltas.append(delta)
+
+    def drain(self):
+        """Deltas received since the last drain (an empty list when nothing was written)"""
+        with self._lock:
+            deltas = [self._overflow] if self._overflow is not None else list(self._deltas)
+            self._deltas.clear()
+            self._overflow = None
+        return deltas
+
+    @property
+    def pending(self):
+        return len(self._deltas) + (self._overflow is not None)
+
+    def close(self):
+        self.notifier.unsubscribe(self)
+
+class ChangeNotifier:
+    """In-process publish/subscribe of the committed writes to sales
+
+    OliveOilDatabase publishes one delta per write once it is committed:
+    {'version': data version after the write, 'kind': 'insert', 'update',
+    'delete' or 'reload', 'ids': ids of the sales written, a range for
+    inserts}. Subscriptions are held weakly, so a session that goes away
+    stops receiving without unsubscribing. Writes of other processes are
+    not published; subscribers see them as a gap in the versions.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.stats = {'published': 0, 'delivered': 0}
+
+    def subscribe(self, key, max_pending=DEFAULT_MAX_PENDING):
+        """New subscription to the deltas of one database (key of OliveOilDatabase)"""
+        subscription = Subscription(self, key, max_pending)
+        with self._lock:
+            self._subscribers.setdefault(key, weakref.WeakSet()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.get(subscription.key, set()).discard(subscription)
+
+    def subscribers(self, key):
+        with self._lock:
+            return len(self._subscribers.get(key, ()))
+
+    def publish(self, key, version, kind, ids=()):
+        """Push a delta to every subscriber of a database; returns it"""
+        delta = {'version': version, 'kind': kind, 'ids': ids}
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+            self.stats['published'] += 1
+            self.stats['delivered'] += len(subscribers)
+        for subscription in subscribers:
+            subscription._push(delta)
+        return delta
+
+def matches(rows, filters):
+    """Whether any of rows falls within dashboard filters (column -> value)"""
+    mask = np.ones(len(rows), dtype=bool)
+    for column, value in (filters or {}).items():
+        mask &= (rows[column] == value).to_numpy()
+    return bool(mask.any())
+
+class LiveFrame:
+    """All sales of a database, kept current by the deltas of its writes
+
+    Shared by every session: the first read after a write patches the
+    frame instead of reloading it (the ids written are dropped, then the
+    inserted and updated rows are read back by id). A reload delta, a gap
+    in the versions (a write by another process) or a patch touching more
+    than PATCH_MAX_SHARE of the frame re-reads everything. The rows removed
+    and added by recent patches are kept, so that sessions can tell whether
+    a change touches what they display.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        # Subscribed before the first read: a write committed meanwhile is replayed on top of it
+        self._subscription = database.subscribe()
+        self._changes = deque(maxlen=CHANGE_LOG_SIZE)
+        self._lock = threading.Lock()
+        self.stats = {'patches': 0, 'patched_rows': 0, 'reloads': 0}
+        self._reload()
+
+    def _reload(self):
+        with track("live.reload") as info:
+            self.version = self.database.data_version()
+            self._frame = self.database.get_all_data()
+            info['rows'] = len(self._frame)
+        self.nbytes = int(self._frame.memory_usage(index=True, deep=True).sum())
+        self._changes.clear()
+        self.stats['reloads'] += 1
+
+    def _apply(self, deltas):
+        deltas = [delta for delta in deltas if delta['version'] > self.version]
+        if not deltas:
+            return
+        versions = [delta['version'] for delta in deltas]
+        written = sum(len(delta['ids']) for delta in deltas)
+        if (any(delta['kind'] == 'reload' for delta in deltas)
+                or versions != list(range(self.version + 1, self.version + 1 + len(deltas)))
+                or written > PATCH_MAX_SHARE * max(len(self._frame), 1)):
+            self._reload()
+            return
+
+        with track("live.patch") as info:
+            written = np.zeros(len(self._frame), dtype=bool)
+            for delta in deltas:
+                written |= self._frame['id'].isin(delta['ids']).to_numpy()
+            updated = sorted({sale_id for delta in deltas if delta['kind'] == 'update' for sale_id in delta['ids']})
+            read = [self.database.get_sales(delta['ids']) for delta in deltas if delta['kind'] == 'insert']
+            if updated:
+                read.append(self.database.get_sales(updated))
+            added = [rows for rows in read if len(rows)]
+            added = pd.concat(added).drop_duplicates('id', keep='last') if added else self._frame.iloc[:0]
+            removed = self._frame[written]
+
+            frame = pd.concat([self._frame[~written], added], ignore_index=True) if len(added) else \
+                self._frame[~written].reset_index(drop=True)
+            if not frame['id'].is_monotonic_increasing:
+                frame = frame.sort_values('id', ignore_index=True)
+            self._frame = frame
+            self.nbytes = int(frame.memory_usage(index=True, deep=True).sum())
+            info['rows'] = len(removed) + len(added)
+
+        self._changes.append((versions[0], versions[-1], pd.concat([removed, added], ignore_index=True)))
+        self.version = versions[-1]
+        self.stats['patches'] += 1
+        self.stats['patched_rows'] += info['rows']
+
+    def refresh(self):
+        """Apply the deltas received since the last read; returns the current version"""
+        with self._lock:
+            self._apply(self._subscription.drain())
+            return self.version
+
+    def frame(self):
+        """(data version, current sales) read together; the frame is a copy callers may modify"""
+        with self._lock:
+            self._apply(self._subscription.drain())
+            return self.version, self._frame.copy()
+
+    def reload(self):
+        """Re-read every sale (after writes made by another process)"""
+        with self._lock:
+            self._subscription.drain()
+            self._reload()
+
+    def changed_rows(self, deltas):
+        """Rows removed or added by the writes of deltas, None when unknown (reload, gap, too old)"""
+        self.refresh()
+        if not deltas:
+            return self._frame.iloc[:0]
+        if any(delta['kind'] == 'reload' for delta in deltas):
+            return None
+        with self._lock:
+            covered, pieces = set(), []
+            low, high = min(delta['version'] for delta in deltas), max(delta['version'] for delta in deltas)
+            for first, last, rows in self._changes:
+                if first <= high and last >= low:
+                    covered.update(range(first, last + 1))
+                    pieces.append(rows)
+        if not {delta['version'] for delta in deltas} <= covered:
+            return None
+        return pd.concat(pieces, ignore_index=True)
+
+    def touches(self, deltas, filters):
+        """Whether deltas change any sale within filters (True when that cannot be told)"""
+        rows = self.changed_rows(deltas)
+        return rows is None or matches(rows, filters)
+
+# Shared by every database of the process; OliveOilDatabase publishes to it
+notifier = ChangeNotifier()
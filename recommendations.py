@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import track
+
+# Same thresholds as AdvancedAnalytics.generate_recommendations
+GROWTH_THRESHOLD = 10
+PRICE_CHANGE_THRESHOLD = 5
+
+# Segment levels: one recommendation table per grouping
+DEFAULT_LEVELS = (('country',), ('type',), ('country', 'type'))
+
+class Rule:
+    """A recommendation rule: a vectorized condition over the segment table and a message template"""
+
+    def __init__(self, name, condition, message):
+        self.name = name
+        # condition(table) -> boolean Series, evaluated on every segment at once
+        self.condition = condition
+        # Formatted with the columns of the matching segments
+        self.message = message
+
+RULES = [
+    Rule('forte_croissance', lambda t: t['growth'] > GROWTH_THRESHOLD,
+         "📈 {segment} : croissance de {growth:.1f}%. Renforcez votre présence sur ce segment."),
+    Rule('croissance', lambda t: (t['growth'] > 0) & (t['growth'] <= GROWTH_THRESHOLD),
+         "📊 {segment} : croissance positive ({growth:.1f}%). Maintenez les stratégies actuelles."),
+    Rule('declin', lambda t: t['growth'] <= 0,
+         "⚠️ {segment} : déclin des ventes ({growth:.1f}%). Analysez les causes et ajustez la stratégie."),
+    Rule('prix_hausse', lambda t: t['price_change'] > PRICE_CHANGE_THRESHOLD,
+         "💰 {segment} : prix en hausse ({price_change:+.1f}%). Évaluez l'impact sur la demande."),
+    Rule('prix_baisse', lambda t: t['price_change'] < -PRICE_CHANGE_THRESHOLD,
+         "💸 {segment} : prix en baisse ({price_change:+.1f}%). Vérifiez la rentabilité."),
+    Rule('meilleur_segment', lambda t: t['rank'] == 1,
+         "🏆 {segment} est le premier segment ({level}) avec {sales:,.0f}€ de ventes ({share:.0%})."),
+]
+
+def segment_table(yearly, levels=DEFAULT_LEVELS):
+    """One row per segment of every level, from sales aggregated per (country, type, year)
+
+    yearly has the columns country, type, year, sales, volume, price_sum and
+    rows; coarser levels are rolled up from it in pandas, so the storage
+    engine is queried once.
+    """
+    tables = []
+    for keys in levels:
+        keys = list(keys)
+        per_year = yearly.groupby(keys + ['year'])[['sales', 'volume', 'price_sum', 'rows']].sum().reset_index()
+        per_year['price'] = per_year['price_sum'] / per_year['rows']
+        per_year = per_year.sort_values(keys + ['year'])
+
+        grouped = per_year.groupby(keys)
+        first, last = grouped[['sales', 'price']].first(), grouped[['sales', 'price']].last()
+        table = pd.DataFrame({
+            'sales': grouped['sales'].sum(),
+            'volume': grouped['volume'].sum(),
+            'years': grouped['year'].nunique(),
+            'growth': (last['sales'] - first['sales']) / first['sales'] * 100,
+            'price_change': (last['price'] - first['price']) / first['price'] * 100,
+        })
+        # Growth needs at least two years of history
+        single_year = table['years'] < 2
+        table.loc[single_year, ['growth', 'price_change']] = np.nan
+        table['share'] = table['sales'] / table['sales'].sum()
+        table['rank'] = table['sales'].rank(ascending=False, method='first').astype(int)
+        table = table.reset_index()
+
+        table['segment'] = table[keys[0]].astype(str)
+        for key in keys[1:]:
+            table['segment'] = table['segment'] + " × " + table[key].astype(str)
+        table['level'] = " × ".join(keys)
+        tables.append(table[['level', 'segment', 'sales', 'volume', 'years', 'growth', 'price_change',
+                             'share', 'rank']])
+    return pd.concat(tables, ignore_index=True)
+
+class RecommendationEngine:
+    """Evaluates the rules over all segments at once, cached per data version
+
+    Shared by every session: the cache is guarded by a lock, and callers
+    get a copy of the cached table, which they may modify.
+    """
+
+    def __init__(self, rules=None, cache_size=32):
+        self.rules = rules or RULES
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def evaluate(self, table):
+        """Apply every rule to the segment table; returns one row per (segment, rule) match"""
+        with track("recommendations.evaluate") as info:
+            info['rows'] = len(table)
+            # NaN comparisons are False, so segments without history match no growth rule
+            masks = np.column_stack([rule.condition(table).to_numpy(dtype=bool) for rule in self.rules])
+            segment_index, rule_index = np.nonzero(masks)
+
+            matches = table.iloc[segment_index].reset_index(drop=True)
+            matches.insert(2, 'rule', [self.rules[i].name for i in rule_index])
+            # Only matching segments are formatted
+            records = matches.to_dict('records')
+            matches['message'] = [self.rules[i].message.format(**record)
+                                  for i, record in zip(rule_index, records)]
+        return matches
+
+    def recommend(self, yearly, version=None, levels=DEFAULT_LEVELS):
+        """Recommendations for every segment; reused while version is unchanged
+
+        yearly is the per-(country, type, year) aggregate, or a callable
+        returning it so that a cache hit skips the query.
+        """
+        key = (version, tuple(tuple(level) for level in levels))
+        if version is not None:
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None:
+                    self._cache.move_to_end(key)
+            if cached is not None:
+                return cached.copy()
+
+        if callable(yearly):
+            yearly = yearly()
+        result = self.evaluate(segment_table(yearly, levels))
+        if version is not None:
+            with self._lock:
+                self._cache[key] = result
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return result.copy()
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+# Shared by every AdvancedAnalytics instance so the cache survives Streamlit reruns
+engine = RecommendationEngine()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import base64
+import hashlib
+import json
+import math
+
+import numpy as np
+import pandas as pd
+
+class HyperLogLog:
+    """Mergeable distinct-count sketch (relative standard error 1.04 / sqrt(2**p))"""
+    
+    def __init__(self, p=12, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = registers if registers is not None else np.zeros(self.m, dtype=np.uint8)
+    
+    @staticmethod
+    def _hash(values):
+        return np.array([int.from_bytes(hashlib.blake2b(str(v).encode('utf-8'), digest_size=8).digest(), 'big')
+                         for v in values], dtype=np.uint64)
+    
+    def update(self, values):
+        """Add an iterable of values (duplicates are hashed only once)"""
+        values = pd.unique(pd.Series(values, dtype=object).dropna())
+        if len(values) == 0:
+            return self
+        hashes = self._hash(values)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = (hashes << np.uint64(self.p)) | np.uint64(1 << (self.p - 1))
+        # Rank = position of the leftmost 1-bit in the remaining 64 - p bits
+        rank = np.array([65 - int(r).bit_length() for r in rest], dtype=np.uint8)
+        np.maximum.at(self.registers, index, rank)
+        return self
+    
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+    
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return self.m * math.log(self.m / zeros)
+        return raw
+    
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(self.m)
+    
+    def to_dict(self):
+        return {'p': self.p, 'registers': base64.b64encode(self.registers.tobytes()).decode('ascii')}
+    
+    @classmethod
+    def from_dict(cls, data):
+        registers = np.frombuffer(base64.b64decode(data['registers']), dtype=np.uint8).copy()
+        return cls(data['p'], registers)
+
+class KLL:
+    """Mergeable quantile sketch (rank error around 1.7 / k)"""
+    
+    def __init__(self, k=200, compactors=None, seed=0):
+        self.k = k
+        self.compactors = compactors or [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+    
+    def _capacity(self, level):
+        depth = len(self.compactors) - level - 1
+        return max(2, int(math.ceil(self.k * (2 / 3) ** depth)))
+    
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.compactors[0] = np.concatenate([self.compactors[0], values])
+            self._compress()
+        return self
+    
+    def merge(self, other):
+        while len(self.compactors) < len(other.compactors):
+            self.compactors.append(np.empty(0))
+        for level, items in enumerate(other.compactors):
+            self.compactors[level] = np.concatenate([self.compactors[level], items])
+        self._compress()
+        return self
+    
+    def _compress(self):
+        level = 0
+        while level < len(self.compactors):
+            if len(self.compactors[level]) > self._capacity(level):
+                if level + 1 == len(self.compactors):
+                    self.compactors.append(np.empty(0))
+                items = np.sort(self.compactors[level])
+                # An odd item stays at this level; the rest is halved with a random offset
+                keep = items[-1:] if len(items) % 2 else np.empty(0)
+                items = items[:len(items) - len(keep)]
+                promoted = items[self._rng.integers(0, 2)::2]
+                self.compactors[level] = keep
+                self.compactors[level + 1] = np.concatenate([self.compactors[level + 1], promoted])
+            level += 1
+    
+    @property
+    def count(self):
+        return sum(len(items) << level for level, items in enumerate(self.compactors))
+    
+    def quantile(self, q):
+        values = np.concatenate(self.compactors)
+        if len(values) == 0:
+            return None
+        weights = np.concatenate([np.full(len(items), 1 << level) for level, items in enumerate(self.compactors)])
+        order = np.argsort(values)
+        cumulative = np.cumsum(weights[order])
+        position = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        return float(values[order][min(position, len(values) - 1)])
+    
+    @property
+    def rank_error(self):
+        return 1.7 / self.k
+    
+    def to_dict(self):
+        return {'k': self.k, 'compactors': [items.tolist() for items in self.compactors]}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['k'], [np.array(items, dtype=np.float64) for items in data['compactors']])
+
+class Moments:
+    """Count, mean, variance, min and max merged with Chan's parallel Welford update"""
+    
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=None, maximum=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.minimum = minimum
+        self.maximum = maximum
+    
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values):
+            batch = Moments(len(values), float(values.mean()), float(((values - values.mean()) ** 2).sum()),
+                            float(values.min()), float(values.max()))
+            self.merge(batch)
+        return self
+    
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            self.minimum, self.maximum = other.minimum, other.maximum
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+    
+    @property
+    def std(self):
+        """Sample standard deviation, like pandas' Series.std()"""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float('nan')
+    
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.minimum, 'max': self.maximum}
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['mean'], data['m2'], data['min'], data['max'])
+
+class PartitionSketch:
+    """Summary of the sales of one partition (one year), mergeable with others"""
+    
+    def __init__(self, rows=0, sales=0.0, volume=0.0, countries=None, types=None, price=None,
+                 price_quantiles=None, country_sales=None):
+        self.rows = rows
+        self.sales = sales
+        self.volume = volume
+        self.countries = countries or HyperLogLog()
+        self.types = types or HyperLogLog()
+        self.price = price or Moments()
+        self.price_quantiles = price_quantiles or KLL()
+        # Exact per-country totals: one entry per country, needed for the HHI
+        self.country_sales = country_sales or {}
+    
+    def update(self, frame):
+        """Add the rows of a sales DataFrame"""
+        self.rows += len(frame)
+        self.sales += float(frame['sales'].sum())
+        self.volume += float(frame['volume'].sum())
+        self.countries.update(frame['country'])
+        self.types.update(frame['type'])
+        self.price.update(frame['price'].to_numpy())
+        self.price_quantiles.update(frame['price'].to_numpy())
+        for country, total in frame.groupby('country')['sales'].sum().items():
+            self.country_sales[country] = self.country_sales.get(country, 0.0) + float(total)
+        return self
+    
+    def merge(self, other):
+        self.rows += other.rows
+        self.sales += other.sales
+        self.volume += other.volume
+        self.countries.merge(other.countries)
+        self.types.merge(other.types)
+        self.price.merge(other.price)
+        self.price_quantiles.merge(other.price_quantiles)
+        for country, total in other.country_sales.items():
+            self.country_sales[country] = self.country_sales.get(country, 0.0) + total
+        return self
+    
+    def to_json(self):
+        return json.dumps({
+            'rows': self.rows,
+            'sales': self.sales,
+            'volume': self.volume,
+            'countries': self.countries.to_dict(),
+            'types': self.types.to_dict(),
+            'price': self.price.to_dict(),
+            'price_quantiles': self.price_quantiles.to_dict(),
+            'country_sales': self.country_sales,
+        })
+    
+    @classmethod
+    def from_json(cls, payload):
+        data = json.loads(payload)
+        return cls(data['rows'], data['sales'], data['volume'],
+                   HyperLogLog.from_dict(data['countries']), HyperLogLog.from_dict(data['types']),
+                   Moments.from_dict(data['price']), KLL.from_dict(data['price_quantiles']),
+                   data['country_sales'])
+
+def build_partitions(frame):
+    """Build one PartitionSketch per year of a sales DataFrame"""
+    return {int(year): PartitionSketch().update(group) for year, group in frame.groupby('year')}
+
+class SketchStore:
+    """Per-year sketches persisted in the sales_sketches table"""
+    
+    def __init__(self, backend):
+        self.backend = backend
+    
+    def load(self, conn):
+        """Return ({year: sketch}, dirty years)"""
+        rows = self.backend.execute(conn, "SELECT partition_key, payload, dirty FROM sales_sketches").fetchall()
+        sketches = {int(key): PartitionSketch.from_json(payload) for key, payload, _ in rows}
+        dirty = {int(key) for key, _, is_dirty in rows if is_dirty}
+        return sketches, dirty
+    
+    def save(self, conn, partitions):
+        for year, sketch in partitions.items():
+            if not sketch.rows:
+                self.backend.execute(conn, "DELETE FROM sales_sketches WHERE partition_key=?", (int(year),))
+                continue
+            self.backend.execute(conn, '''
+                INSERT OR REPLACE INTO sales_sketches (partition_key, payload, dirty, updated_at)
+                VALUES (?, ?, 0, CURRENT_TIMESTAMP)
+            ''', (int(year), sketch.to_json()))
+    
+    def replace_all(self, conn, frame):
+        """Drop every sketch and rebuild them from a DataFrame (full reload)"""
+        self.backend.execute(conn, "DELETE FROM sales_sketches")
+        self.save(conn, build_partitions(frame))
+    
+    def add(self, conn, frame):
+        """Merge newly inserted rows into their partitions"""
+        for year, update in build_partitions(frame).items():
+            row = self.backend.execute(
+                conn, "SELECT payload, dirty FROM sales_sketches WHERE partition_key=?", (year,)
+            ).fetchone()
+            if row and row[1]:
+                # A dirty partition is rebuilt from the table anyway
+                continue
+            sketch = PartitionSketch.from_json(row[0]).merge(update) if row else update
+            self.save(conn, {year: sketch})
+    
+    def mark_dirty(self, conn, years):
+        """Updates and deletes cannot be subtracted from a sketch: flag for rebuild"""
+        for year in years:
+            self.backend.execute(conn, '''
+                INSERT OR REPLACE INTO sales_sketches (partition_key, payload, dirty, updated_at)
+                VALUES (?, COALESCE((SELECT payload FROM sales_sketches WHERE partition_key=?), ?), 1,
+                        CURRENT_TIMESTAMP)
+            ''', (int(year), int(year), PartitionSketch().to_json()))
+    
+    def rebuild(self, conn, years, batch_size=100_000):
+        """Recompute the sketches of some years by scanning their rows in batches"""
+        columns = ['country', 'year', 'type', 'sales', 'volume', 'price']
+        partitions = {}
+        for year in years:
+            sketch = PartitionSketch()
+            cursor = self.backend.execute(conn, f"SELECT {', '.join(columns)} FROM sales WHERE year=?", (int(year),))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                sketch.update(pd.DataFrame(rows, columns=columns))
+            partitions[int(year)] = sketch
+        return partitions
+    
+    def refresh(self, conn):
+        """Rebuild the dirty partitions (run on the writer so no write slips in between)"""
+        dirty = [row[0] for row in self.backend.execute(
+            conn, "SELECT partition_key FROM sales_sketches WHERE dirty=1").fetchall()]
+        if dirty:
+            self.save(conn, self.rebuild(conn, dirty))
+        return len(dirty)
+
+def summarize(partitions, years=None):
+    """Merge partitions (optionally only some years) into approximate statistics"""
+    selected = {year: sketch for year, sketch in partitions.items()
+                if sketch.rows and (years is None or year in years)}
+    merged = PartitionSketch()
+    for sketch in selected.values():
+        merged.merge(sketch)
+    
+    country_total = sum(merged.country_sales.values())
+    return {
+        'total_records': merged.rows,
+        'total_sales': merged.sales,
+        'total_volume': merged.volume,
+        'countries_count': round(merged.countries.estimate()) if merged.rows else 0,
+        'types_count': round(merged.types.estimate()) if merged.rows else 0,
+        'year_range': (min(selected), max(selected)) if selected else (None, None),
+        'avg_price': merged.price.mean if merged.price.count else float('nan'),
+        'price_std': merged.price.std,
+        'price_median': merged.price_quantiles.quantile(0.5),
+        'price_p95': merged.price_quantiles.quantile(0.95),
+        'market_concentration': (sum(v ** 2 for v in merged.country_sales.values()) / country_total ** 2
+                                 if country_total else float('nan')),
+        'yearly_sales': {year: sketch.sales for year, sketch in sorted(selected.items())},
+        'yearly_volume': {year: sketch.volume for year, sketch in sorted(selected.items())},
+        'error_bounds': {
+            # Relative standard error of the distinct counts, rank error of the quantiles
+            'countries_count': merged.countries.relative_error,
+            'types_count': merged.types.relative_error,
+            'price_quantiles': merged.price_quantiles.rank_error,
+        },
+    }
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import ast
+import json
+import re
+import sqlite3
+import zlib
+import numpy as np
+import pandas as pd
+
+from instrumentation import query_log
+
+SALES_COLUMNS = ['country', 'year', 'type', 'sales', 'volume', 'price']
+# Money is stored as integers: sales in cents, prices in thousandths of a euro per litre.
+# The REAL columns are kept in sync for older readers; aggregations use the integers.
+FIXED_POINT = {
+    'sales': ('sales_cents', 100),
+    'price': ('price_millis', 1000),
+}
+
+def to_fixed(values, scale):
+    """Round amounts to integer units of 1/scale (int64), halves away from zero
+
+    Same rule as SQL ROUND, which backfilled the integer columns of older
+    databases: a sale gets the same amount (and row hash) either way.
+    """
+    scaled = np.asarray(values, dtype=np.float64) * scale
+    return np.trunc(scaled + np.copysign(0.5, scaled)).astype(np.int64)
+
+def with_fixed_columns(df):
+    """Copy of a sales frame with its integer money columns, and amounts rounded to match them"""
+    df = df.copy()
+    for column, (fixed, scale) in FIXED_POINT.items():
+        if column in df:
+            df[fixed] = to_fixed(df[column], scale)
+            df[column] = df[fixed] / scale
+    return df
+
+def from_fixed_columns(df):
+    """Amounts of a sales frame read back from their integer columns (which are dropped)"""
+    for column, (fixed, scale) in FIXED_POINT.items():
+        if fixed in df:
+            values = df.pop(fixed)
+            if values.notna().all():
+                df[column] = values.to_numpy(dtype=np.int64) / scale
+    return df
+
+# Columns identifying a sale's content; identical rows share a row_hash
+HASH_COLUMNS = ['country', 'year', 'type', 'sales_cents', 'volume', 'price_millis', 'sale_date']
+# SipHash key of the row hashes: changing it invalidates every stored hash
+ROW_HASH_KEY = '0l1v30il7r4ck3r!'
+
+def row_hashes(df):
+    """Stable 64-bit content hash of each sale, as signed int64 (fits an INTEGER column)
+
+    Hashes a canonical text form of the row with a fixed key, so the value
+    does not depend on the dtypes of the frame it was computed from.
+    """
+    if df.empty:
+        return np.empty(0, dtype=np.int64)
+    keys = (df['country'].astype(str) + '|' + df['year'].astype(np.int64).astype(str) + '|' +
+            df['type'].astype(str) + '|' + df['sales_cents'].astype(np.int64).astype(str) + '|' +
+            df['volume'].astype(np.float64).map(repr) + '|' + df['price_millis'].astype(np.int64).astype(str))
+    if 'sale_date' in df and df['sale_date'].notna().any():
+        keys = keys + '|' + pd.to_datetime(df['sale_date']).dt.strftime('%Y-%m-%d').fillna('')
+    else:
+        keys = keys + '|'
+    hashes = pd.util.hash_array(keys.to_numpy(dtype=object), hash_key=ROW_HASH_KEY, categorize=False)
+    return hashes.view(np.int64)
+
+def prepare_sales(df):
+    """Sales frame ready to be stored: integer money columns and content hash (no-op when present)"""
+    if FIXED_POINT['sales'][0] not in df:
+        df = with_fixed_columns(df)
+    if 'row_hash' not in df:
+        df = df.assign(row_hash=row_hashes(df))
+    return df
+
+def read_sales(df):
+    """Stored sales rows as the DataFrame API exposes them: amounts in euros, no internal columns"""
+    return from_fixed_columns(df).drop(columns=['row_hash'], errors='ignore')
+
+FILTER_COLUMNS = ('country', 'year', 'type')
+
+def filters_key(filters):
+    """Canonical JSON key of a {column: value} filter dict"""
+    values = {column: value.item() if hasattr(value, 'item') else value for column, value in filters.items()}
+    return json.dumps(values, sort_keys=True, ensure_ascii=False)
+
+def _json_default(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+def analysis_parameters(parameters):
+    """Parameters of an analysis as a dict, from a dict, a JSON string or a legacy str(dict)
+
+    A flat dict of filter columns is taken as the filter set of the analysis.
+    """
+    if isinstance(parameters, str):
+        try:
+            parameters = json.loads(parameters)
+        except ValueError:
+            try:
+                parameters = ast.literal_eval(parameters)
+            except (ValueError, SyntaxError):
+                parameters = {'value': parameters}
+    if not isinstance(parameters, dict):
+        parameters = {'value': parameters}
+    if parameters and set(parameters) <= set(FILTER_COLUMNS):
+        parameters = {'filters': parameters}
+    return json.loads(json.dumps(parameters, default=_json_default))
+
+def analysis_row(parameters, result):
+    """(parameters JSON, filters_key, compressed result) of an analysis_history row"""
+    parameters = analysis_parameters(parameters)
+    return (json.dumps(parameters, ensure_ascii=False, sort_keys=True),
+            filters_key(parameters.get('filters') or {}),
+            zlib.compress(str(result).encode('utf-8'), 6))
+
+def analysis_result(blob, text=None):
+    """Text of a stored result: the compressed blob, or the legacy TEXT column"""
+    return zlib.decompress(blob).decode('utf-8') if blob is not None else text
+
+class StorageBackend:
+    """Base class for the storage engines behind OliveOilDatabase"""
+    
+    name = None
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+    
+    def connect(self):
+        """Open a new connection to the engine"""
+        raise NotImplementedError
+    
+    def schema_statements(self):
+        """DDL statements creating the application tables"""
+        raise NotImplementedError
+    
+    def execute(self, conn, sql, params=()):
+        """Run a statement on an open connection and return the cursor
+        
+        Every statement goes through here: the query log records its
+        latency and rows, fetches included, and explains the slow ones.
+        """
+        return query_log.execute(self, conn, sql, params)
+    
+    def executemany(self, conn, sql, rows):
+        """Run a statement once per parameter row, logged as one call"""
+        rows = list(rows)
+        with query_log.track(self, sql) as info:
+            conn.executemany(sql, rows)
+            info['rows'] = len(rows)
+    
+    def query_df(self, sql, params=()):
+        """Run a query on a fresh connection and return a DataFrame"""
+        raise NotImplementedError
+    
+    def explain(self, sql, params=()):
+        """(plan lines, tables read by a full scan) of a statement, on a fresh connection"""
+        raise NotImplementedError
+    
+    def prepare(self, conn):
+        """Settings applied before the first table of a new database is created"""
+    
+    def configure_writer(self, conn):
+        """Tune the long-lived connection of the writer thread"""
+    
+    def begin_write(self, conn):
+        """Open an explicit write transaction"""
+        conn.execute("BEGIN TRANSACTION")
+    
+    def insert_frame(self, conn, table, df):
+        """Append the rows of a DataFrame to a table"""
+        raise NotImplementedError
+    
+    def _storage_frame(self, table, df):
+        # Sales rows get their integer money columns and hash whichever caller inserts them
+        return prepare_sales(df) if table == 'sales' else df
+
+
+class SQLiteBackend(StorageBackend):
+    """Row-oriented storage in a single SQLite file"""
+    
+    name = "sqlite"
+    
+    def connect(self):
+        return sqlite3.connect(self.db_path)
+    
+    def prepare(self, conn):
+        # Lets maintenance hand free pages back in small steps (PRAGMA incremental_vacuum);
+        # only takes effect on an empty file, existing ones need one full VACUUM
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    
+    def configure_writer(self, conn):
+        # WAL lets readers keep reading while the writer commits, and
+        # synchronous=NORMAL is durable enough in WAL mode with one fsync per checkpoint
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Once checkpointed, the WAL is truncated back to 64 MB instead of keeping its peak size
+        conn.execute("PRAGMA journal_size_limit=67108864")
+    
+    def begin_write(self, conn):
+        # Take the write lock upfront instead of upgrading from a read lock
+        conn.execute("BEGIN IMMEDIATE")
+    
+    def schema_statements(self):
+        return [
+            '''
+            CREATE TABLE IF NOT EXISTS sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                country TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                type TEXT NOT NULL,
+                sales REAL NOT NULL,
+                volume REAL NOT NULL,
+                price REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            # Users table for future multi-user support
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                email TEXT UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS analysis_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                analysis_type TEXT NOT NULL,
+                parameters TEXT,
+                result TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+        ]
+    
+    def query_df(self, sql, params=()):
+        conn = self.connect()
+        try:
+            cursor = self.execute(conn, sql, params)
+            # What pd.read_sql_query does, minus its own execution path
+            return pd.DataFrame.from_records(cursor.fetchall(), columns=[column[0] for column in cursor.description],
+                                             coerce_float=True)
+        finally:
+            conn.close()
+    
+    def explain(self, sql, params=()):
+        conn = self.connect()
+        try:
+            plan = [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        finally:
+            conn.close()
+        # "SCAN sales" reads every row; "SCAN sales USING (COVERING) INDEX ..." walks an index instead
+        scanned = set()
+        for line in plan:
+            match = re.match(r"SCAN (TABLE )?(\w+)", line)
+            if match and "USING" not in line and match.group(2) in tables:
+                scanned.add(match.group(2))
+        return plan, sorted(scanned)
+    
+    def insert_frame(self, conn, table, df):
+        # executemany instead of DataFrame.to_sql, which commits on its own
+        # and would break the caller's transaction
+        df = self._storage_frame(table, df)
+        columns = ", ".join(df.columns)
+        placeholders = ", ".join("?" * len(df.columns))
+        rows = df.astype(object).where(df.notna(), None).itertuples(index=False, name=None)
+        self.executemany(conn, f"INSERT INTO {table} ({columns}) VALUES ({placeholders})", rows)
+
+
+class DuckDBBackend(StorageBackend):
+    """Embedded columnar storage for scan-heavy aggregations"""
+    
+    name = "duckdb"
+    
+    def __init__(self, db_path):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise ImportError("The duckdb backend requires the 'duckdb' package (pip install duckdb)") from e
+        self._duckdb = duckdb
+        super().__init__(db_path)
+    
+    def connect(self):
+        return self._duckdb.connect(self.db_path)
+    
+    def schema_statements(self):
+        # DuckDB has no AUTOINCREMENT, ids come from sequences instead
+        return [
+            "CREATE SEQUENCE IF NOT EXISTS sales_id_seq",
+            '''
+            CREATE TABLE IF NOT EXISTS sales (
+                id BIGINT PRIMARY KEY DEFAULT nextval('sales_id_seq'),
+                country VARCHAR NOT NULL,
+                year INTEGER NOT NULL,
+                type VARCHAR NOT NULL,
+                sales DOUBLE NOT NULL,
+                volume DOUBLE NOT NULL,
+                price DOUBLE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            "CREATE SEQUENCE IF NOT EXISTS users_id_seq",
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id BIGINT PRIMARY KEY DEFAULT nextval('users_id_seq'),
+                username VARCHAR UNIQUE NOT NULL,
+                email VARCHAR UNIQUE NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+            "CREATE SEQUENCE IF NOT EXISTS analysis_history_id_seq",
+            '''
+            CREATE TABLE IF NOT EXISTS analysis_history (
+                id BIGINT PRIMARY KEY DEFAULT nextval('analysis_history_id_seq'),
+                analysis_type VARCHAR NOT NULL,
+                parameters VARCHAR,
+                result VARCHAR,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''',
+        ]
+    
+    def query_df(self, sql, params=()):
+        conn = self.connect()
+        try:
+            return self.execute(conn, sql, list(params)).df()
+        finally:
+            conn.close()
+    
+    def explain(self, sql, params=()):
+        conn = self.connect()
+        try:
+            text = "\n".join(row[-1] for row in conn.execute(f"EXPLAIN {sql}", list(params)).fetchall())
+        finally:
+            conn.close()
+        # Tables of the SEQ_SCAN boxes of the rendered plan (an INDEX_SCAN names its table too)
+        lines = text.splitlines()
+        scanned, operator = set(), None
+        for index, line in enumerate(lines):
+            cell = line.strip(" │┌┐└┘─┬┴")
+            if re.fullmatch(r"[A-Z_]+", cell):
+                operator = cell
+            elif cell.startswith("Table:") and operator == "SEQ_SCAN":
+                name = cell[len("Table:"):].strip() or lines[index + 1].strip(" │")
+                scanned.add(name.split(".")[-1])
+        return lines, sorted(scanned)
+    
+    def insert_frame(self, conn, table, df):
+        df = self._storage_frame(table, df)
+        columns = ", ".join(df.columns)
+        conn.register("_insert_frame", df)
+        try:
+            with query_log.track(self, f"INSERT INTO {table} ({columns}) SELECT {columns} FROM _insert_frame") as info:
+                conn.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM _insert_frame")
+                info['rows'] = len(df)
+        finally:
+            conn.unregister("_insert_frame")
+
+
+BACKENDS = {
+    SQLiteBackend.name: SQLiteBackend,
+    DuckDBBackend.name: DuckDBBackend,
+}
+
+def create_backend(backend, db_path):
+    """Build a backend from its name, or return an existing instance unchanged"""
+    if isinstance(backend, StorageBackend):
+        return backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[backend](db_path)
@@ -6,6 +6,7 @@ Script de test pour vérifier la base de données Olive Oil Tracker Pro
 """
 
 import pandas as pd
+import numpy as np
 from database import db
 import os
 
@@ -113,6 +114,1205 @@ def test_analytics():
         print(f"❌ Erreur lors du test d'analyse: {e}")
         return False
 
+def test_storage_backends():
+    """Les moteurs SQLite et DuckDB doivent donner les mêmes agrégations"""
+    import tempfile
+    from database import OliveOilDatabase
+    
+    print("\n🗄️ Test des moteurs de stockage")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for backend in ("sqlite", "duckdb"):
+            test_db = OliveOilDatabase(os.path.join(tmp, f"test.{backend}"), backend=backend)
+            test_db.load_data_from_csv("olive_oil_data.csv")
+            results[backend] = (
+                test_db.get_statistics(),
+                test_db.aggregate('country', filters={'year': 2021}),
+                test_db.pivot('country', 'year'),
+            )
+            print(f"✅ {backend}: {results[backend][0]['total_records']} enregistrements")
+        
+        sqlite_stats, sqlite_agg, sqlite_pivot = results["sqlite"]
+        duckdb_stats, duckdb_agg, duckdb_pivot = results["duckdb"]
+        assert sqlite_stats['total_records'] == duckdb_stats['total_records']
+        assert abs(sqlite_stats['total_sales'] - duckdb_stats['total_sales']) < 1e-6
+        assert list(sqlite_agg['country']) == list(duckdb_agg['country'])
+        assert np.allclose(sqlite_agg['sales'], duckdb_agg['sales'])
+        assert np.allclose(sqlite_pivot.values, duckdb_pivot.values)
+
+def test_data_generator():
+    """Le générateur synthétique doit être déterministe et injecter des anomalies"""
+    from data_generator import SalesGenerator
+    
+    print("\n🎲 Test du générateur de données")
+    print("=" * 30)
+    
+    generator = SalesGenerator(countries=12, anomaly_rate=0.05, seed=7)
+    full = generator.frame(150_000, labels=True)
+    chunked = pd.concat(list(generator.chunks(150_000, 40_000, labels=True)), ignore_index=True)
+    
+    assert full.equals(chunked)
+    assert full.equals(SalesGenerator(countries=12, anomaly_rate=0.05, seed=7).frame(150_000, labels=True))
+    assert full['country'].nunique() == 12
+    assert 0.04 < full['injected_anomaly'].mean() < 0.06
+    print(f"✅ {len(full)} lignes, {full['injected_anomaly'].sum()} anomalies injectées")
+
+def test_instrumentation():
+    """Les opérations mesurées apparaissent dans le résumé, le JSONL et l'export Prometheus"""
+    import json
+    import tempfile
+    import urllib.request
+    from instrumentation import Instrumentation
+    
+    print("\n⏱️ Test de l'instrumentation")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        recorder = Instrumentation(jsonl_path=os.path.join(tmp, "metrics.jsonl"))
+        run_id = recorder.start_run()
+        
+        @recorder.timed("test.load")
+        def load():
+            return pd.DataFrame({'sales': np.arange(100, dtype=float)})
+        
+        load()
+        with recorder.track("test.block") as info:
+            info['rows'] = 3
+        with recorder.profile('cprofile'):
+            load()
+        
+        summary = recorder.summary().set_index('operation')
+        assert summary.loc['test.load', 'calls'] == 2 and summary.loc['test.load', 'rows'] == 200
+        assert summary.loc['test.load', 'bytes'] == 2 * 800 and summary.loc['test.block', 'rows'] == 3
+        assert [span['name'] for span in recorder.run_spans(run_id)] == ['test.load', 'test.block', 'test.load']
+        with open(recorder.jsonl_path, encoding='utf-8') as f:
+            assert [json.loads(line)['name'] for line in f] == ['test.load', 'test.block', 'test.load']
+        assert 'load' in recorder.profiles[run_id]
+        
+        text = recorder.prometheus_text()
+        assert 'olive_oil_operation_calls_total{operation="test.load"} 2' in text
+        server = recorder.serve_prometheus(port=0)
+        try:
+            port = server.server_address[1]
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                assert 'olive_oil_operation_rows_total{operation="test.block"} 3' in response.read().decode()
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/queries") as response:
+                assert 'statements' in json.loads(response.read())
+        finally:
+            server.shutdown()
+            server.server_close()
+        print(f"✅ {len(summary)} opérations exportées")
+
+def test_launcher():
+    """Le rapport de démarrage mesure les imports et le premier rendu ; --warmup remplit le cache du dashboard"""
+    import contextlib
+    import io
+    import shutil
+    import sqlite3
+    import tempfile
+    import launch_pro
+    
+    print("\n🚀 Test du lanceur")
+    print("=" * 30)
+    
+    assert launch_pro.measure_import("json") >= 0
+    assert launch_pro.measure_import("module_inexistant") is None
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert launch_pro.report_startup_time()
+    report = output.getvalue()
+    assert "📦 pandas" in report and "Premier affichage (titre)" in report and "app.rerun" in report
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "warmup.db")
+        shutil.copy("olive_oil.db", db_path)
+        previous = os.environ.get("OLIVE_OIL_DB_PATH")
+        os.environ["OLIVE_OIL_DB_PATH"] = db_path
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                process = launch_pro.start_warmup(top_k=3)
+            assert process.wait(timeout=300) == 0
+        finally:
+            if previous is None:
+                del os.environ["OLIVE_OIL_DB_PATH"]
+            else:
+                os.environ["OLIVE_OIL_DB_PATH"] = previous
+        with contextlib.closing(sqlite3.connect(db_path)) as conn:
+            # The unfiltered view plus the three most used combinations
+            assert conn.execute("SELECT COUNT(*) FROM dashboard_cache").fetchone()[0] == 1 + 3
+    print("✅ Rapport de démarrage et préchauffage")
+
+def test_migrations():
+    """Les migrations sont versionnées, atomiques par étape, et les backfills reprennent après interruption"""
+    import tempfile
+    import threading
+    from database import OliveOilDatabase
+    from migrations import MIGRATIONS, Migration, MigrationRunner, SQL, FrameBackfill
+    from storage import create_backend
+    
+    print("\n🧱 Test des migrations")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        assert test_db.schema_version() == MIGRATIONS[-1].version
+        
+        calls = {'batches': 0}
+        def double_sales(frame):
+            calls['batches'] += 1
+            if calls['batches'] == 3:
+                raise RuntimeError("interruption simulée")
+            return frame.assign(sales_x2=frame['sales'] * 2)
+        
+        version = MIGRATIONS[-1].version + 1
+        extra = Migration(version, "test backfill", [
+            SQL("ALTER TABLE sales ADD COLUMN sales_x2 REAL"),
+            FrameBackfill('sales', ['sales'], ['sales_x2'], double_sales, batch_size=4),
+        ])
+        runner = MigrationRunner(test_db.backend, MIGRATIONS + [extra])
+        try:
+            runner.migrate()
+            assert False, "la migration aurait dû être interrompue"
+        except RuntimeError:
+            pass
+        assert runner.current_version() == version - 1
+        
+        runner.migrate()
+        df = test_db.get_all_data()
+        assert runner.current_version() == version
+        assert np.allclose(df['sales_x2'], df['sales'] * 2)
+        # 15 rows by batches of 4: two batches, the failed one, then the two remaining
+        assert calls['batches'] == 5
+        
+        # A crash after the DDL rolls it back with the step: the resumed step does not hit a duplicate column
+        class CrashAfterAlter(SQL):
+            def run(self, runner, conn, version, index):
+                super().run(runner, conn, version, index)
+                if not calls.get('crashed'):
+                    calls['crashed'] = True
+                    raise RuntimeError("arrêt simulé")
+        
+        crashing = Migration(version + 1, "test DDL", [CrashAfterAlter("ALTER TABLE sales ADD COLUMN note TEXT")])
+        runner = MigrationRunner(test_db.backend, MIGRATIONS + [extra, crashing])
+        try:
+            runner.migrate()
+            assert False, "la migration aurait dû être interrompue"
+        except RuntimeError:
+            pass
+        assert 'note' not in test_db.get_all_data().columns
+        runner.migrate()
+        assert runner.current_version() == version + 1
+        print(f"✅ Schéma en version {runner.current_version()} après reprise")
+        test_db.close()
+        
+        # Two processes migrating the same new file: each step runs once, under the write lock
+        results = []
+        def migrate_fresh():
+            results.append(MigrationRunner(create_backend('sqlite', os.path.join(tmp, "fresh.db"))).migrate())
+        threads = [threading.Thread(target=migrate_fresh) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(results) == 2
+        assert MigrationRunner(create_backend('sqlite', os.path.join(tmp, "fresh.db"))).current_version() == version - 1
+
+def test_single_writer():
+    """Les écritures concurrentes passent par un seul écrivain sans se bloquer"""
+    import tempfile
+    import threading
+    from database import OliveOilDatabase
+    
+    print("\n✍️ Test de l'écrivain unique")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        
+        def write_many():
+            futures = [test_db.add_sale("Spain", 2024, "Pure", 10.0, 2.0, 5.0) for _ in range(50)]
+            for future in futures:
+                future.result()
+        
+        threads = [threading.Thread(target=write_many) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert test_db.get_statistics()['total_records'] == 1000
+        assert test_db.writer.stats['batches'] < 1000
+        
+        # A failing request does not take the rest of its batch down with it
+        bad = test_db.writer.execute("INSERT INTO missing_table VALUES (1)")
+        good = test_db.add_sale("Italy", 2024, "Pure", 10.0, 2.0, 5.0)
+        assert good.result() == 1
+        assert isinstance(bad.exception(), Exception)
+        print(f"✅ 1000 écritures en {test_db.writer.stats['batches']} transactions")
+        test_db.close()
+
+def test_sketches():
+    """Les statistiques approximatives restent proches des valeurs exactes"""
+    import tempfile
+    from database import OliveOilDatabase
+    from data_generator import SalesGenerator
+    from analytics import AdvancedAnalytics
+    from sketches import HyperLogLog, KLL, Moments
+    
+    print("\n⚡ Test des sketches")
+    print("=" * 30)
+    
+    # Merging partial sketches gives the same answer as one sketch over everything
+    values = np.random.default_rng(0).normal(10, 2, 100000)
+    left, right = Moments().update(values[:30000]), Moments().update(values[30000:])
+    assert abs(left.merge(right).std - values.std(ddof=1)) < 1e-9
+    quantiles = KLL().update(values[:50000]).merge(KLL().update(values[50000:]))
+    assert abs((values < quantiles.quantile(0.95)).mean() - 0.95) < 3 * quantiles.rank_error
+    distinct = HyperLogLog().update(range(50000))
+    assert abs(distinct.estimate() - 50000) / 50000 < 3 * distinct.relative_error
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "sales.csv")
+        SalesGenerator(seed=1).write_csv(csv_path, 20000)
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv(csv_path)
+        
+        exact = test_db.get_statistics()
+        requests = test_db.writer.stats['requests']
+        approx = test_db.get_statistics(approximate=True)
+        # Nothing dirty: the approximate read never queues on the writer
+        assert test_db.writer.stats['requests'] == requests
+        assert approx['total_records'] == exact['total_records']
+        assert approx['countries_count'] == exact['countries_count']
+        assert approx['year_range'] == exact['year_range']
+        assert abs(approx['total_sales'] - exact['total_sales']) < 1e-6 * exact['total_sales']
+        
+        # Inserts are merged into their partition, updates and deletes trigger a rebuild
+        test_db.add_sale("Atlantis", 2030, "Pure", 10.0, 2.0, 5.0).result()
+        sale_id = test_db.get_all_data()['id'].iloc[0]
+        test_db.delete_sale(sale_id).result()
+        requests = test_db.writer.stats['requests']
+        approx = test_db.get_statistics(approximate=True)
+        assert test_db.writer.stats['requests'] == requests + 1
+        assert approx['total_records'] == exact['total_records']
+        assert approx['countries_count'] == exact['countries_count'] + 1
+        assert approx['year_range'][1] == 2030
+        
+        exact_kpis = AdvancedAnalytics(test_db.get_all_data(), test_db).calculate_kpis()
+        approx_kpis = AdvancedAnalytics(test_db.get_all_data(), test_db).calculate_kpis(approximate=True)
+        for key in ('price_volatility', 'market_concentration', 'sales_growth'):
+            assert abs(approx_kpis[key] - exact_kpis[key]) < 1e-6 * max(1, abs(exact_kpis[key]))
+        print(f"✅ Sketches cohérents ({approx['total_records']} enregistrements)")
+        test_db.close()
+
+def test_chunked_analytics():
+    """L'analyse par blocs donne les mêmes résultats qu'en mémoire"""
+    import tempfile
+    from analytics import AdvancedAnalytics
+    from database import OliveOilDatabase
+    from data_generator import SalesGenerator
+    from figure_cache import decode_array
+    
+    print("\n🧱 Test de l'analyse par blocs")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "sales.csv")
+        SalesGenerator(seed=3).write_csv(csv_path, 20000)
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv(csv_path)
+        
+        in_memory = AdvancedAnalytics(test_db.get_all_data())
+        chunked = AdvancedAnalytics(test_db.iter_data(chunksize=3000))
+        
+        expected, kpis = in_memory.calculate_kpis(), chunked.calculate_kpis()
+        assert set(kpis) == set(expected)
+        for key, value in expected.items():
+            assert abs(kpis[key] - value) <= 1e-9 * max(1, abs(value)), key
+        
+        expected_pivot = decode_array(in_memory.create_heatmap().data[0].z)
+        assert np.allclose(decode_array(chunked.create_heatmap().data[0].z), expected_pivot)
+        assert np.allclose(chunked.predict_sales()[0]['predicted_sales'],
+                           in_memory.predict_sales()[0]['predicted_sales'])
+        assert chunked.generate_recommendations() == in_memory.generate_recommendations()
+        
+        # Row-level methods work on a bounded sample
+        assert len(chunked.rows) == chunked.cube.sample_size
+        print(f"✅ {chunked.cube.rows} lignes analysées par blocs de 3000")
+        test_db.close()
+
+def test_segment_recommendations():
+    """Les règles sont évaluées pour tous les segments et mises en cache par version"""
+    import tempfile
+    from analytics import AdvancedAnalytics
+    from database import OliveOilDatabase
+    from data_generator import SalesGenerator
+    from recommendations import engine
+    
+    print("\n🎯 Test des recommandations par segment")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "sales.csv")
+        SalesGenerator(countries=12, types=4, seed=5).write_csv(csv_path, 20000)
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv(csv_path)
+        data = test_db.get_all_data()
+        
+        recommendations = AdvancedAnalytics(data, test_db).segment_recommendations()
+        assert set(recommendations['level']) == {'country', 'type', 'country × type'}
+        assert recommendations['segment'].nunique() == 12 + 4 + 48
+        # Exactly one top segment per level, and every segment gets one growth verdict
+        assert (recommendations['rule'] == 'meilleur_segment').sum() == 3
+        growth = recommendations[recommendations['rule'].isin(['forte_croissance', 'croissance', 'declin'])]
+        assert len(growth) == 12 + 4 + 48
+        
+        # Same rules whatever the source of the aggregates
+        in_memory = AdvancedAnalytics(data).segment_recommendations()
+        assert in_memory[['segment', 'rule']].equals(recommendations[['segment', 'rule']])
+        
+        # Cached until the data version changes (a hit does not query the aggregates)
+        version = AdvancedAnalytics(data, test_db)._data_version()
+        cached = engine.recommend(lambda: 1 / 0, version)
+        pd.testing.assert_frame_equal(cached, recommendations)
+        # Callers get copies: modifying one leaves the cache intact
+        cached['message'] = ""
+        assert engine.recommend(lambda: 1 / 0, version)['message'].equals(recommendations['message'])
+        country = data['country'].iloc[0]
+        test_db.add_sale(country, int(data['year'].max()), data['type'].iloc[0], 1e12, 2e11, 5.0).result()
+        refreshed = AdvancedAnalytics(data, test_db).segment_recommendations()
+        assert refreshed is not recommendations
+        top = refreshed[(refreshed['rule'] == 'meilleur_segment') & (refreshed['level'] == 'country')]
+        assert top['segment'].tolist() == [country]
+        print(f"✅ {len(refreshed)} recommandations sur {refreshed['segment'].nunique()} segments")
+        engine.clear()
+        test_db.close()
+
+def test_robust_anomaly_detectors():
+    """Les détecteurs MAD et IQR par segment retrouvent les anomalies injectées"""
+    from analytics import AdvancedAnalytics
+    from anomalies import grouped_quantiles, group_codes
+    from data_generator import SalesGenerator
+    
+    print("\n🚨 Test des détecteurs d'anomalies robustes")
+    print("=" * 30)
+    
+    data = SalesGenerator(seed=7).frame(50000, labels=True)
+    injected = data.pop('injected_anomaly').to_numpy()
+    
+    # The sort-based grouped quantiles match pandas
+    codes = group_codes(data, ('country', 'type'))
+    median, q1 = grouped_quantiles(data['sales'].to_numpy(), codes, [0.5, 0.25])
+    assert np.allclose(median, data.groupby(codes)['sales'].median().to_numpy())
+    assert np.allclose(q1, data.groupby(codes)['sales'].quantile(0.25).to_numpy())
+    
+    analytics = AdvancedAnalytics(data)
+    for method in ('mad', 'iqr'):
+        result = analytics.detect_anomalies(method=method, by=('country', 'type', 'year'))
+        flagged = result['is_anomaly'].to_numpy()
+        assert (result['anomaly_score'] < 0).equals(result['is_anomaly'])
+        recall = (flagged & injected).sum() / injected.sum()
+        precision = (flagged & injected).sum() / flagged.sum()
+        assert recall > 0.9 and precision > 0.3, (method, precision, recall)
+        print(f"✅ {method} : précision {precision:.2f}, rappel {recall:.2f}")
+
+def test_time_series():
+    """Les agrégations mensuelles et glissantes suivent les nouvelles ventes datées"""
+    import tempfile
+    from analytics import AdvancedAnalytics
+    from timeseries import TimeSeriesCache
+    from database import OliveOilDatabase
+    from data_generator import SalesGenerator
+    
+    print("\n📅 Test des séries temporelles")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "sales.csv")
+        SalesGenerator(years=[2022, 2023], seed=11, daily=True).write_csv(csv_path, 20000)
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv(csv_path)
+        assert test_db.has_sale_dates()
+        
+        def expected_monthly():
+            data = test_db.get_all_data()
+            month = pd.to_datetime(data['sale_date']).dt.to_period('M')
+            return data.groupby(month)['sales'].sum().to_numpy()
+        
+        series = AdvancedAnalytics(test_db.get_all_data(), test_db).time_series()
+        assert np.allclose(series.resample('M').sum(axis=1).to_numpy(), expected_monthly())
+        daily = test_db.daily_sales(by=()).set_index('sale_date')['sales'].asfreq('D', fill_value=0)
+        assert np.allclose(series.rolling_mean(7).sum(axis=1).to_numpy()[6:], daily.rolling(7).mean().to_numpy()[6:])
+        yoy = series.yoy('M')
+        assert yoy.iloc[:12].isna().all().all() and yoy.iloc[12:].notna().any().any()
+        
+        # Inserts extend a copy of the cached engine, sessions still reading it are unaffected; an update rebuilds it
+        end = series.end
+        test_db.add_sale("Spain", 2024, "Pure", 100.0, 20.0, 5.0, sale_date="2024-01-10").result()
+        extended = AdvancedAnalytics(None, test_db).time_series()
+        assert extended is not series and str(extended.end) == "2024-01-10" and series.end == end
+        assert np.allclose(extended.resample('M').sum(axis=1).to_numpy(), expected_monthly())
+        sale_id = test_db.get_all_data()['id'].iloc[0]
+        test_db.update_sale(sale_id, "Spain", 2022, "Pure", 1.0, 1.0, 1.0).result()
+        rebuilt = AdvancedAnalytics(None, test_db).time_series()
+        assert rebuilt is not series
+        assert np.allclose(rebuilt.resample('M').sum(axis=1).to_numpy(), expected_monthly())
+        
+        small = TimeSeriesCache(max_entries=1)
+        small.get(test_db)
+        small.get(test_db, filters={'country': 'Spain'})
+        assert len(small._entries) == 1
+        print(f"✅ {len(rebuilt.values)} jours × {len(rebuilt.segments)} segments")
+        test_db.close()
+
+def test_forecasting():
+    """Holt-Winters ajusté en lot retrouve la saisonnalité ; la reprise à chaud prolonge l'état"""
+    import tempfile
+    from analytics import AdvancedAnalytics
+    from database import OliveOilDatabase
+    from data_generator import SalesGenerator
+    from forecasting import ForecastCache, HoltWinters
+    
+    print("\n🔮 Test des prévisions Holt-Winters")
+    print("=" * 30)
+    
+    rng = np.random.default_rng(3)
+    t = np.arange(72)[:, None]
+    amplitude = rng.uniform(50, 200, 40)
+    values = 1000 + 3 * t + amplitude * np.sin(2 * np.pi * t / 12) + rng.normal(0, 5, (72, 40))
+    model = HoltWinters(season_length=12)
+    state = model.fit(values[:60])
+    predicted = model.forecast(state, 12)
+    assert predicted.shape == (12, 40)
+    assert np.abs(predicted - values[60:]).mean() < 0.1 * amplitude.mean()
+    
+    # Continuing the fitted state equals running the same parameters over the whole history
+    warm = model.update(state, values[60:])
+    assert warm.steps == 72
+    replay = HoltWinters(12, alphas=[state.alpha[0]], betas=[state.beta[0]], gammas=[state.gamma[0]])
+    refit = replay.fit(values[:, :1])
+    assert np.allclose(model.forecast(warm, 6)[:, 0], replay.forecast(refit, 6)[:, 0])
+    
+    # Cached states are refitted when a settled period or the segments change, and bounded
+    cache = ForecastCache(max_entries=2)
+    segments = [f"s{i}" for i in range(40)]
+    cache.forecast('key', values[:60], 12, 6, segments)
+    backdated = values[:61].copy()
+    backdated[10] += 500
+    fresh, _ = ForecastCache().forecast('key', backdated, 12, 6, segments)
+    assert np.allclose(cache.forecast('key', backdated, 12, 6, segments)[0], fresh)
+    assert np.allclose(cache.forecast('key', backdated, 12, 6, segments[::-1])[0], fresh)
+    for key in ('other', 'third'):
+        cache.forecast(key, values[:60], 12, 6, segments)
+    assert list(cache._entries) == ['other', 'third']
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "sales.csv")
+        SalesGenerator(years=[2021, 2022, 2023], seed=5, daily=True).write_csv(csv_path, 20000)
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv(csv_path)
+        analytics = AdvancedAnalytics(test_db.get_all_data(), test_db)
+        forecasts = analytics.forecast_segments(periods=6)
+        segments = test_db.get_all_data().groupby(['country', 'type']).ngroups
+        assert len(forecasts) == 6 * segments
+        assert list(forecasts.columns) == ['period', 'country', 'type', 'predicted_sales']
+        predictions, score = analytics.predict_sales(periods=2, method='holt_winters')
+        assert len(predictions) == 2 and score <= 1
+        print(f"✅ {segments} segments prévus sur 6 mois")
+        test_db.close()
+
+def test_dashboard_cache():
+    """Le préchauffage remplit le cache du dashboard, invalidé par les écritures"""
+    import tempfile
+    from database import OliveOilDatabase
+    from dashboard import DashboardCache, compute_dashboard, filter_combinations, filters_key, warmup
+    
+    print("\n🔥 Test du cache du dashboard")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "test.db")
+        test_db = OliveOilDatabase(path)
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        data = test_db.get_all_data()
+        combinations = filter_combinations(test_db)
+        assert combinations[0] == {}
+        assert {'country': 'Spain', 'year': 2021} in combinations
+        
+        # Unfiltered view plus the most used combinations (no hits yet: the first ones)
+        summary = warmup(path, workers=2, top_k=3)
+        assert summary['computed'] == 4
+        assert warmup(path, workers=2, top_k=3)['computed'] == 0
+        
+        filters = combinations[1]
+        frame = data[data[list(filters)[0]] == list(filters.values())[0]]
+        stored = DashboardCache.load(test_db, filters_key(filters), test_db.data_version())
+        assert stored == compute_dashboard(test_db, filters, frame)
+        cache = DashboardCache()
+        assert cache.get(test_db, filters, frame)['totals']['sales'] == frame['sales'].sum()
+        
+        # A write changes the data version: the next lookup recomputes
+        test_db.add_sale(*frame.iloc[0][['country', 'year', 'type']], 1000.0, 100.0, 10.0).result()
+        data = test_db.get_all_data()
+        frame = data[data[list(filters)[0]] == list(filters.values())[0]]
+        assert np.isclose(cache.get(test_db, filters, frame)['totals']['sales'], frame['sales'].sum())
+        
+        # Hits are counted in memory: lookups queue no write until a flush
+        key = filters_key(filters)
+        test_db.writer.flush()
+        before = DashboardCache.stored_keys(test_db, test_db.data_version())[1][key]
+        requests = test_db.writer.stats['requests']
+        for _ in range(5):
+            cache.get(test_db, filters, frame)
+        assert test_db.writer.stats['requests'] == requests
+        assert cache.pending_hits(test_db)[key] == 7
+        cache.flush_hits(test_db).result()
+        assert test_db.writer.stats['requests'] == requests + 1
+        assert DashboardCache.stored_keys(test_db, test_db.data_version())[1][key] == before + 7
+        assert cache.flush_hits(test_db) is None
+        
+        # Every flush_every hits are written in one request
+        small = DashboardCache(flush_every=3)
+        for _ in range(3):
+            small.get(test_db, filters, frame)
+        assert small.pending_hits(test_db) == {}
+        print(f"✅ {summary['computed']} combinaisons préchauffées")
+        test_db.close()
+
+def test_figure_cache():
+    """Les graphiques sont servis depuis leur JSON en cache, borné en octets"""
+    from analytics import AdvancedAnalytics
+    from figure_cache import FigureCache, cache, decode_array, serialize
+    
+    print("\n🖼️ Test du cache des graphiques")
+    print("=" * 30)
+    
+    data = pd.read_csv("olive_oil_data.csv")
+    cache.clear()
+    analytics = AdvancedAnalytics(data)
+    first = analytics.create_heatmap()
+    misses = cache.stats()['misses']
+    second = AdvancedAnalytics(data.copy()).create_heatmap()
+    assert cache.stats()['misses'] == misses
+    assert np.allclose(decode_array(second.data[0].z), decode_array(first.data[0].z))
+    assert second.layout.title.text == "Heatmap des ventes par pays et année"
+    # Different data, different key
+    AdvancedAnalytics(data.head(5)).create_heatmap()
+    assert cache.stats()['misses'] == misses + 1
+    
+    calls = []
+    def build():
+        calls.append(1)
+        return first
+    small = FigureCache(max_bytes=2 * len(serialize(first)))
+    for key in range(3):
+        small.figure((1, key), build)
+    small.figure((1, 2), build)
+    assert len(calls) == 3 and small.nbytes <= small.max_bytes
+    assert small.get((1, 0)) is None and small.get((1, 2)) is not None
+    small.figure((None, 'sans version'), build)
+    assert len(calls) == 4 and small.stats()['entries'] == 2
+    print(f"✅ {cache.stats()['entries']} graphiques en cache ({cache.stats()['nbytes']:,} octets)")
+
+def test_ai_batch_summaries():
+    """Résumés par segment : prompts dédupliqués, concurrence bornée, reprises et historique"""
+    import tempfile
+    from ai_batch import ANALYSIS_TYPE, BatchSummarizer, MockModel, segment_prompts
+    from database import OliveOilDatabase
+    
+    print("\n📰 Test des résumés IA par segment")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        data = test_db.get_all_data()
+        prompts = segment_prompts(test_db)
+        assert len(prompts) == data['country'].nunique() + data['type'].nunique()
+        assert all(str(year) in prompts[0][2] for year in data['year'].unique())
+        
+        # Every prompt twice: each distinct prompt reaches the model once (plus retries)
+        model = MockModel(latency=0.01, failure_rate=0.3, seed=1)
+        summarizer = BatchSummarizer(model, max_concurrency=3, retries=5, backoff=0.001, database=test_db)
+        summaries = summarizer.summarize(prompts + prompts)
+        assert summaries['error'].isna().all() and summaries['summary'].notna().all()
+        assert model.calls == len(prompts) + (summaries['attempts'] - 1).sum() // 2
+        assert model.peak_concurrency <= 3
+        history = [row for row in test_db.get_analysis_history(100) if row[1] == ANALYSIS_TYPE]
+        assert len(history) == len(prompts)
+        
+        # Memoized: a second batch calls the model and writes history no more
+        calls = model.calls
+        again = summarizer.summarize(prompts)
+        assert model.calls == calls and list(again['summary']) == list(summaries['summary'][:len(prompts)])
+        assert len([row for row in test_db.get_analysis_history(100) if row[1] == ANALYSIS_TYPE]) == len(history)
+        
+        class BrokenModel:
+            def generate(self, prompt):
+                raise ValueError("prompt refusé")
+        failed = BatchSummarizer(BrokenModel(), retries=3).summarize(prompts[:1])
+        assert failed['attempts'].tolist() == [1] and failed['error'].tolist() == ["prompt refusé"]
+        print(f"✅ {len(prompts)} segments résumés, {model.calls} appels au modèle")
+        test_db.close()
+
+def test_batch_reports():
+    """Rapports en lot : un rapport par segment, en base et en fichiers"""
+    import json
+    import tempfile
+    from batch_reports import (ANALYSIS_TYPE, level_segments, load_shared_dataset, parse_segment, run_batch,
+                               share_dataset)
+    from database import OliveOilDatabase
+    
+    print("\n📋 Test des rapports en lot")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        data = test_db.get_all_data()
+        segments = level_segments(data)
+        assert len(segments) == sum(data[column].nunique() for column in ('country', 'year', 'type'))
+        assert parse_segment(['country=Spain', 'year=2021']) == {'country': 'Spain', 'year': 2021}
+        
+        segments = [{'country': 'Spain'}, parse_segment(['type=Organic', 'year=2021'])]
+        output = os.path.join(tmp, "reports")
+        results, summary = run_batch(segments, test_db, workers=2, output_dir=output)
+        assert summary['segments'] == 2 and summary['files'] == 5
+        assert [filters for filters, _, _ in results] == segments
+        spain = data[data['country'] == 'Spain']
+        with open(os.path.join(output, "country=Spain.json"), encoding='utf-8') as f:
+            report = json.load(f)
+        assert np.isclose(report['kpis']['total_sales'], spain['sales'].sum())
+        assert pd.read_parquet(os.path.join(output, "reports.parquet"))['segment'].tolist() == \
+            ["country=Spain", "type=Organic, year=2021"]
+        history = [row for row in test_db.get_analysis_history(10) if row[1] == ANALYSIS_TYPE]
+        assert len(history) == 2
+        
+        # A single-year segment has no model score: written as null, never as NaN (invalid JSON)
+        def strict(constant):
+            raise ValueError(f"JSON invalide : {constant}")
+        with open(os.path.join(output, "type=Organic__year=2021.json"), encoding='utf-8') as f:
+            assert json.load(f, parse_constant=strict)['model_score'] is None
+        for row in history:
+            json.loads(row[3], parse_constant=strict)
+        
+        # Workers map one Arrow file instead of receiving a copy of the rows each
+        shared = load_shared_dataset(share_dataset(data, tmp))
+        pd.testing.assert_frame_equal(shared, data, check_dtype=False)
+        print(f"✅ {summary['segments']} rapports, {summary['files']} fichiers ({summary['reports_per_second']:.1f}/s)")
+        test_db.close()
+
+def test_fixed_point_money():
+    """Montants en entiers : sommes exactes, backfill de migration, API en euros inchangée"""
+    import tempfile
+    from analytics import AdvancedAnalytics
+    from database import OliveOilDatabase
+    from migrations import MIGRATIONS, MigrationRunner
+    from storage import create_backend, prepare_sales
+    
+    print("\n💶 Test des montants en virgule fixe")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        # A database created before the integer columns, then migrated
+        path = os.path.join(tmp, "old.db")
+        backend = create_backend('sqlite', path)
+        MigrationRunner(backend, [m for m in MIGRATIONS if m.version < 7]).migrate()
+        conn = backend.connect()
+        conn.execute("INSERT INTO sales (country, year, type, sales, volume, price) "
+                     "VALUES ('Spain', 2021, 'Organic', 10.1, 2.0, 5.05)")
+        conn.commit()
+        conn.close()
+        test_db = OliveOilDatabase(path)
+        assert test_db.schema_version() == MIGRATIONS[-1].version
+        conn = backend.connect()
+        assert conn.execute("SELECT sales_cents, price_millis FROM sales").fetchone() == (1010, 5050)
+        conn.close()
+        test_db.close()
+        
+        # Exact half cents: the SQL backfill and to_fixed round them the same way (away from zero),
+        # so an ingested copy of a backfilled sale has the same amounts and row hash
+        path = os.path.join(tmp, "halves.db")
+        backend = create_backend('sqlite', path)
+        MigrationRunner(backend, [m for m in MIGRATIONS if m.version < 7]).migrate()
+        conn = backend.connect()
+        conn.execute("INSERT INTO sales (country, year, type, sales, volume, price) "
+                     "VALUES ('Spain', 2021, 'Organic', 0.125, 2.0, 0.0625)")
+        conn.commit()
+        conn.close()
+        test_db = OliveOilDatabase(path)
+        legacy = pd.DataFrame({'country': ['Spain'], 'year': [2021], 'type': ['Organic'],
+                               'sales': [0.125], 'volume': [2.0], 'price': [0.0625]})
+        assert test_db.ingest_frame(legacy).result() == 0
+        conn = backend.connect()
+        assert conn.execute("SELECT sales_cents, price_millis, row_hash FROM sales").fetchall() == [
+            (13, 63, int(prepare_sales(legacy)['row_hash'].iloc[0]))]
+        conn.close()
+        test_db.close()
+        
+        # 0.10 € ten thousand times: a float sum drifts, the integer sum does not
+        rows = 10_000
+        data = pd.DataFrame({'country': 'Spain', 'year': 2021, 'type': 'Organic',
+                             'sales': [0.1] * rows, 'volume': 1.0, 'price': 0.1})
+        assert sum(data['sales'].tolist()) != 1000.0
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        csv_path = os.path.join(tmp, "dimes.csv")
+        data.to_csv(csv_path, index=False)
+        test_db.load_data_from_csv(csv_path)
+        test_db.add_sale('Spain', 2022, 'Organic', 12.346, 1.0, 12.346).result()
+        
+        assert test_db.get_statistics()['total_sales'] == 1012.35
+        totals = test_db.aggregate('year', {'sales': 'sum', 'price': 'mean'}).set_index('year')
+        assert totals.loc[2021, 'sales'] == 1000.0 and totals.loc[2021, 'price'] == 0.1
+        assert totals.loc[2022, 'sales'] == 12.35
+        
+        df = test_db.get_all_data()
+        assert 'sales_cents' not in df and df['sales'].dtype == np.float64
+        assert df['sales'].iloc[-1] == 12.35 and df['price'].iloc[-1] == 12.346
+        analytics = AdvancedAnalytics(df)
+        assert analytics._stat('sales', 'sum') == 1012.35
+        assert analytics._grouped('year', 'sales').loc[2021] == 1000.0
+        # Converted to integers once, then shared by every aggregate
+        assert analytics._fixed('sales') is analytics._fixed('sales')
+        assert AdvancedAnalytics(test_db.iter_data(chunksize=999))._stat('sales', 'sum') == 1012.35
+        print(f"✅ Total exact : {test_db.get_statistics()['total_sales']:.2f} € sur {rows + 1} ventes")
+        test_db.close()
+
+def test_ingestion():
+    """Ingestion d'un dossier : fichiers déjà vus ignorés, lignes dédoublonnées par empreinte"""
+    import shutil
+    import tempfile
+    from database import OliveOilDatabase
+    from ingestion import ingest, scan, watch
+    
+    print("\n📥 Test de l'ingestion de fichiers")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "depots")
+        os.makedirs(folder)
+        data = pd.read_csv("olive_oil_data.csv")
+        data.iloc[:10].to_csv(os.path.join(folder, "a.csv"), index=False)
+        # Overlaps a.csv on 5 rows, and repeats one of its own rows
+        pd.concat([data.iloc[5:], data.iloc[[14]]]).to_excel(os.path.join(folder, "b.xlsx"), index=False)
+        shutil.copy(os.path.join(folder, "a.csv"), os.path.join(folder, "a_copie.csv"))
+        with open(os.path.join(folder, "vide.csv"), "w") as f:
+            f.write("pays,annee\n")
+        
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        summary = ingest(test_db, scan(folder), workers=2)
+        assert summary['files'] == 4 and summary['ingested'] == 2
+        assert summary['skipped'] == 1 and summary['failed'] == 1
+        assert summary['inserted'] == len(data) and summary['duplicates'] == 6
+        stored = test_db.get_all_data()
+        assert len(stored) == len(data) and np.isclose(stored['sales'].sum(), data['sales'].sum())
+        assert 'row_hash' not in stored
+        
+        again = ingest(test_db, scan(folder), workers=2)
+        assert again['skipped'] == 3 and again['inserted'] == 0
+        # A new file repeating known rows only adds the unknown ones
+        changed = data.iloc[[12]].assign(sales=data['sales'].iloc[12] + 1)
+        pd.concat([data.iloc[:3], changed]).to_csv(os.path.join(folder, "c.csv"), index=False)
+        assert ingest(test_db, [os.path.join(folder, "c.csv")])['inserted'] == 1
+        assert len(test_db.get_all_data()) == len(data) + 1
+        
+        # A file whose write fails is reported alone, and retried by the next watch pass
+        retry = os.path.join(tmp, "retry")
+        os.makedirs(retry)
+        data.iloc[[0]].assign(sales=1.0).to_csv(os.path.join(retry, "d.csv"), index=False)
+        data.iloc[[1]].assign(sales=2.0).to_csv(os.path.join(retry, "e.csv"), index=False)
+        test_db.ingest_frame = lambda frame, checksum=None, path=None: test_db.writer.submit(lambda conn: 1 / 0) \
+            if path.name == "d.csv" else OliveOilDatabase.ingest_frame(test_db, frame, checksum, path)
+        passes = []
+        
+        def on_batch(summary):
+            passes.append(summary)
+            vars(test_db).pop('ingest_frame', None)
+        
+        watch(test_db, retry, interval=0, settle=0, on_batch=on_batch, iterations=3)
+        assert passes[0]['failed'] == 1 and passes[0]['inserted'] == 1 and list(passes[0]['errors']) == [
+            os.path.join(retry, "d.csv")]
+        assert len(passes) == 2 and passes[1]['files'] == 1 and passes[1]['inserted'] == 1
+        
+        # Reloading the CSV drops every sale, and with them the record of ingested files
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        assert test_db.ingested_checksums() == set()
+        print(f"✅ {summary['inserted']} lignes, {summary['duplicates']} doublons, {summary['rows_per_second']:,.0f} lignes/s")
+        test_db.close()
+
+def test_xlsx_import():
+    """Import Excel en flux : colonnes françaises, lignes invalides rejetées, lots bornés"""
+    import tempfile
+    from database import OliveOilDatabase
+    from ingestion import iter_xlsx
+    
+    print("\n📗 Test de l'import Excel")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        data = pd.read_csv("olive_oil_data.csv")
+        sheet = data.rename(columns={'country': 'Pays', 'year': 'Année', 'type': "Type d'huile",
+                                     'sales': 'Ventes (€)', 'volume': 'Volume (L)', 'price': 'Prix (€/L)'})
+        sheet['Commentaire'] = "ignoré"
+        invalid = pd.DataFrame({'Pays': ['', 'Spain'], 'Année': [2021, 'deux mille'], "Type d'huile": ['Organic'] * 2,
+                                'Ventes (€)': [1.0, 2.0], 'Volume (L)': [1.0, 1.0], 'Prix (€/L)': [1.0, -2.0]})
+        path = os.path.join(tmp, "ventes.xlsx")
+        pd.concat([sheet, invalid], ignore_index=True).to_excel(path, index=False, sheet_name="ventes")
+        
+        assert [len(batch) for batch in iter_xlsx(path, batch_size=4)] == [4, 4, 4, 4, 1]
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        summary = test_db.load_data_from_xlsx(path, batch_size=4)
+        assert summary['rows'] == len(data) + 2 and summary['batches'] == 5
+        assert summary['inserted'] == len(data) and summary['rejected'] == 2
+        stored = test_db.get_all_data()
+        assert np.isclose(stored['sales'].sum(), data['sales'].sum())
+        assert sorted(stored['country'].unique()) == sorted(data['country'].unique())
+        assert test_db.load_data_from_xlsx(path)['inserted'] == 0
+        
+        pd.DataFrame({'Pays': ['Spain']}).to_excel(path, index=False)
+        try:
+            test_db.load_data_from_xlsx(path)
+            assert False, "colonnes manquantes non détectées"
+        except ValueError:
+            pass
+        print(f"✅ {summary['inserted']} lignes importées, {summary['rejected']} rejetées")
+        test_db.close()
+
+def test_analysis_history():
+    """Historique compact : JSON, résultats compressés, dernier rapport par filtres, rétention"""
+    import tempfile
+    from database import OliveOilDatabase
+    from migrations import MIGRATIONS, MigrationRunner
+    from storage import create_backend
+    
+    print("\n🗂️ Test de l'historique des analyses")
+    print("=" * 30)
+    
+    report = "# Rapport\n" + "Ventes en hausse. " * 200
+    with tempfile.TemporaryDirectory() as tmp:
+        # Rows written before the compact format are converted by the migration
+        path = os.path.join(tmp, "old.db")
+        backend = create_backend('sqlite', path)
+        MigrationRunner(backend, [m for m in MIGRATIONS if m.version < 9]).migrate()
+        conn = backend.connect()
+        conn.execute("INSERT INTO analysis_history (analysis_type, parameters, result) VALUES (?, ?, ?)",
+                     ("comprehensive_report", str({'filters': {'country': 'Spain'}}), report))
+        conn.commit()
+        conn.close()
+        test_db = OliveOilDatabase(path)
+        latest = test_db.get_latest_analysis("comprehensive_report", {'country': 'Spain'})
+        assert latest['result'] == report and latest['parameters'] == {'filters': {'country': 'Spain'}}
+        conn = backend.connect()
+        stored, blob, country = conn.execute(
+            "SELECT result, length(result_blob), filter_country FROM analysis_history").fetchone()
+        plan = " ".join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM analysis_history WHERE analysis_type = ? AND filters_key = ? "
+            "ORDER BY created_at DESC LIMIT 1", ("comprehensive_report", "{}")).fetchall())
+        conn.close()
+        assert stored is None and blob < len(report) / 10 and country == 'Spain'
+        assert "idx_history_filters" in plan
+        test_db.close()
+        
+        for backend_name in ('sqlite', 'duckdb'):
+            test_db = OliveOilDatabase(os.path.join(tmp, f"test.{backend_name}"), backend_name)
+            for year in (2020, 2021, 2021, 2021):
+                test_db.save_analysis("comprehensive_report", {'filters': {'year': np.int64(year)}},
+                                      f"{report} {year}").result()
+            test_db.save_analysis("batch_report", {'country': 'Spain'}, "{}").result()
+            test_db.writer.execute("INSERT INTO analysis_history (analysis_type, parameters, filters_key, created_at) "
+                                   "VALUES ('ancien', '{}', '{}', '2000-01-01 00:00:00')").result()
+            
+            history = test_db.get_analysis_history(10)
+            assert len(history) == 6 and history[1][1] == "batch_report" and history[2][3] == f"{report} 2021"
+            assert len(test_db.get_analysis_history(10, "comprehensive_report")) == 4
+            latest = test_db.get_latest_analysis("comprehensive_report", {'year': 2021})
+            assert latest['id'] == history[2][0] and latest['result'].endswith("2021")
+            assert test_db.get_latest_analysis("batch_report", {'country': 'Spain'}) is not None
+            assert test_db.get_latest_analysis("comprehensive_report", {'year': 1999}) is None
+            
+            # The 2000 row is too old, and only two 2021 reports are kept
+            assert test_db.compact_history(max_age_days=365, keep_per_key=2).result() == 2
+            assert len(test_db.get_analysis_history(10)) == 4
+            assert test_db.get_latest_analysis("comprehensive_report", {'year': 2021})['id'] == latest['id']
+            test_db.close()
+        print(f"✅ Résultat de {len(report)} caractères stocké en {blob} octets")
+
+def test_maintenance():
+    """Maintenance : churn compté, ANALYZE, vacuum incrémental et checkpoint selon les seuils"""
+    import tempfile
+    import time
+    from database import OliveOilDatabase
+    from instrumentation import query_log
+    from maintenance import Maintenance, MaintenanceScheduler
+
+    print("\n🧹 Test de la maintenance")
+    print("=" * 30)
+
+    data = pd.read_csv("olive_oil_data.csv")
+    rows = pd.concat([data.assign(sales=data['sales'] + i, country=data['country'] + " " * 100) for i in range(200)],
+                     ignore_index=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        test_db = OliveOilDatabase(os.path.join(tmp, "test.db"))
+        maintenance = Maintenance(test_db, analyze_changes=1000, vacuum_min_pages=10, checkpoint_bytes=1)
+        status = maintenance.status()
+        assert status['auto_vacuum'] == 'incremental' and not status['analyzed']
+
+        assert test_db.ingest_frame(rows).result() == len(rows)
+        test_db.delete_sale(1).result()
+        status = maintenance.status()
+        assert status['changes'] == len(rows) + 1 and status['changes_since_analyze'] == len(rows) + 1
+        # Most rows gone: their pages are free but still in the file
+        test_db.writer.execute("DELETE FROM sales WHERE id > 300").result()
+        status = maintenance.status()
+        assert status['fragmentation'] > 0.2
+        assert maintenance.due(status) == ['analyze', 'vacuum', 'checkpoint']
+
+        results = maintenance.run()
+        assert set(results) == {'analyze', 'vacuum', 'checkpoint'}
+        assert results['vacuum']['pages'] > 200 and results['vacuum']['free_pages'] == 0
+        after = maintenance.status()
+        assert after['analyzed'] and after['changes_since_analyze'] == 0
+        assert after['freelist_count'] == 0 and after['page_count'] < status['page_count']
+        assert results['checkpoint']['truncated'] and after['wal_bytes'] < status['wal_bytes']
+        # Maintenance statements go through the backend, hence the query log
+        assert {('sqlite', 'ANALYZE'), ('sqlite', 'PRAGMA incremental_vacuum'),
+                ('sqlite', 'PRAGMA wal_checkpoint(PASSIVE)')} <= set(query_log.statements)
+        assert set(after['runs']) == set(results)
+
+        # Below every threshold nothing runs, until enough rows change again
+        maintenance.checkpoint_bytes = 1 << 30
+        assert maintenance.due() == [] and maintenance.run() == {}
+        test_db.add_sale("Spain", 2024, "Extra Virgin", 100.0, 20.0, 5.0).result()
+        assert maintenance.status()['changes_since_analyze'] == 1
+        maintenance.analyze_changes = 1
+        scheduler = MaintenanceScheduler(maintenance, interval=0.05).start()
+        deadline = time.time() + 10
+        while scheduler.passes == 0 and time.time() < deadline:
+            time.sleep(0.05)
+        scheduler.stop()
+        assert scheduler.passes >= 1 and scheduler.last_error is None
+        assert maintenance.status()['changes_since_analyze'] == 0
+        print(f"✅ {results['vacuum']['pages']} pages rendues sur {status['page_count']}, WAL vidé")
+        test_db.close()
+
+def test_query_log():
+    """Journal des requêtes : latence et lignes par requête, plans et scans complets des requêtes lentes"""
+    import tempfile
+    from database import OliveOilDatabase
+    from instrumentation import QueryLog, query_log
+    
+    print("\n🐢 Test du journal des requêtes")
+    print("=" * 30)
+    
+    assert QueryLog.normalize("SELECT a FROM t\n  WHERE id IN (?, ?,?)") == "SELECT a FROM t WHERE id IN (?, …)"
+    slow_ms = query_log.slow_ms
+    query_log.slow_ms = 0
+    query_log.reset()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            for backend in ("sqlite", "duckdb"):
+                test_db = OliveOilDatabase(os.path.join(tmp, f"test.{backend}"), backend)
+                test_db.load_data_from_csv("olive_oil_data.csv")
+                assert len(test_db.get_all_data()) == 15
+                test_db.aggregate('country', filters={'year': 2021})
+                test_db.close()
+        
+        report = query_log.report()
+        by_statement = {(row.backend, row.statement): row for row in report.itertuples()}
+        scan = by_statement[('sqlite', "SELECT * FROM sales")]
+        assert scan.rows == 15 * scan.calls and scan.full_scan and scan.scanned == "sales"
+        assert "SCAN sales" in scan.plan
+        grouped = [row for (backend, statement), row in by_statement.items()
+                   if backend == 'sqlite' and statement.startswith("SELECT country, SUM(sales_cents)")][0]
+        assert not grouped.full_scan and "idx_sales_year" in grouped.plan
+        assert by_statement[('duckdb', "SELECT * FROM sales")].scanned == "sales"
+        inserted = [row for (backend, statement), row in by_statement.items()
+                    if backend == 'sqlite' and statement.startswith("INSERT INTO sales (")][0]
+        assert inserted.rows == 15
+        assert report['seconds'].is_monotonic_decreasing and (report['slow_calls'] == report['calls']).all()
+        assert len(query_log.recent_slow_calls()) > 0
+        print(f"✅ {len(report)} requêtes distinctes, {int(report['full_scan'].eq(True).sum())} scans complets")
+    finally:
+        query_log.slow_ms = slow_ms
+        query_log.reset()
+
+def test_loadtest():
+    """Tests de charge : scénarios versionnés, sessions websocket sur un serveur local, percentiles et seuils"""
+    import json
+    import tempfile
+    from database import OliveOilDatabase
+    from loadtest import Server, Session, apply_step, check_thresholds, load_scenarios, record_baseline, run_scenario
+
+    print("\n🚦 Test des tests de charge")
+    print("=" * 30)
+
+    scenarios = load_scenarios()
+    assert {'filtres', 'onglets', 'saisies'} <= {scenario['name'] for scenario in scenarios}
+    assert all(scenario['steps'] and scenario['thresholds'] and scenario['baseline'] for scenario in scenarios)
+    assert check_thresholds({'p95_ms': 120.0, 'errors': 0}, {'p95_ms': 100, 'errors': 0}) == ["p95_ms : 120.0 > 100"]
+    # Latencies are judged against a recorded baseline, with a tolerance in percent
+    assert check_thresholds({'p95_ms': 120.0}, {}, {'p95_ms': 100.0}, tolerance_pct=25) == []
+    assert check_thresholds({'p95_ms': 130.0}, {}, {'p95_ms': 100.0}, tolerance_pct=25) == [
+        "p95_ms : 130.0 > 125.0 (référence 100.0 + 25 %)"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "scenarios.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'scenarios': [{'name': "x", 'steps': [], 'thresholds': {'p42_ms': 1}}]}, f)
+        try:
+            load_scenarios(path)
+            assert False, "seuil inconnu accepté"
+        except ValueError:
+            pass
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'scenarios': [{'name': "x", 'steps': [], 'thresholds': {'errors': 0}}]}, f)
+        record_baseline(path, [{'scenario': "x", 'p95_ms': 812.34, 'p99_ms': 900.0, 'rss_peak_mb': 250.0}])
+        assert load_scenarios(path)[0]['baseline'] == {'p95_ms': 812.3, 'p99_ms': 900.0, 'rss_peak_mb': 250.0}
+
+        db_path = os.path.join(tmp, "test.db")
+        test_db = OliveOilDatabase(db_path)
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        test_db.close()
+        with Server(db_path) as server:
+            with Session(server.url) as session:
+                session.rerun()
+                assert session.tree.sidebar.metric[0].value == "15"
+                apply_step(session, {'set': {"Pays": "Spain"}}, None)
+                session.rerun()
+                assert session.tree.metric[0].value == "405,000.75 €"
+                apply_step(session, {'set': {'add_country': "Loadtest", 'add_sales': 1000.0, 'add_volume': 200.0},
+                                     'click': "Ajouter"}, None)
+                session.rerun()
+                # The edit lands in the server copy, then st.rerun() shows it
+                assert session.tree.sidebar.metric[0].value == "16"
+
+            scenario = {'name': "test", 'iterations': 2, 'steps': [{'name': "pays", 'set': {"Pays": "random"}}],
+                        'thresholds': {'errors': 0, 'p50_ms': 0}}
+            summary, samples = run_scenario(server, scenario, sessions=2)
+        assert summary['reruns'] == len(samples) == 2 * 3 and summary['errors'] == 0
+        assert 0 < summary['p50_ms'] <= summary['p95_ms'] <= summary['max_ms']
+        assert summary['rss_peak_mb'] > 0
+        assert summary['breaches'] == [f"p50_ms : {summary['p50_ms']:.1f} > 0"]
+        test_db = OliveOilDatabase(db_path)
+        assert len(test_db.get_all_data()) == 15
+        test_db.close()
+        print(f"✅ {summary['reruns']} réexécutions, P95 {summary['p95_ms']:.0f} ms, RSS {summary['rss_peak_mb']:.0f} Mo")
+
+def test_live_updates():
+    """Les écritures validées sont poussées aux abonnés et appliquées au DataFrame partagé sans rechargement"""
+    import sqlite3
+    import tempfile
+    from database import OliveOilDatabase
+    from notifier import LiveFrame
+    
+    print("\n🔴 Test des mises à jour en direct")
+    print("=" * 30)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "test.db")
+        test_db = OliveOilDatabase(db_path)
+        test_db.load_data_from_csv("olive_oil_data.csv")
+        live = LiveFrame(test_db)
+        subscription = test_db.subscribe()
+        
+        # The delta is published before the write's Future resolves
+        test_db.add_sale("Greece", 2024, "Pure", 100.0, 20.0, 5.0).result()
+        deltas = subscription.drain()
+        assert [delta['kind'] for delta in deltas] == ['insert'] and len(deltas[0]['ids']) == 1
+        new_id = deltas[0]['ids'][0]
+        spain = test_db.get_all_data().query("country == 'Spain'")['id'].iloc[0]
+        test_db.update_sale(spain, "Spain", 2021, "Pure", 1.0, 1.0, 1.0).result()
+        test_db.delete_sale(new_id).result()
+        test_db.delete_sale(new_id).result()
+        deltas = subscription.drain()
+        assert [delta['kind'] for delta in deltas] == ['update', 'delete']
+        
+        # Patched in place of a full reload, and equal to it; read with the version it reflects
+        version, frame = live.frame()
+        assert version == test_db.data_version()
+        expected = test_db.get_all_data()
+        assert live.stats == {'patches': 1, 'patched_rows': 2, 'reloads': 1}
+        pd.testing.assert_frame_equal(frame.reset_index(drop=True), expected.reset_index(drop=True))
+        assert live.touches(deltas, {'country': 'Spain'}) and not live.touches(deltas, {'country': 'Italy'})
+        
+        # A write by another process shows up as a gap in the versions
+        with sqlite3.connect(db_path) as other:
+            other.execute("UPDATE sales SET year = 2020 WHERE id = ?", (int(spain),))
+            other.execute("UPDATE data_version SET version = version + 1, rewritten = version + 1")
+        test_db.add_sale("Italy", 2024, "Pure", 100.0, 20.0, 5.0).result()
+        _, frame = live.frame()
+        assert len(frame) == len(expected) + 1 and live.stats['reloads'] == 2
+        assert frame.set_index('id').loc[spain, 'year'] == 2020
+        assert live.touches(subscription.drain(), {'country': 'Spain'})
+        
+        # Callbacks of a rolled back transaction are dropped
+        published = []
+        def failing(conn):
+            test_db.writer.on_commit(lambda: published.append(True))
+            raise ValueError("rollback")
+        assert isinstance(test_db.writer.submit(failing).exception(), ValueError)
+        test_db.add_sale("Italy", 2024, "Pure", 100.0, 20.0, 5.0).result()
+        assert published == [] and len(subscription.drain()) == 1
+        print(f"✅ {live.stats['patches']} correctifs, {live.stats['reloads']} rechargements")
+        test_db.close()
+
+def test_memory_budget():
+    """Les résultats en cache restent sous le budget mémoire : évincés ou écrits en Parquet puis relus"""
+    import tempfile
+    from memory_budget import MemoryGovernor, sizeof
+    
+    print("\n🧠 Test du budget mémoire")
+    print("=" * 30)
+    
+    frame = pd.DataFrame({'country': ['Spain', 'Italy'] * 5000, 'sales': np.arange(10000, dtype=float)})
+    size = sizeof(frame.assign(key='a'))
+    with tempfile.TemporaryDirectory() as tmp:
+        governor = MemoryGovernor(budget_bytes=int(2.5 * size), spill_dir=tmp)
+        for key in ('a', 'b', 'c'):
+            governor.put(key, frame.assign(key=key))
+        
+        # The least recently used frame went to disk and comes back equal on its next get
+        stats = governor.stats()
+        assert stats['entries'] == 2 and stats['spilled_entries'] == 1 and stats['usage'] <= governor.budget_bytes
+        assert len(os.listdir(tmp)) == 1
+        pd.testing.assert_frame_equal(governor.get('a'), frame.assign(key='a'))
+        assert governor.counters['spill_hits'] == 1 and governor.stats()['spilled_entries'] == 1
+        
+        # Other values are evicted; watched caches count against the budget
+        governor.put('summary', {'text': 'x' * size})
+        governor.watch('live_sales', lambda: size)
+        assert governor.get_or_compute(('version', 'd'), lambda: frame) is frame
+        assert governor.usage() <= governor.budget_bytes and governor.counters['evictions'] >= 1
+        assert governor.get('summary') is None
+        governor.put('huge', pd.concat([frame] * 3))
+        assert governor.counters['rejected'] == 1 and governor.get('huge') is None
+        assert 'olive_oil_memory_events_total{event="spills"}' in governor.prometheus_text()
+        print(f"✅ {governor.counters['spills']} frames écrits sur disque, {governor.counters['evictions']} évincés, "
+              f"pic {governor.peak_bytes / 1e6:.1f} Mo")
+        governor.clear()
+        assert os.listdir(tmp) == [] and governor.usage() == size
+        
+        # Watched caches that can shrink give memory back, largest first; the rest is counted
+        from figure_cache import FigureCache
+        from forecasting import ForecastCache
+        figures, forecasts = FigureCache(), ForecastCache()
+        for key in range(4):
+            figures.put((1, key), b'x' * (size // 2))
+            forecasts.forecast(key, np.arange(48, dtype=float), 12, 3)
+        governor.watch('figures', lambda: figures.nbytes, figures.shrink)
+        governor.watch('forecasts', lambda: forecasts.nbytes, forecasts.shrink)
+        assert governor.usage() > governor.budget_bytes
+        governor.enforce()
+        assert governor.usage() <= governor.budget_bytes and governor.counters['shrinks'] == 1
+        assert figures.get((1, 0)) is None and figures.get((1, 3)) is not None
+        assert forecasts.nbytes > 0
+        governor.watch('live_sales', lambda: 2 * governor.budget_bytes)
+        governor.enforce()
+        assert figures.nbytes == forecasts.nbytes == 0 and governor.counters['over_budget'] == 1
+
 if __name__ == "__main__":
     print("🚀 Démarrage des tests...")
     
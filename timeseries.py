@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import track
+
+# Engines kept by TimeSeriesCache (one per database, segments, measure and filters)
+DEFAULT_MAX_ENTRIES = 64
+
+# Resampling frequencies: numpy calendar unit and periods per year (for YoY)
+FREQUENCIES = {
+    'M': ('datetime64[M]', 12),
+    'Q': ('datetime64[M]', 4),
+    'Y': ('datetime64[Y]', 1),
+}
+
+def _period_ids(days, freq):
+    """Calendar period number of each day (months, quarters or years since 1970)"""
+    unit, _ = FREQUENCIES[freq]
+    ids = days.astype(unit).astype(np.int64)
+    return ids // 3 if freq == 'Q' else ids
+
+def _period_start(period_id, freq):
+    if freq == 'Q':
+        return np.datetime64(int(period_id) * 3, 'M').astype('datetime64[D]')
+    unit = 'M' if freq == 'M' else 'Y'
+    return np.datetime64(int(period_id), unit).astype('datetime64[D]')
+
+class TimeSeriesEngine:
+    """Dense day × segment matrix with vectorized resampling and rolling windows
+    
+    Windows are derived from cached running sums and period sums. Both
+    caches remember up to which day they are valid, so appending new days
+    (or replacing the last, partial one) only recomputes the tail.
+    """
+    
+    def __init__(self, start, values, segments, names):
+        self.start = np.datetime64(start, 'D')
+        self.values = values
+        self.segments = segments
+        self.names = list(names)
+        # Cache name -> (number of valid days, cached arrays)
+        self._caches = {}
+    
+    @staticmethod
+    def _daily_matrix(frame, segments, start, days, names, value):
+        day = (frame['sale_date'].to_numpy().astype('datetime64[D]') - start).astype(np.int64)
+        if names:
+            codes = segments.get_indexer(pd.MultiIndex.from_frame(frame[names]))
+        else:
+            codes = np.zeros(len(frame), dtype=np.int64)
+        flat = np.bincount(day * len(segments) + codes, weights=frame[value].to_numpy(dtype=np.float64),
+                           minlength=days * len(segments))
+        return flat.reshape(days, len(segments))
+    
+    @classmethod
+    def from_frame(cls, frame, by=('country', 'type'), value='sales'):
+        """Build from rows (raw or already summed per day) with a sale_date column"""
+        names = list(by)
+        frame = frame.dropna(subset=['sale_date'])
+        frame = frame.assign(sale_date=pd.to_datetime(frame['sale_date']))
+        dates = frame['sale_date'].to_numpy().astype('datetime64[D]')
+        start = dates.min()
+        days = int((dates.max() - start).astype(np.int64)) + 1
+        if names:
+            segments = pd.MultiIndex.from_frame(frame[names]).unique().sort_values()
+        else:
+            segments = pd.MultiIndex.from_tuples([('total',)], names=['segment'])
+        values = cls._daily_matrix(frame, segments, start, days, names, value)
+        return cls(start, values, segments, names)
+    
+    def copy(self):
+        """Engine sharing this one's arrays and caches; update() on the copy leaves this one untouched
+        
+        Arrays are never modified in place (update and the caches build
+        new ones), so sharing them is safe.
+        """
+        engine = TimeSeriesEngine(self.start, self.values, self.segments, self.names)
+        engine._caches = dict(self._caches)
+        return engine
+    
+    @property
+    def nbytes(self):
+        """Bytes of the day matrix and of the cached arrays"""
+        return self.values.nbytes + sum(array.nbytes for _, arrays in self._caches.values() for array in arrays)
+    
+    @property
+    def days(self):
+        return pd.DatetimeIndex(self.start + np.arange(len(self.values)))
+    
+    @property
+    def end(self):
+        return self.start + len(self.values) - 1
+    
+    def update(self, frame, value='sales'):
+        """Replace every day from the first day of frame onwards with its rows
+        
+        frame holds the complete rows of those days (e.g. re-aggregated from
+        the database since the first new sale date). Earlier days and the
+        caches computed over them are kept.
+        """
+        frame = frame.dropna(subset=['sale_date'])
+        if frame.empty:
+            return self
+        frame = frame.assign(sale_date=pd.to_datetime(frame['sale_date']))
+        dates = frame['sale_date'].to_numpy().astype('datetime64[D]')
+        first = int((dates.min() - self.start).astype(np.int64))
+        if first < 0:
+            raise ValueError("update() only accepts days on or after the start of the series")
+        
+        # New segments get zero history
+        if self.names:
+            new_segments = pd.MultiIndex.from_frame(frame[self.names]).unique().difference(self.segments)
+            if len(new_segments):
+                self.segments = self.segments.append(new_segments)
+                self._widen(len(new_segments))
+        
+        days = int((dates.max() - self.start).astype(np.int64)) + 1
+        tail = self._daily_matrix(frame, self.segments, self.start + first, days - first, self.names, value)
+        # Days without sales between the old end and the new rows are zeros
+        gap = np.zeros((max(first - len(self.values), 0), len(self.segments)))
+        self.values = np.concatenate([self.values[:first], gap, tail])
+        for name, (valid, arrays) in self._caches.items():
+            self._caches[name] = (min(valid, first), arrays)
+        return self
+    
+    def _widen(self, count):
+        """Add zero columns for new segments to the values and every cache"""
+        pad = lambda array: np.concatenate([array, np.zeros((len(array), count))], axis=1)
+        self.values = pad(self.values)
+        for name, (valid, arrays) in self._caches.items():
+            self._caches[name] = (valid, tuple(pad(array) if array.ndim == 2 else array for array in arrays))
+    
+    def cumulative(self):
+        """Running sums with a leading zero row: window sums are differences of two rows"""
+        valid, arrays = self._caches.get('cumsum', (0, (np.zeros((1, self.values.shape[1])),)))
+        cumsum, = arrays
+        if valid < len(self.values) or len(cumsum) != len(self.values) + 1:
+            with track("timeseries.cumsum") as info:
+                tail = cumsum[valid] + np.cumsum(self.values[valid:], axis=0)
+                cumsum = np.concatenate([cumsum[:valid + 1], tail])
+                info['rows'] = len(tail)
+            self._caches['cumsum'] = (len(self.values), (cumsum,))
+        return cumsum
+    
+    def resample(self, freq='M'):
+        """Sum per calendar period: DataFrame indexed by period start, one column per segment"""
+        empty = (np.empty(0, dtype=np.int64), np.empty((0, self.values.shape[1])))
+        valid, arrays = self._caches.get(freq, (0, empty))
+        period_ids, sums = arrays
+        if valid < len(self.values) or not len(period_ids):
+            with track(f"timeseries.resample_{freq}") as info:
+                day_ids = _period_ids(self.start + np.arange(len(self.values)), freq)
+                # Recompute from the period holding the first invalid day
+                keep = np.searchsorted(period_ids, day_ids[valid]) if valid < len(day_ids) else len(period_ids)
+                first_day = np.searchsorted(day_ids, period_ids[keep]) if keep < len(period_ids) else valid
+                boundaries = np.flatnonzero(np.diff(day_ids[first_day:], prepend=np.int64(-1 << 62))) + first_day
+                tail_sums = np.add.reduceat(self.values[first_day:], boundaries - first_day, axis=0)
+                period_ids = np.concatenate([period_ids[:keep], day_ids[boundaries]])
+                sums = np.concatenate([sums[:keep], tail_sums])
+                info['rows'] = len(self.values) - first_day
+            self._caches[freq] = (len(self.values), (period_ids, sums))
+        index = pd.DatetimeIndex([_period_start(period_id, freq) for period_id in period_ids])
+        return pd.DataFrame(sums, index=index, columns=self.segments)
+    
+    def rolling_mean(self, window=30):
+        """Trailing moving average over window days (NaN until the window is full)"""
+        cumsum = self.cumulative()
+        means = np.full(self.values.shape, np.nan)
+        if window <= len(self.values):
+            means[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+        return pd.DataFrame(means, index=self.days, columns=self.segments)
+    
+    def yoy(self, freq='M'):
+        """Growth (%) of each period against the same period one year earlier"""
+        periods = self.resample(freq)
+        lag = FREQUENCIES[freq][1]
+        previous = periods.shift(lag)
+        return (periods - previous) / previous.where(previous != 0) * 100
+
+class TimeSeriesCache:
+    """One engine per (database, segments, measure, filters), kept fresh across reruns
+    
+    When only inserts happened since an engine was built, the days from the
+    first new sale date on are re-aggregated into a copy of it; an update,
+    delete or reload triggers a full rebuild. Engines handed out are never
+    modified, so sessions may keep reading them while a newer one is built.
+    The least recently used engines beyond max_entries are dropped, and
+    shrink() drops more of them for the memory governor.
+    """
+    
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, database, by=('country', 'type'), measure='sales', filters=None):
+        filters = filters or {}
+        key = (database.db_path, tuple(by), measure, tuple(sorted(filters.items())))
+        version, rewritten = database.data_versions()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None and entry['version'] == version:
+            return entry['engine']
+        
+        last_id = database.max_sale_id()
+        since = None
+        if entry is not None and entry['engine'] is not None and rewritten <= entry['version']:
+            since = database.first_sale_date_after(entry['last_id'])
+            appended = since is None or np.datetime64(since, 'D') >= entry['engine'].start
+        else:
+            appended = False
+        
+        if appended:
+            engine = entry['engine']
+            if since is not None:
+                engine = engine.copy().update(database.daily_sales(by, measure, filters, since=since), measure)
+        else:
+            daily = database.daily_sales(by, measure, filters)
+            engine = TimeSeriesEngine.from_frame(daily, by, measure) if not daily.empty else None
+        with self._lock:
+            self._entries[key] = {'engine': engine, 'version': version, 'last_id': last_id}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return engine
+    
+    @property
+    def nbytes(self):
+        with self._lock:
+            engines = [entry['engine'] for entry in self._entries.values() if entry['engine'] is not None]
+        return sum(engine.nbytes for engine in engines)
+    
+    def shrink(self, nbytes):
+        """Drop least recently used engines until nbytes are freed (or none is left); returns the bytes freed"""
+        freed = 0
+        with self._lock:
+            while self._entries and freed < nbytes:
+                _, entry = self._entries.popitem(last=False)
+                freed += entry['engine'].nbytes if entry['engine'] is not None else 0
+        return freed
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# Shared by every AdvancedAnalytics instance so engines survive Streamlit reruns
+cache = TimeSeriesCache()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from instrumentation import metrics
+
+class WriteQueueFull(RuntimeError):
+    """Raised when the write queue stays full longer than the submit timeout"""
+
+class SingleWriter:
+    """Dedicated writer thread that group-commits queued write requests
+    
+    Every write of the process goes through one connection owned by this
+    thread. Requests arriving within batch_window seconds of each other are
+    committed together, so concurrent sessions share one transaction (and
+    one fsync) instead of fighting over the database lock.
+    """
+    
+    def __init__(self, backend, max_queue=1000, max_batch=256, batch_window=0.005, submit_timeout=5.0):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.submit_timeout = submit_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._on_commit = []
+        self.stats = {'requests': 0, 'batches': 0, 'failed': 0, 'failed_callbacks': 0}
+    
+    def start(self):
+        """Start the writer thread if it is not running yet"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        return self
+    
+    def submit(self, func):
+        """Queue func(conn) and return a Future with its result
+        
+        Blocks for at most submit_timeout seconds when the queue is full
+        (backpressure), then raises WriteQueueFull.
+        """
+        self.start()
+        future = Future()
+        try:
+            self._queue.put((func, future), timeout=self.submit_timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"Write queue full ({self._queue.maxsize} pending requests)") from None
+        return future
+    
+    def execute(self, sql, params=()):
+        """Queue a single statement; the Future resolves to the affected row count"""
+        return self.submit(lambda conn: self.backend.execute(conn, sql, params).rowcount)
+    
+    def on_commit(self, callback):
+        """Run callback() once the transaction of the running request commits
+        
+        Only valid from a queued func(conn), on the writer thread. Callbacks
+        run before the Futures of the batch resolve, so a caller waiting on
+        its write also sees their effects; they are dropped on rollback.
+        """
+        self._on_commit.append(callback)
+    
+    def _committed(self):
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
+            # The data is committed either way: a failing callback must not strand the Futures
+            try:
+                callback()
+            except Exception:
+                self.stats['failed_callbacks'] += 1
+    
+    def flush(self, timeout=None):
+        """Wait until every request queued so far is committed"""
+        return self.submit(lambda conn: None).result(timeout)
+    
+    def close(self):
+        """Commit pending requests and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._queue.put(None)
+            thread.join()
+    
+    @property
+    def pending(self):
+        return self._queue.qsize()
+    
+    def _next_batch(self, first):
+        """Collect requests arriving within the batch window after the first one"""
+        batch = [first]
+        deadline = time.perf_counter() + self.batch_window
+        stop = False
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+    
+    def _run(self):
+        conn = self.backend.connect()
+        self.backend.configure_writer(conn)
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    break
+                batch, stop = self._next_batch(first)
+                self._commit(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+    
+    def _commit(self, conn, batch):
+        """Run a batch in one transaction; on failure retry each request alone"""
+        batch = [(func, future) for func, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        with metrics.track("db.group_commit") as info:
+            info['rows'] = len(batch)
+            try:
+                self.backend.begin_write(conn)
+                results = [func(conn) for func, _ in batch]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                self._on_commit = []
+                self._commit_one_by_one(conn, batch)
+                return
+        self._committed()
+        self.stats['requests'] += len(batch)
+        self.stats['batches'] += 1
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+    
+    def _commit_one_by_one(self, conn, batch):
+        for func, future in batch:
+            try:
+                self.backend.begin_write(conn)
+                result = func(conn)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                self._on_commit = []
+                self.stats['failed'] += 1
+                future.set_exception(e)
+            else:
+                self._committed()
+                future.set_result(result)
+            self.stats['requests'] += 1
+            self.stats['batches'] += 1